@@ -1,8 +1,11 @@
 import os.path
+from datetime import datetime, timezone
 from django.conf import settings
 from django.test import TestCase, Client
+from yt_dlp.utils import LazyList
 from .testutils import prevent_request_warnings
-from .utils import parse_database_connection_string, clean_filename
+from .utils import (parse_database_connection_string, clean_filename, json_dumps,
+                    json_loads, JSON_CODECS)
 from .errors import DatabaseConnectionError
 
 
@@ -135,3 +138,36 @@ class UtilsTestCase(TestCase):
         self.assertEqual(clean_filename('a  a'), 'a  a')
         self.assertEqual(clean_filename('a\t\t\ta'), 'a   a')
         self.assertEqual(clean_filename('a\t\t\ta\t\t\t'), 'a   a')
+
+    def test_json_codecs(self):
+        data = {
+            'str': 'test \u2764',
+            'int': 1,
+            'big_int': 2 ** 70,
+            'float': 1.5,
+            'list': [1, None, True],
+            'datetime': datetime(2020, 1, 2, 3, 4, 5, 6),
+            'aware_datetime': datetime(2020, 1, 2, 3, 4, 5, tzinfo=timezone.utc),
+            'lazylist': LazyList(iter(['a', 'b'])),
+        }
+        expected = {
+            'str': 'test \u2764',
+            'int': 1,
+            'big_int': 2 ** 70,
+            'float': 1.5,
+            'list': [1, None, True],
+            'datetime': '2020-01-02T03:04:05.000006',
+            'aware_datetime': '2020-01-02T03:04:05+00:00',
+            'lazylist': ['a', 'b'],
+        }
+        self.assertIn('json', JSON_CODECS)
+        for codec in JSON_CODECS:
+            data['lazylist'] = LazyList(iter(['a', 'b']))
+            encoded = json_dumps(data, codec=codec)
+            self.assertIsInstance(encoded, str)
+            for decode_codec in JSON_CODECS:
+                self.assertEqual(json_loads(encoded, codec=decode_codec), expected)
+            self.assertEqual(json_loads('{"a": NaN}', codec=codec).keys(), {'a'})
+            with self.assertRaises(TypeError):
+                json_dumps({'a': object()}, codec=codec)
+        self.assertEqual(json_loads(json_dumps(data)), expected)
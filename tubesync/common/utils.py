@@ -1,8 +1,13 @@
+import json
 import string
 from datetime import datetime
 from urllib.parse import urlunsplit, urlencode, urlparse
 from yt_dlp.utils import LazyList
 from .errors import DatabaseConnectionError
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def parse_database_connection_string(database_connection_string):
@@ -129,3 +134,58 @@ def json_serial(obj):
     if isinstance(obj, LazyList):
         return list(obj)
     raise TypeError(f'Type {type(obj)} is not json_serial()-able')
+
+
+def stdlib_json_dumps(obj):
+    return json.dumps(obj, default=json_serial)
+
+
+def stdlib_json_loads(data):
+    return json.loads(data)
+
+
+# Datetimes are passed to json_serial() so they are encoded the same as the stdlib
+ORJSON_OPTIONS = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+                  if orjson else 0)
+
+
+def orjson_dumps(obj):
+    try:
+        return orjson.dumps(obj, default=json_serial, option=ORJSON_OPTIONS).decode()
+    except TypeError:
+        # orjson is stricter than the stdlib, for example with integers over 64 bits
+        return stdlib_json_dumps(obj)
+
+
+def orjson_loads(data):
+    try:
+        return orjson.loads(data)
+    except ValueError:
+        # orjson is stricter than the stdlib, for example with NaN values
+        return stdlib_json_loads(data)
+
+
+# Available JSON codecs as name: (dumps, loads), the first available is the default
+JSON_CODECS = {}
+if orjson:
+    JSON_CODECS['orjson'] = (orjson_dumps, orjson_loads)
+JSON_CODECS['json'] = (stdlib_json_dumps, stdlib_json_loads)
+DEFAULT_JSON_CODEC = next(iter(JSON_CODECS))
+
+
+def json_dumps(obj, codec=DEFAULT_JSON_CODEC):
+    '''
+        Encodes obj as a JSON string with the named codec, by default the fastest
+        installed codec. Types the stdlib can't encode are passed to json_serial().
+    '''
+    dumps, _ = JSON_CODECS[codec]
+    return dumps(obj)
+
+
+def json_loads(data, codec=DEFAULT_JSON_CODEC):
+    '''
+        Decodes a JSON string with the named codec, by default the fastest installed
+        codec.
+    '''
+    _, loads = JSON_CODECS[codec]
+    return loads(data)
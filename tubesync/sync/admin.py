@@ -16,9 +16,10 @@ class SourceAdmin(admin.ModelAdmin):
 class MediaAdmin(admin.ModelAdmin):
 
     ordering = ('-created',)
-    list_display = ('uuid', 'key', 'source', 'can_download', 'skip', 'downloaded')
+    list_display = ('uuid', 'key', 'title', 'source', 'can_download', 'skip',
+                    'downloaded')
     readonly_fields = ('uuid', 'created')
-    search_fields = ('uuid', 'source__key', 'key')
+    search_fields = ('uuid', 'source__key', 'key', 'title')
 
 
 @admin.register(MediaServer)
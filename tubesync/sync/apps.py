@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class SyncConfig(AppConfig):
 
     name = 'sync'
+
+    def ready(self):
+        # Connect the signal receivers in every process, not only the web server
+        from . import signals
@@ -0,0 +1,55 @@
+'''
+    Reads the feeds of recent uploads YouTube publishes for channels and playlists.
+    Fetching a feed is far cheaper than indexing a source with youtube-dl so they
+    are used to check if a source has any new media before indexing it.
+'''
+
+
+from xml.etree import ElementTree
+import requests
+from django.conf import settings
+
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+YOUTUBE_NS = '{http://www.youtube.com/xml/schemas/2015}'
+
+
+class FeedError(Exception):
+    '''
+        Raised when a feed could not be fetched or parsed.
+    '''
+    pass
+
+
+def fetch_feed(url):
+    '''
+        The default feed fetcher, gets the feed at "url" over HTTP and returns the
+        response body as bytes.
+    '''
+    timeout = getattr(settings, 'INDEX_FEED_TIMEOUT', 10)
+    r = requests.get(url, timeout=timeout)
+    r.raise_for_status()
+    return r.content
+
+
+def get_feed_media_keys(url, fetcher=fetch_feed):
+    '''
+        Returns a list of the IDs of the media in the feed at "url", newest first.
+        "fetcher" is called with the URL and must return the body of the feed.
+        Raises FeedError if the feed could not be fetched or parsed.
+    '''
+    try:
+        body = fetcher(url)
+    except Exception as e:
+        # Fetchers are pluggable so any error means the feed couldn't be fetched
+        raise FeedError(f'Failed to fetch feed "{url}": {e}') from e
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError as e:
+        raise FeedError(f'Failed to parse feed "{url}": {e}') from e
+    keys = []
+    for entry in root.iter(f'{ATOM_NS}entry'):
+        video_id = entry.find(f'{YOUTUBE_NS}videoId')
+        if video_id is not None and video_id.text:
+            keys.append(video_id.text.strip())
+    return keys
@@ -0,0 +1,272 @@
+'''
+    An in-memory index of the files present under MEDIA_ROOT and DOWNLOAD_ROOT. These
+    can be on network mounted volumes where checking each file exists is slow, so the
+    directories are swept with os.scandir() in a background thread every
+    FILE_INDEX_MAX_AGE seconds and, if enabled with FILE_INDEX_INOTIFY, kept up to
+    date with inotify in between. Checking a file exists is then a set lookup.
+'''
+
+
+import os
+import time
+import threading
+from django.conf import settings
+from common.logger import log
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+class FileIndex:
+    '''
+        Index of the files present under a set of root directories. Files found in
+        the index are assumed to exist, files not found in it are checked on disk
+        unless the caller only wants to trust the index.
+    '''
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.refresh_lock = threading.Lock()
+        self.roots = ()
+        self.files = set()
+        self.refreshed = None
+        # Files added and discarded while a sweep is running, replayed on the swept
+        # files so they aren't lost when the index is replaced
+        self.changes = None
+        self.watching = False
+        self.inotify = None
+        self.watches = {}
+        self.watched = set()
+
+    def get_roots(self):
+        roots = (settings.MEDIA_ROOT, settings.DOWNLOAD_ROOT)
+        return tuple(os.path.abspath(str(root)) for root in roots)
+
+    def is_indexed(self, path, roots=None):
+        '''
+            Returns True if "path" is under one of the indexed root directories.
+        '''
+        for root in (self.roots if roots is None else roots):
+            if path == root or path.startswith(f'{root}{os.sep}'):
+                return True
+        return False
+
+    def sweep(self, directory):
+        '''
+            Returns a tuple of (files, directories) found under "directory".
+        '''
+        files, directories = set(), [directory]
+        pending = [directory]
+        while pending:
+            try:
+                entries = os.scandir(pending.pop())
+            except OSError:
+                continue
+            with entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(entry.path)
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            files.add(entry.path)
+                    except OSError:
+                        continue
+        return files, directories
+
+    def refresh(self):
+        '''
+            Sweeps the root directories and replaces the index with the files found,
+            waiting for any sweep already running to finish first. Returns a tuple of
+            the sets of (added, removed) file paths, where removed files are stale
+            entries for files which have been deleted since the last sweep without
+            the index being told.
+        '''
+        with self.refresh_lock:
+            return self.rebuild()
+
+    def refresh_in_background(self):
+        '''
+            Starts a sweep in a background thread unless one is already running.
+            The current index is used until the sweep finishes. Returns True if a
+            sweep was started.
+        '''
+        if not self.refresh_lock.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                self.rebuild()
+            except Exception as e:
+                log.error(f'Failed to refresh the file index: {e}')
+            finally:
+                self.refresh_lock.release()
+
+        thread = threading.Thread(target=run, name='file-index', daemon=True)
+        thread.start()
+        return True
+
+    def rebuild(self):
+        roots = self.get_roots()
+        start = time.monotonic()
+        with self.lock:
+            self.changes = []
+        try:
+            files, directories = set(), []
+            for root in roots:
+                root_files, root_directories = self.sweep(root)
+                files |= root_files
+                directories.extend(root_directories)
+            with self.lock:
+                for exists, path in self.changes:
+                    if not exists:
+                        files.discard(path)
+                    elif self.is_indexed(path, roots):
+                        files.add(path)
+                if roots == self.roots:
+                    added, removed = files - self.files, self.files - files
+                else:
+                    added, removed = files, set()
+                self.roots = roots
+                self.files = files
+                self.refreshed = time.monotonic()
+                if self.inotify:
+                    for directory in directories:
+                        self.watch(directory)
+        finally:
+            with self.lock:
+                self.changes = None
+        log.info(f'Indexed {len(files)} files in {time.monotonic() - start:.1f}s, '
+                 f'{len(added)} new files found')
+        if removed:
+            log.info(f'Removed {len(removed)} stale files from the file index which '
+                     f'no longer exist')
+            for path in sorted(removed):
+                log.debug(f'Stale file removed from the file index: {path}')
+        return added, removed
+
+    def is_ready(self):
+        '''
+            Returns True if the index has been built for the current root directories.
+        '''
+        return self.refreshed is not None and self.roots == self.get_roots()
+
+    def is_stale(self):
+        if not self.is_ready():
+            return True
+        max_age = getattr(settings, 'FILE_INDEX_MAX_AGE', 0)
+        return time.monotonic() - self.refreshed > max_age
+
+    def exists(self, path, verify=True):
+        '''
+            Returns True if the file at "path" exists. Files outside the indexed
+            directories, every file until the index has first been built, or every
+            file if FILE_INDEX_MAX_AGE is 0, are checked on disk. If "verify" is set
+            files missing from the index are checked on disk as well in case they
+            were created by another process since the last sweep. Stale indexes are
+            refreshed in the background and used until the sweep finishes.
+        '''
+        path = os.path.abspath(str(path))
+        if getattr(settings, 'FILE_INDEX_MAX_AGE', 0) <= 0:
+            return os.path.isfile(path)
+        if self.is_stale():
+            self.refresh_in_background()
+        if not self.is_ready() or not self.is_indexed(path):
+            return os.path.isfile(path)
+        if path in self.files:
+            return True
+        if verify and os.path.isfile(path):
+            self.add(path)
+            return True
+        return False
+
+    def add(self, path):
+        path = os.path.abspath(str(path))
+        with self.lock:
+            if self.changes is not None:
+                self.changes.append((True, path))
+            if self.is_indexed(path):
+                self.files.add(path)
+
+    def discard(self, path):
+        path = os.path.abspath(str(path))
+        with self.lock:
+            if self.changes is not None:
+                self.changes.append((False, path))
+            self.files.discard(path)
+
+    def watch(self, directory):
+        if directory in self.watched:
+            return
+        try:
+            wd = self.inotify.add_watch(directory, self.watch_flags)
+        except OSError as e:
+            log.error(f'Failed to watch directory for file changes: {directory}: {e}')
+            return
+        self.watches[wd] = directory
+        self.watched.add(directory)
+
+    def start_watching(self):
+        '''
+            Starts a thread which keeps the index up to date with inotify between
+            sweeps. Returns False if inotify is not available.
+        '''
+        with self.lock:
+            if self.watching:
+                return bool(self.inotify)
+            self.watching = True
+            if inotify_simple is None:
+                log.warn('FILE_INDEX_INOTIFY is enabled but the inotify_simple '
+                         'package is not installed, the file index is only updated '
+                         'by sweeps')
+                return False
+            flags = inotify_simple.flags
+            self.watch_flags = (flags.CREATE | flags.CLOSE_WRITE | flags.DELETE |
+                                flags.MOVED_FROM | flags.MOVED_TO)
+            self.inotify = inotify_simple.INotify()
+        # A sweep which is already running adds the watches when it finishes
+        self.refresh_in_background()
+        thread = threading.Thread(target=self.watch_events, daemon=True)
+        thread.start()
+        return True
+
+    def watch_events(self):
+        flags = inotify_simple.flags
+        while True:
+            for event in self.inotify.read():
+                directory = self.watches.get(event.wd)
+                if not directory or not event.name:
+                    continue
+                path = os.path.join(directory, event.name)
+                if event.mask & flags.ISDIR:
+                    if event.mask & (flags.CREATE | flags.MOVED_TO):
+                        # Index and watch new directories
+                        files, directories = self.sweep(path)
+                        with self.lock:
+                            for new_file in files:
+                                self.add(new_file)
+                            for new_directory in directories:
+                                self.watch(new_directory)
+                    elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                        with self.lock:
+                            prefix = f'{path}{os.sep}'
+                            for old_file in [f for f in self.files
+                                             if f.startswith(prefix)]:
+                                self.discard(old_file)
+                elif event.mask & (flags.CREATE | flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self.add(path)
+                elif event.mask & (flags.DELETE | flags.MOVED_FROM):
+                    self.discard(path)
+
+
+file_index = FileIndex()
+
+
+def file_exists(path, verify=True):
+    '''
+        Returns True if the file at "path" exists, using the file index.
+    '''
+    if getattr(settings, 'FILE_INDEX_INOTIFY', False) and not file_index.watching:
+        file_index.start_watching()
+    return file_index.exists(path, verify=verify)
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from common.logger import log
+from sync.models import Media
+
+
+class Command(BaseCommand):
+
+    help = ('Copies commonly used fields such as the title and duration out of the '
+            'stored metadata of existing media into their own database columns')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', action='store', type=int, default=500,
+                            help='Number of media items to update at once')
+        parser.add_argument('--all', action='store_true', default=False,
+                            help='Update all media, not just media without a title')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        log.info('Backfilling media fields from metadata...')
+        q = Media.objects.filter(has_metadata=True)
+        if not options['all']:
+            q = q.filter(title='')
+        media_pks = list(q.values_list('pk', flat=True))
+        log.info(f'Found {len(media_pks)} media items to update')
+        update_fields = Media.METADATA_COPIED_FIELDS + ('published',)
+        updated = 0
+        for i in range(0, len(media_pks), batch_size):
+            batch = []
+            chunk = media_pks[i:i + batch_size]
+            for media in Media.objects.filter(pk__in=chunk).select_related(
+                    'source', 'media_metadata'):
+                media.copy_metadata_fields()
+                if not media.published:
+                    upload_date = media.upload_date
+                    if upload_date:
+                        media.published = timezone.make_aware(upload_date)
+                batch.append(media)
+            Media.objects.bulk_update(batch, update_fields)
+            updated += len(batch)
+            log.info(f'Updated {updated} of {len(media_pks)} media items')
+        log.info('Done')
@@ -0,0 +1,49 @@
+from pathlib import Path
+from timeit import Timer
+from django.core.management.base import BaseCommand, CommandError
+from common.utils import JSON_CODECS, DEFAULT_JSON_CODEC, json_dumps, json_loads
+
+
+TESTDATA_DIR = Path(__file__).resolve().parent.parent.parent / 'testdata'
+
+
+class Command(BaseCommand):
+
+    help = ('Benchmarks encoding and decoding the metadata test fixtures with each '
+            'installed JSON codec')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', action='store', type=int, default=200,
+                            help='Number of times to encode and decode each fixture')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+        fixtures = sorted(TESTDATA_DIR.glob('metadata*.json'))
+        if not fixtures:
+            raise CommandError(f'No metadata fixtures found in: {TESTDATA_DIR}')
+        self.stdout.write(f'Installed JSON codecs: {", ".join(JSON_CODECS)} '
+                          f'(default: {DEFAULT_JSON_CODEC}), {iterations} iterations')
+        totals = {}
+        for fixture in fixtures:
+            data = fixture.read_text()
+            decoded = json_loads(data, codec='json')
+            self.stdout.write(f'{fixture.name} ({len(data)} bytes):')
+            for codec in JSON_CODECS:
+                encode = Timer(lambda: json_dumps(decoded, codec=codec))
+                decode = Timer(lambda: json_loads(data, codec=codec))
+                # Per operation times in microseconds
+                encode_us = encode.timeit(iterations) / iterations * 1000000
+                decode_us = decode.timeit(iterations) / iterations * 1000000
+                total_encode, total_decode = totals.get(codec, (0, 0))
+                totals[codec] = (total_encode + encode_us, total_decode + decode_us)
+                self.stdout.write(f'  {codec:>8}: encode {encode_us:10.1f}us  '
+                                  f'decode {decode_us:10.1f}us')
+        self.stdout.write('Total per pass over all fixtures:')
+        baseline_encode, baseline_decode = totals['json']
+        for codec, (encode_us, decode_us) in totals.items():
+            self.stdout.write(f'  {codec:>8}: encode {encode_us:10.1f}us '
+                              f'({baseline_encode / encode_us:.1f}x)  '
+                              f'decode {decode_us:10.1f}us '
+                              f'({baseline_decode / decode_us:.1f}x)')
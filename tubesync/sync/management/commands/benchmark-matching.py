@@ -0,0 +1,135 @@
+import sys
+import itertools
+from pathlib import Path
+from timeit import Timer
+from django.core.management.base import BaseCommand, CommandError
+from common.utils import json_dumps, json_loads
+from sync.models import Source, Media
+from sync.matching import (get_best_combined_format, get_best_audio_format,
+                           get_best_video_format)
+from sync.utils import parse_media_format
+from sync.testutils import random_formats
+
+
+TESTDATA_DIR = Path(__file__).resolve().parent.parent.parent / 'testdata'
+
+
+def source_profiles():
+    '''
+        Returns every combination of the source settings which affect matching.
+    '''
+    return list(itertools.product(
+        Source.SOURCE_RESOLUTIONS, Source.SOURCE_VCODECS, Source.SOURCE_ACODECS,
+        (True, False), (True, False), Source.FALLBACKS))
+
+
+def apply_profile(source, profile):
+    (source.source_resolution, source.source_vcodec, source.source_acodec,
+     source.prefer_60fps, source.prefer_hdr, source.fallback) = profile
+
+
+def get_format_str(media):
+    # Clear the stored match so the formats are matched on every call
+    media.matched_format_key = ''
+    return media.get_format_str()
+
+
+# Functions timed once per source profile, called with a Media instance
+PROFILE_FUNCTIONS = {
+    'get_format_str': get_format_str,
+    'get_best_combined_format': get_best_combined_format,
+    'get_best_audio_format': get_best_audio_format,
+    'get_best_video_format': get_best_video_format,
+}
+# Functions timed once per format, independent of the source profile
+FORMAT_FUNCTIONS = {
+    'parse_media_format': parse_media_format,
+}
+FUNCTIONS = tuple(PROFILE_FUNCTIONS) + tuple(FORMAT_FUNCTIONS)
+
+
+class Command(BaseCommand):
+
+    help = ('Benchmarks format matching and parsing for every source profile against '
+            'the metadata test fixtures and large random format lists')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', action='store', type=int, default=5,
+                            help='Number of times to run each function per profile')
+        parser.add_argument('--sizes', action='store', type=str, default='64,128,256',
+                            help='Comma separated sizes of random format lists')
+        parser.add_argument('--functions', action='store', type=str,
+                            default=','.join(FUNCTIONS),
+                            help=f'Comma separated functions to time, from: '
+                                 f'{", ".join(FUNCTIONS)}')
+        parser.add_argument('--json', action='store_true', default=False,
+                            help='Output the results as JSON')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if iterations < 1:
+            raise CommandError('--iterations must be at least 1')
+        try:
+            sizes = [int(s) for s in options['sizes'].split(',') if s.strip()]
+        except ValueError as e:
+            raise CommandError(f'--sizes must be a list of integers: {e}') from e
+        functions = [f.strip() for f in options['functions'].split(',') if f.strip()]
+        for function in functions:
+            if function not in FUNCTIONS:
+                raise CommandError(f'Unknown function: {function}, must be one of: '
+                                   f'{", ".join(FUNCTIONS)}')
+        format_lists = {}
+        for fixture in sorted(TESTDATA_DIR.glob('metadata*.json')):
+            format_lists[fixture.name] = json_loads(fixture.read_text())['formats']
+        for size in sizes:
+            format_lists[f'random-{size}'] = random_formats(size, seed=size)
+        source = Source()
+        profiles = source_profiles()
+        results = []
+        for name, formats in format_lists.items():
+            media = Media(source=source)
+            media.metadata = json_dumps({'formats': formats})
+            # Parse the formats before timing
+            media.parsed_formats
+            for function in functions:
+                if function in FORMAT_FUNCTIONS:
+                    func = FORMAT_FUNCTIONS[function]
+
+                    def run():
+                        for f in formats:
+                            func(f)
+
+                    calls = len(formats)
+                else:
+                    func = PROFILE_FUNCTIONS[function]
+
+                    def run():
+                        for profile in profiles:
+                            apply_profile(source, profile)
+                            func(media)
+
+                    calls = len(profiles)
+                elapsed = Timer(run).timeit(iterations)
+                results.append({
+                    'formats_name': name,
+                    'formats': len(formats),
+                    'function': function,
+                    'calls': calls * iterations,
+                    'total_seconds': round(elapsed, 6),
+                    'per_call_us': round(elapsed / iterations / calls * 1000000, 3),
+                })
+        if options['json']:
+            self.stdout.write(json_dumps({
+                'python': sys.version.split()[0],
+                'iterations': iterations,
+                'profiles': len(profiles),
+                'results': results,
+            }))
+            return
+        self.stdout.write(f'{len(profiles)} source profiles, {iterations} iterations, '
+                          f'times are per call')
+        for result in results:
+            self.stdout.write(f'{result["formats_name"]:>30} '
+                              f'({result["formats"]:>3} formats) '
+                              f'{result["function"]:>24}: '
+                              f'{result["per_call_us"]:8.1f}us')
@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from common.logger import log
+from sync.models import MediaMetadata
+from sync.utils import METADATA_CODECS, get_metadata_codec
+
+
+class Command(BaseCommand):
+
+    help = ('Converts the stored metadata of existing media to the configured '
+            'compression codec in batches and reports the space reclaimed')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--codec', action='store', type=str, default=None,
+                            help=(f'Codec to convert metadata to, one of '
+                                  f'{METADATA_CODECS} or "none" to decompress, '
+                                  f'defaults to MEDIA_METADATA_COMPRESSION'))
+        parser.add_argument('--batch-size', action='store', type=int, default=250,
+                            help='Number of media items to convert at once')
+        parser.add_argument('--vacuum', action='store_true', default=False,
+                            help='Run VACUUM afterwards to shrink an SQLite database')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be at least 1')
+        codec = options['codec']
+        if codec is None:
+            codec = get_metadata_codec()
+        codec = codec.strip().lower()
+        if codec == 'none':
+            codec = ''
+        if codec and codec not in METADATA_CODECS:
+            raise CommandError(f'--codec must be one of {METADATA_CODECS} or "none"')
+        log.info(f'Converting media metadata to codec: {codec or "none"}')
+        has_stored_metadata = (Q(data__isnull=False) & ~Q(data='') |
+                               Q(compressed__isnull=False))
+        q = MediaMetadata.objects.filter(has_stored_metadata).exclude(codec=codec)
+        media_pks = list(q.values_list('pk', flat=True))
+        log.info(f'Found {len(media_pks)} media items to convert')
+        bytes_before, bytes_after, converted = 0, 0, 0
+        for i in range(0, len(media_pks), batch_size):
+            batch = []
+            chunk = media_pks[i:i + batch_size]
+            for media_metadata in MediaMetadata.objects.filter(pk__in=chunk):
+                bytes_before += media_metadata.stored_size
+                media_metadata.store(media_metadata.metadata, codec)
+                bytes_after += media_metadata.stored_size
+                batch.append(media_metadata)
+            MediaMetadata.objects.bulk_update(batch, MediaMetadata.STORAGE_FIELDS)
+            converted += len(batch)
+            log.info(f'Converted {converted} of {len(media_pks)} media items')
+        reclaimed = bytes_before - bytes_after
+        log.info(f'Metadata size was {bytes_before} bytes and is now {bytes_after} '
+                 f'bytes, reclaimed {reclaimed} bytes '
+                 f'({round(reclaimed / 1024 / 1024, 1)} MiB)')
+        if options['vacuum']:
+            if connection.vendor == 'sqlite':
+                log.info('Running VACUUM to shrink the database file...')
+                with connection.cursor() as cursor:
+                    cursor.execute('VACUUM')
+            else:
+                log.info(f'Not running VACUUM on a {connection.vendor} database')
+        log.info('Done')
@@ -1,12 +1,8 @@
-import os
 import uuid
-from django.utils.translation import gettext_lazy as _
 from django.core.management.base import BaseCommand, CommandError
-from django.db.models import signals
 from common.logger import log
-from sync.models import Source, Media, MediaServer
-from sync.signals import media_post_delete
-from sync.tasks import rescan_media_server
+from sync.models import Source
+from sync.tasks import delete_source
 
 
 class Command(BaseCommand):
@@ -15,6 +11,8 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--source', action='store', required=True, help='Source UUID')
+        parser.add_argument('--delete-media', action='store_true', default=False,
+                            help='Also delete the downloaded media files')
 
     def handle(self, *args, **options):
         source_uuid_str = options.get('source', '')
@@ -29,23 +27,9 @@ class Command(BaseCommand):
         except Source.DoesNotExist:
             raise CommandError(f'Source does not exist with '
                                f'UUID: {source_uuid}')
-        # Detach post-delete signal for Media so we don't spam media servers
-        signals.post_delete.disconnect(media_post_delete, sender=Media)
-        # Delete the source, triggering pre-delete signals for each media item
+        # Delete the source and its media in bulk, then update any media servers
         log.info(f'Found source with UUID "{source.uuid}" with name '
                  f'"{source.name}" and deleting it, this may take some time!')
-        source.delete()
-        # Update any media servers
-        for mediaserver in MediaServer.objects.all():
-            log.info(f'Scheduling media server updates')
-            verbose_name = _('Request media server rescan for "{}"')
-            rescan_media_server(
-                str(mediaserver.pk),
-                priority=0,
-                verbose_name=verbose_name.format(mediaserver),
-                remove_existing_tasks=True
-            )
-        # Re-attach signals
-        signals.post_delete.connect(media_post_delete, sender=Media)
+        delete_source.now(str(source.pk), delete_files=options['delete_media'])
         # All done
         log.info('Done')
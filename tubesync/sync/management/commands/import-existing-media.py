@@ -3,6 +3,7 @@ from pathlib import Path
 from django.core.management.base import BaseCommand, CommandError
 from common.logger import log
 from sync.models import Source, Media
+from sync.tasks import scheduled_tasks_buffer
 
 
 class Command(BaseCommand):
@@ -46,10 +47,12 @@ class Command(BaseCommand):
                         # the undownloaded media item
                         filemap[filepath] = item
                         continue
-            for filepath, item in filemap.items():
-                log.info(f'Matched on-disk file: {filepath} '
-                         f'to media item: {item.source} / {item}')
-                item.media_file.name = filepath
-                item.downloaded = True
-                item.save()
+            # Schedule any tasks the saved media needs together
+            with scheduled_tasks_buffer():
+                for filepath, item in filemap.items():
+                    log.info(f'Matched on-disk file: {filepath} '
+                             f'to media item: {item.source} / {item}')
+                    item.media_file.name = filepath
+                    item.downloaded = True
+                    item.save()
         log.info('Done')
@@ -0,0 +1,42 @@
+import uuid
+from django.utils.translation import gettext_lazy as _
+from django.core.management.base import BaseCommand, CommandError
+from common.logger import log
+from sync.models import Source
+from sync.tasks import index_source_task
+
+
+class Command(BaseCommand):
+
+    help = ('Schedules a source to be indexed now by UUID')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', action='store', required=True, help='Source UUID')
+        parser.add_argument('--full', action='store_true', default=False,
+                            help='Index every media item rather than stopping at the '
+                                 'first run of already indexed media')
+
+    def handle(self, *args, **options):
+        source_uuid_str = options.get('source', '')
+        try:
+            source_uuid = uuid.UUID(source_uuid_str)
+        except Exception as e:
+            raise CommandError(f'Failed to parse source UUID: {e}')
+        try:
+            source = Source.objects.get(uuid=source_uuid)
+        except Source.DoesNotExist:
+            raise CommandError(f'Source does not exist with '
+                               f'UUID: {source_uuid}')
+        full = options['full']
+        log.info(f'Scheduling {"full" if full else "incremental"} index of source: '
+                 f'{source.name}')
+        verbose_name = _('Index media from source "{}"')
+        index_source_task(
+            str(source.pk),
+            full=full,
+            queue=str(source.pk),
+            priority=5,
+            verbose_name=verbose_name.format(source.name),
+            remove_existing_tasks=True
+        )
+        log.info('Done')
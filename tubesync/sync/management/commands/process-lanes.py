@@ -0,0 +1,41 @@
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from background_task.tasks import autodiscover
+from common.logger import log
+from sync.workers import LaneSupervisor
+
+
+class Command(BaseCommand):
+
+    help = ('Runs background tasks in lanes with separate concurrency for each type '
+            'of task, as configured by the WORKER_LANES setting')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--duration', action='store', type=int, default=0,
+                            help='Run tasks for this many seconds, 0 to run forever')
+        parser.add_argument('--sleep', action='store', type=float, default=5.0,
+                            help='Seconds to wait before checking for new tasks when '
+                                 'no tasks were found')
+        parser.add_argument('--report-interval', action='store', type=int,
+                            default=None,
+                            help='Seconds between logging the utilisation of each '
+                                 'lane, 0 to disable')
+
+    def handle(self, *args, **options):
+        autodiscover()
+        try:
+            supervisor = LaneSupervisor(report_interval=options['report_interval'])
+        except (TypeError, ValueError) as e:
+            raise CommandError(f'Invalid WORKER_LANES setting: {e}')
+        stopping = []
+
+        def stop(signum, frame):
+            log.info(f'Received signal {signum}, stopping task worker')
+            stopping.append(signum)
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        supervisor.run(duration=options['duration'], sleep=options['sleep'],
+                       stop=lambda: bool(stopping))
+        supervisor.report()
+        log.info('Done')
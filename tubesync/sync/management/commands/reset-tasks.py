@@ -2,7 +2,7 @@ from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import gettext_lazy as _
 from background_task.models import Task
 from sync.models import Source
-from sync.tasks import index_source_task
+from sync.tasks import schedule_index_source_task, schedule_update_source_media
 
 
 from common.logger import log
@@ -19,15 +19,7 @@ class Command(BaseCommand):
         # Iter all tasks
         for source in Source.objects.all():
             # Recreate the initial indexing task
-            log.info(f'Resetting tasks for source: {source}')
-            verbose_name = _('Index media from source "{}"')
-            index_source_task(
-                str(source.pk),
-                repeat=source.index_schedule,
-                queue=str(source.pk),
-                priority=5,
-                verbose_name=verbose_name.format(source.name)
-            )
-            # This also chains down to call each Media objects .save() as well
-            source.save()
+            schedule_index_source_task(source)
+            # Recreate any media tasks with a bulk update of the sources media
+            schedule_update_source_media(source)
         log.info('Done')
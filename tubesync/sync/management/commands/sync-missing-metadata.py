@@ -5,6 +5,7 @@ from django.db.models import Q
 from common.logger import log
 from sync.models import Source, Media
 from sync.utils import write_text_file
+from sync.fileindex import file_index, file_exists
 
 
 class Command(BaseCommand):
@@ -13,22 +14,26 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         log.info('Syncing missing metadata...')
+        # Sweep the media directories once up front rather than checking each file
+        file_index.refresh()
         sources = Source.objects.filter(Q(copy_thumbnails=True) | Q(write_nfo=True))
         for source in sources.order_by('name'):
             log.info(f'Finding media for source: {source}')
             for item in Media.objects.filter(source=source, downloaded=True):
                 log.info(f'Checking media for missing metadata: {source} / {item}')
                 thumbpath = item.thumbpath
-                if not thumbpath.is_file():
+                if not file_exists(thumbpath, verify=False):
                     if item.thumb:
                         log.info(f'Copying missing thumbnail from: {item.thumb.path} '
                                  f'to: {thumbpath}')
                         copyfile(item.thumb.path, thumbpath)
+                        file_index.add(thumbpath)
                     else:
                         log.error(f'Tried to copy missing thumbnail for {item} but '
                                   f'the thumbnail has not been downloaded')
                 nfopath = item.nfopath
-                if not nfopath.is_file():
+                if not file_exists(nfopath, verify=False):
                     log.info(f'Writing missing NFO file: {nfopath}')
                     write_text_file(nfopath, item.nfoxml)
+                    file_index.add(nfopath)
         log.info('Done')
@@ -19,22 +19,24 @@ def get_best_combined_format(media):
         and video formats if possible. Combined formats are the easiest to check
         for as they must exactly match the source profile be be valid.
     '''
-    for fmt in media.iter_formats():
+    source = media.source
+    source_resolution = source.source_resolution.strip().upper()
+    for fmt in media.parsed_formats.combined:
         # Check height matches
-        if media.source.source_resolution.strip().upper() != fmt['format']:
+        if source_resolution != fmt['format']:
             continue
         # Check the video codec matches
-        if media.source.source_vcodec != fmt['vcodec']:
+        if source.source_vcodec != fmt['vcodec']:
             continue
         # Check the audio codec matches
-        if media.source.source_acodec != fmt['acodec']:
+        if source.source_acodec != fmt['acodec']:
             continue
         # if the source prefers 60fps, check for it
-        if media.source.prefer_60fps:
+        if source.prefer_60fps:
             if not fmt['is_60fps']:
                 continue
         # If the source prefers HDR, check for it
-        if media.source.prefer_hdr:
+        if source.prefer_hdr:
             if not fmt['is_hdr']:
                 continue
         # If we reach here, we have a combined match!
@@ -48,12 +50,7 @@ def get_best_audio_format(media):
         has a 'fallback' of fail this can return no match.
     '''
     # Order all audio-only formats by bitrate
-    audio_formats = []
-    for fmt in media.iter_formats():
-        # If the format has a video stream, skip it
-        if fmt['vcodec'] is not None:
-            continue
-        audio_formats.append(fmt)
+    audio_formats = media.parsed_formats.audio_only
     audio_formats = list(reversed(sorted(audio_formats, key=lambda k: k['abr'])))
     if not audio_formats:
         # Media has no audio formats at all
@@ -72,315 +69,135 @@ def get_best_audio_format(media):
         return False, False
 
 
+# Video format preference ladders for each (prefer_60fps, prefer_hdr) source profile,
+# most preferred first. Each rule lists the (resolution, vcodec, hdr, 60fps)
+# requirements of a format, True or False must match and None is ignored. The first
+# rule is an exact match, the rest are only used if the source can fallback.
+VIDEO_FORMAT_LADDERS = {
+    (True, True): (
+        (True, True, True, True),
+        (True, None, True, True),
+        (None, True, True, True),
+        (True, True, None, True),
+        (True, None, True, None),
+        (True, None, None, True),
+        (True, True, True, None),
+        (True, True, None, None),
+        (True, None, None, None),
+        (None, None, None, None),
+    ),
+    (True, False): (
+        (True, True, False, True),
+        (True, None, False, True),
+        (None, True, False, True),
+        (None, True, None, True),
+        (True, True, False, None),
+        (True, True, None, None),
+        (True, None, None, None),
+        (None, None, None, None),
+    ),
+    (False, True): (
+        (True, True, True, None),
+        (True, None, True, False),
+        (None, True, True, False),
+        (None, True, True, None),
+        (True, True, None, False),
+        (True, True, None, None),
+        (True, None, None, None),
+        (None, None, None, None),
+    ),
+    (False, False): (
+        (True, True, False, False),
+        (True, None, False, False),
+        (None, True, False, True),
+        (True, True, False, None),
+        (True, True, None, False),
+        (True, True, None, None),
+        (True, None, False, None),
+        (True, None, None, None),
+        (None, None, None, None),
+    ),
+}
+
+
+def _build_video_rank_tables():
+    '''
+        Flattens VIDEO_FORMAT_LADDERS into lookup tables keyed by (prefer_60fps,
+        prefer_hdr, can_fallback). Each table is indexed by a format's resolution,
+        vcodec, hdr and 60fps matches packed into 4 bits (resolution being the most
+        significant) and holds the index of the first rule the format satisfies,
+        or NO_RANK if it satisfies no rule.
+    '''
+    tables = {}
+    for (prefer_60fps, prefer_hdr), ladder in VIDEO_FORMAT_LADDERS.items():
+        for can_fallback in (True, False):
+            rules = ladder if can_fallback else ladder[:1]
+            table = []
+            for bits in range(16):
+                matches = (bool(bits & 8), bool(bits & 4), bool(bits & 2), bool(bits & 1))
+                rank = NO_RANK
+                for i, rule in enumerate(rules):
+                    if all(req is None or req == m for req, m in zip(rule, matches)):
+                        rank = i
+                        break
+                table.append(rank)
+            tables[(prefer_60fps, prefer_hdr, can_fallback)] = tuple(table)
+    return tables
+
+
+NO_RANK = len(max(VIDEO_FORMAT_LADDERS.values(), key=len))
+video_rank_tables = _build_video_rank_tables()
+
+
 def get_best_video_format(media):
     '''
         Finds the best match for the source required video format. If the source
         has a 'fallback' of fail this can return no match. Resolution is treated
-        as the most important factor to match. This is pretty verbose due to the
-        'soft' matching requirements for prefer_hdr and prefer_60fps.
+        as the most important factor to match. Video-only formats are ranked in a
+        single pass, highest resolution first, by the first rule of the source's
+        VIDEO_FORMAT_LADDERS entry they satisfy.
     '''
+    source = media.source
     # Check if the source wants audio only, fast path to return
-    if media.source.is_audio:
+    if source.is_audio:
         return False, False
-    # Filter video-only formats by resolution that matches the source
-    video_formats = []
-    for fmt in media.iter_formats():
-        # If the format has an audio stream, skip it
-        if fmt['acodec'] is not None:
-            continue
-        if media.source.source_resolution.strip().upper() == fmt['format']:
-            video_formats.append(fmt)
-    # Check we matched some streams
-    if not video_formats:
-        # No streams match the requested resolution, see if we can fallback
-        if media.source.can_fallback:
-            # Find the next-best format matches by height
-            for fmt in media.iter_formats():
-                # If the format has an audio stream, skip it
-                if fmt['acodec'] is not None:
-                    continue
-                if (fmt['height'] <= media.source.source_resolution_height and 
-                    fmt['height'] >= min_height):
-                    video_formats.append(fmt)
-        else:
-            # Can't fallback
+    source_resolution = source.source_resolution.strip().upper()
+    source_vcodec = source.source_vcodec
+    can_fallback = source.can_fallback
+    rank_table = video_rank_tables[(bool(source.prefer_60fps), bool(source.prefer_hdr),
+                                    can_fallback)]
+    video_formats = media.parsed_formats.video_only_by_height
+    # Formats matching the source resolution are always preferred
+    candidates = [fmt for fmt in video_formats if fmt.format == source_resolution]
+    if not candidates:
+        if not can_fallback:
             return False, False
-    video_formats = list(reversed(sorted(video_formats, key=lambda k: k['height'])))
-    source_resolution = media.source.source_resolution.strip().upper()
-    source_vcodec = media.source.source_vcodec
-    if not video_formats:
-        # Still no matches
-        return False, False
-    exact_match, best_match = None, None
-    # Of our filtered video formats, check for resolution + codec + hdr + fps match
-    if media.source.prefer_60fps and media.source.prefer_hdr:
-        for fmt in video_formats:
-            # Check for an exact match
-            if (source_resolution == fmt['format'] and
-                source_vcodec == fmt['vcodec'] and 
-                fmt['is_hdr'] and
-                fmt['is_60fps']):
-                # Exact match
-                exact_match, best_match = True, fmt
-                break
-        if media.source.can_fallback:
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a resolution, hdr and fps match but drop the codec
-                    if (source_resolution == fmt['format'] and 
-                        fmt['is_hdr'] and fmt['is_60fps']):
-                        # Close match
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec, hdr and fps match but drop the resolution
-                    if (source_vcodec == fmt['vcodec'] and 
-                        fmt['is_hdr'] and fmt['is_60fps']):
-                        # Close match
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution, codec and 60fps match
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution and hdr match
-                    if (source_resolution == fmt['format'] and
-                        fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution and 60fps match
-                    if (source_resolution == fmt['format'] and
-                        fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution, codec and hdr match
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution and codec
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution
-                    if source_resolution == fmt['format']:
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                # Match the highest resolution
-                exact_match, best_match = False, video_formats[0]
-    # Check for resolution + codec + fps match
-    if media.source.prefer_60fps and not media.source.prefer_hdr:
-        for fmt in video_formats:
-            # Check for an exact match
-            if (source_resolution == fmt['format'] and
-                source_vcodec == fmt['vcodec'] and 
-                fmt['is_60fps'] and
-                not fmt['is_hdr']):
-                # Exact match
-                exact_match, best_match = True, fmt
-                break
-        if media.source.can_fallback:
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a resolution and fps match but drop the codec
-                    if (source_resolution == fmt['format'] and 
-                        fmt['is_60fps'] and
-                        not fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec and fps match but drop the resolution
-                    if (source_vcodec == fmt['vcodec'] and 
-                        fmt['is_60fps'] and
-                        not fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec and 60fps match
-                    if (source_vcodec == fmt['vcodec'] and 
-                        fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for codec and resolution match bot drop 60fps
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        not fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for codec and resolution match only
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution
-                    if source_resolution == fmt['format']:
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                # Match the highest resolution
-                exact_match, best_match = False, video_formats[0]
-    # Check for resolution + codec + hdr
-    elif media.source.prefer_hdr and not media.source.prefer_60fps:
-        for fmt in video_formats:
-            # Check for an exact match
-            if (source_resolution == fmt['format'] and
-                source_vcodec == fmt['vcodec'] and 
-                fmt['is_hdr']):
-                # Exact match
-                exact_match, best_match = True, fmt
-                break
-        if media.source.can_fallback:
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a resolution and fps match but drop the codec
-                    if (source_resolution == fmt['format'] and 
-                        fmt['is_hdr'] and
-                        not fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec and fps match but drop the resolution
-                    if (source_vcodec == fmt['vcodec'] and 
-                        fmt['is_hdr'] and
-                        not fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec and 60fps match
-                    if (source_vcodec == fmt['vcodec'] and 
-                        fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for codec and resolution match bot drop hdr
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        not fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for codec and resolution match only
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution
-                    if source_resolution == fmt['format']:
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                # Match the highest resolution
-                exact_match, best_match = False, video_formats[0]
-    # check for resolution + codec
-    elif not media.source.prefer_hdr and not media.source.prefer_60fps:
-        for fmt in video_formats:
-            # Check for an exact match
-            if (source_resolution == fmt['format'] and
-                source_vcodec == fmt['vcodec'] and
-                not fmt['is_60fps'] and
-                not fmt['is_hdr']):
-                # Exact match
-                exact_match, best_match = True, fmt
+        # No streams match the requested resolution, find the next-best by height
+        max_height = source.source_resolution_height
+        candidates = [fmt for fmt in video_formats
+                      if min_height <= fmt.height <= max_height]
+        resolution_bit = 0
+    else:
+        resolution_bit = 8
+    best_rank, best_match = NO_RANK, None
+    for fmt in candidates:
+        rank = rank_table[resolution_bit | (4 if fmt.vcodec == source_vcodec else 0) |
+                          (2 if fmt.is_hdr else 0) | (1 if fmt.is_60fps else 0)]
+        if rank < best_rank:
+            best_rank, best_match = rank, fmt
+            if rank == 0:
                 break
-        if media.source.can_fallback:
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a resolution, hdr and fps match but drop the codec
-                    if (source_resolution == fmt['format'] and 
-                        not fmt['is_hdr'] and not fmt['is_60fps']):
-                        # Close match
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for a codec, hdr and fps match but drop the resolution
-                    if (source_vcodec == fmt['vcodec'] and 
-                        not fmt['is_hdr'] and fmt['is_60fps']):
-                        # Close match
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution, codec and hdr match
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        not fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution, codec and 60fps match
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec'] and
-                        not fmt['is_60fps']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution and codec
-                    if (source_resolution == fmt['format'] and
-                        source_vcodec == fmt['vcodec']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution and not hdr
-                    if (source_resolution == fmt['format'] and
-                        not fmt['is_hdr']):
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                for fmt in video_formats:
-                    # Check for resolution
-                    if source_resolution == fmt['format']:
-                        exact_match, best_match = False, fmt
-                        break
-            if not best_match:
-                # Match the highest resolution
-                exact_match, best_match = False, video_formats[0]
     # See if we found a match
     if best_match:
         # Final check to see if the match we found was good enough
-        if exact_match:
-            return True, best_match['id']
-        elif media.source.can_fallback:
+        if best_rank == 0:
+            return True, best_match.id
+        elif can_fallback:
             # Allow the fallback if it meets requirements
-            if (media.source.fallback == media.source.FALLBACK_NEXT_BEST_HD and
-                best_match['height'] >= fallback_hd_cutoff):
-                return False, best_match['id']
-            elif media.source.fallback == media.source.FALLBACK_NEXT_BEST:
-                return False, best_match['id']
+            if (source.fallback == source.FALLBACK_NEXT_BEST_HD and
+                best_match.height >= fallback_hd_cutoff):
+                return False, best_match.id
+            elif source.fallback == source.FALLBACK_NEXT_BEST:
+                return False, best_match.id
     # Nope, failed to find match
     return False, False
@@ -0,0 +1,15 @@
+from .tasks import scheduled_tasks_buffer
+
+
+class ScheduledTasksMiddleware:
+    '''
+        Collects the background tasks scheduled while handling a request and
+        schedules them together in bulk once the response is ready.
+    '''
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with scheduled_tasks_buffer():
+            return self.get_response(request)
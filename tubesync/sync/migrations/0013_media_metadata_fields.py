@@ -0,0 +1,47 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:40
+
+from django.db import migrations, models
+
+
+def set_has_metadata(apps, schema_editor):
+    # The other copied fields require parsing the metadata, they are filled in by
+    # the backfill-media-fields management command
+    Media = apps.get_model('sync', 'Media')
+    Media.objects.filter(metadata__isnull=False).exclude(metadata='').update(
+        has_metadata=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0012_alter_media_downloaded_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='duration',
+            field=models.PositiveIntegerField(db_index=True, default=0, help_text='Duration of the media in seconds, copied from the metadata', verbose_name='duration'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='has_metadata',
+            field=models.BooleanField(db_index=True, default=False, help_text='Media has had its metadata downloaded', verbose_name='has metadata'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='thumbnail',
+            field=models.CharField(blank=True, default='', help_text='URL of the media thumbnail, copied from the metadata', max_length=500, verbose_name='thumbnail'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='title',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Media title, copied from the metadata', max_length=200, verbose_name='title'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='uploader',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Name of the media uploader, copied from the metadata', max_length=200, verbose_name='uploader'),
+        ),
+        migrations.RunPython(set_has_metadata, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.25 on 2026-10-15 06:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0013_media_metadata_fields'),
+    ]
+
+    operations = [
+        # The existing metadata column is kept as-is, only the model field is renamed
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name='media',
+                    old_name='metadata',
+                    new_name='metadata_json',
+                ),
+                migrations.AlterField(
+                    model_name='media',
+                    name='metadata_json',
+                    field=models.TextField(blank=True, db_column='metadata', help_text='JSON encoded metadata for the media, if stored uncompressed', null=True, verbose_name='metadata'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='metadata_codec',
+            field=models.CharField(blank=True, default='', help_text='Codec the metadata is compressed with, blank if uncompressed', max_length=8, verbose_name='metadata codec'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='metadata_compressed',
+            field=models.BinaryField(blank=True, help_text='Compressed JSON encoded metadata for the media', null=True, verbose_name='compressed metadata'),
+        ),
+    ]
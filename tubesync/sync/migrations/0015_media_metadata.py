@@ -0,0 +1,64 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Number of media items to move the metadata of at once
+CHUNK_SIZE = 250
+
+
+def move_metadata_to_table(apps, schema_editor):
+    Media = apps.get_model('sync', 'Media')
+    MediaMetadata = apps.get_model('sync', 'MediaMetadata')
+    has_metadata = (models.Q(metadata_json__isnull=False) & ~models.Q(metadata_json='') |
+                    models.Q(metadata_compressed__isnull=False))
+    media_pks = list(Media.objects.filter(has_metadata).values_list('pk', flat=True))
+    for i in range(0, len(media_pks), CHUNK_SIZE):
+        chunk = media_pks[i:i + CHUNK_SIZE]
+        rows = Media.objects.filter(pk__in=chunk).values_list(
+            'pk', 'metadata_json', 'metadata_compressed', 'metadata_codec')
+        MediaMetadata.objects.bulk_create([
+            MediaMetadata(media_id=pk, data=data, compressed=compressed, codec=codec)
+            for pk, data, compressed, codec in rows
+        ])
+
+
+def move_metadata_to_media(apps, schema_editor):
+    Media = apps.get_model('sync', 'Media')
+    MediaMetadata = apps.get_model('sync', 'MediaMetadata')
+    media_pks = list(MediaMetadata.objects.values_list('pk', flat=True))
+    for i in range(0, len(media_pks), CHUNK_SIZE):
+        chunk = media_pks[i:i + CHUNK_SIZE]
+        batch = []
+        for media_metadata in MediaMetadata.objects.filter(pk__in=chunk):
+            batch.append(Media(pk=media_metadata.pk,
+                               metadata_json=media_metadata.data,
+                               metadata_compressed=media_metadata.compressed,
+                               metadata_codec=media_metadata.codec))
+        Media.objects.bulk_update(batch, ('metadata_json', 'metadata_compressed',
+                                          'metadata_codec'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0014_media_metadata_compressed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaMetadata',
+            fields=[
+                ('media', models.OneToOneField(help_text='Media the metadata is for', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='media_metadata', serialize=False, to='sync.media')),
+                ('data', models.TextField(blank=True, help_text='JSON encoded metadata for the media, if stored uncompressed', null=True, verbose_name='data')),
+                ('compressed', models.BinaryField(blank=True, help_text='Compressed JSON encoded metadata for the media', null=True, verbose_name='compressed')),
+                ('codec', models.CharField(blank=True, default='', help_text='Codec the metadata is compressed with, blank if uncompressed', max_length=8, verbose_name='codec')),
+            ],
+            options={
+                'verbose_name': 'Media metadata',
+                'verbose_name_plural': 'Media metadata',
+            },
+        ),
+        migrations.RunPython(move_metadata_to_table, move_metadata_to_media),
+    ]
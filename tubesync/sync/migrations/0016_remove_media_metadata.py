@@ -0,0 +1,25 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0015_media_metadata'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='media',
+            name='metadata_codec',
+        ),
+        migrations.RemoveField(
+            model_name='media',
+            name='metadata_compressed',
+        ),
+        migrations.RemoveField(
+            model_name='media',
+            name='metadata_json',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0016_remove_media_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='media',
+            name='matched_format',
+            field=models.CharField(blank=True, default='', help_text='Format string of the best formats matched for the source', max_length=100, verbose_name='matched format'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='matched_format_key',
+            field=models.CharField(blank=True, default='', help_text='Source fingerprint and metadata version the format was matched for', max_length=50, verbose_name='matched format key'),
+        ),
+        migrations.AddField(
+            model_name='media',
+            name='metadata_version',
+            field=models.PositiveIntegerField(default=0, help_text='Incremented every time the metadata changes', verbose_name='metadata version'),
+        ),
+    ]
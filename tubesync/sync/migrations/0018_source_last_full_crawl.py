@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0017_media_matched_format'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='last_full_crawl',
+            field=models.DateTimeField(blank=True, help_text='Date and time all media on the source was last crawled', null=True, verbose_name='last full crawl'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-15 05:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sync', '0018_source_last_full_crawl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='source',
+            name='index_checkpoint',
+            field=models.PositiveIntegerField(default=0, help_text='Number of media items processed by an unfinished index of the source', verbose_name='index checkpoint'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 import os
 import uuid
 import json
+import random
+from hashlib import sha1
 from xml.etree import ElementTree
 from collections import OrderedDict
 from datetime import datetime, timedelta
@@ -11,14 +13,19 @@ from django.core.files.storage import FileSystemStorage
 from django.utils.text import slugify
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from common.logger import log
 from common.errors import NoFormatException
-from common.utils import clean_filename
+from common.utils import clean_filename, json_dumps, json_loads
 from .youtube import (get_media_info as get_youtube_media_info,
+                      get_media_entries as get_youtube_media_entries,
+                      iter_media_info as iter_youtube_media_info,
                       download_media as download_youtube_media)
-from .utils import seconds_to_timestr, parse_media_format
+from .utils import (seconds_to_timestr, ParsedFormats, get_metadata_codec,
+                    compress_metadata, decompress_metadata, slim_metadata)
 from .matching import (get_best_combined_format, get_best_audio_format, 
-                       get_best_video_format)
+                       get_best_video_format, min_height, fallback_hd_cutoff)
 from .mediaservers import PlexMediaServer
+from .fileindex import file_exists
 
 
 media_file_storage = FileSystemStorage(location=str(settings.DOWNLOAD_ROOT))
@@ -124,12 +131,32 @@ class Source(models.Model):
         SOURCE_TYPE_YOUTUBE_CHANNEL_ID: 'https://www.youtube.com/channel/{key}/videos',
         SOURCE_TYPE_YOUTUBE_PLAYLIST: 'https://www.youtube.com/playlist?list={key}',
     }
+    # Format used to create feeds of recent uploads, used to check for new media
+    # before indexing. Channels by name have no feed
+    FEED_URLS = {
+        SOURCE_TYPE_YOUTUBE_CHANNEL_ID: ('https://www.youtube.com/feeds/videos.xml'
+                                         '?channel_id={key}'),
+        SOURCE_TYPE_YOUTUBE_PLAYLIST: ('https://www.youtube.com/feeds/videos.xml'
+                                       '?playlist_id={key}'),
+    }
     # Callback functions to get a list of media from the source
     INDEXERS = {
         SOURCE_TYPE_YOUTUBE_CHANNEL: get_youtube_media_info,
         SOURCE_TYPE_YOUTUBE_CHANNEL_ID: get_youtube_media_info,
         SOURCE_TYPE_YOUTUBE_PLAYLIST: get_youtube_media_info,
     }
+    # Callback functions to lazily iterate over the media from the source
+    ENTRY_INDEXERS = {
+        SOURCE_TYPE_YOUTUBE_CHANNEL: get_youtube_media_entries,
+        SOURCE_TYPE_YOUTUBE_CHANNEL_ID: get_youtube_media_entries,
+        SOURCE_TYPE_YOUTUBE_PLAYLIST: get_youtube_media_entries,
+    }
+    # Fields which affect which media is matched, skipped or where it is saved, the
+    # media for the source is updated when any of them change
+    MEDIA_UPDATE_FIELDS = ('source_type', 'key', 'directory', 'media_format',
+                           'download_media', 'download_cap', 'delete_old_media',
+                           'days_to_keep', 'source_resolution', 'source_vcodec',
+                           'source_acodec', 'prefer_60fps', 'prefer_hdr', 'fallback')
     # Field names to find the media ID used as the key when storing media
     KEY_FIELD = {
         SOURCE_TYPE_YOUTUBE_CHANNEL: 'id',
@@ -160,6 +187,7 @@ class Source(models.Model):
         EVERY_24_HOURS = 86400, _('Every 24 hours')
         EVERY_3_DAYS = 259200, _('Every 3 days')
         EVERY_7_DAYS = 604800, _('Every 7 days')
+        ADAPTIVE = -1, _('Adaptively, based on how often media is published')
         NEVER = 0, _('Never')
 
     uuid = models.UUIDField(
@@ -182,6 +210,18 @@ class Source(models.Model):
         blank=True,
         help_text=_('Date and time the source was last crawled')
     )
+    last_full_crawl = models.DateTimeField(
+        _('last full crawl'),
+        null=True,
+        blank=True,
+        help_text=_('Date and time all media on the source was last crawled')
+    )
+    index_checkpoint = models.PositiveIntegerField(
+        _('index checkpoint'),
+        default=0,
+        help_text=_('Number of media items processed by an unfinished index of the '
+                    'source')
+    )
     source_type = models.CharField(
         _('source type'),
         max_length=1,
@@ -316,6 +356,38 @@ class Source(models.Model):
         verbose_name = _('Source')
         verbose_name_plural = _('Sources')
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.track_loaded_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.track_loaded_values()
+
+    def track_loaded_values(self):
+        '''
+            Records the current value of every loaded field so changed_fields can
+            tell which fields have been changed since.
+        '''
+        self._loaded_values = {f.attname: self.__dict__[f.attname]
+                               for f in self._meta.concrete_fields
+                               if f.attname in self.__dict__}
+
+    @property
+    def changed_fields(self):
+        '''
+            Returns a set of the names of the fields which have been changed since the
+            source was loaded from or last saved to the database. Every field is
+            returned for sources which have never been loaded or saved.
+        '''
+        fields = [f.attname for f in self._meta.concrete_fields]
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None:
+            return set(fields)
+        return {f for f in fields if f in loaded and self.__dict__.get(f) != loaded[f]}
+
     @property
     def icon(self):
         return self.ICONS.get(self.source_type)
@@ -341,6 +413,21 @@ class Source(models.Model):
         else:
             return False
 
+    @property
+    def download_window_date(self):
+        '''
+            Returns the date media must have been published after to be downloaded,
+            the later of the download cap date and, if old media is deleted, the
+            days to keep cut-off. Returns False if there is no limit.
+        '''
+        dates = []
+        cap_date = self.download_cap_date
+        if cap_date:
+            dates.append(cap_date)
+        if self.delete_old_media and self.days_to_keep > 0:
+            dates.append(timezone.now() - timedelta(days=self.days_to_keep))
+        return max(dates) if dates else False
+
     @property
     def extension(self):
         '''
@@ -378,6 +465,11 @@ class Source(models.Model):
     def index_url(self):
         return Source.create_index_url(self.source_type, self.key)
 
+    @property
+    def feed_url(self):
+        url = self.FEED_URLS.get(self.source_type)
+        return url.format(key=self.key) if url else None
+
     @property
     def format_summary(self):
         if self.source_resolution == Source.SOURCE_RESOLUTION_AUDIO:
@@ -416,6 +508,18 @@ class Source(models.Model):
     def can_fallback(self):
         return self.fallback != self.FALLBACK_FAIL
 
+    @property
+    def format_fingerprint(self):
+        '''
+            Returns a short hash of everything about the source which affects which
+            formats are matched for its media. If it changes, formats need to be
+            matched again.
+        '''
+        profile = (self.source_resolution, self.source_vcodec, self.source_acodec,
+                   bool(self.prefer_60fps), bool(self.prefer_hdr), self.fallback,
+                   min_height, fallback_hd_cutoff)
+        return sha1(repr(profile).encode('utf-8')).hexdigest()[:16]
+
     @property
     def example_media_format_dict(self):
         '''
@@ -475,6 +579,99 @@ class Source(models.Model):
             return []
         return response.get('entries', [])
 
+    def iter_index_media(self, start=0):
+        '''
+            Index the media source lazily, yielding media metadata as dicts as each
+            page of results is fetched. Channels and playlists are returned newest
+            first. The first "start" media items are skipped.
+        '''
+        indexer = self.ENTRY_INDEXERS.get(self.source_type, None)
+        if not callable(indexer):
+            raise Exception(f'Source type f"{self.source_type}" has no indexer')
+        return indexer(self.index_url, start=start)
+
+    def get_adaptive_index_interval(self):
+        '''
+            Returns the number of seconds between indexes of the source when using the
+            adaptive index schedule. This is half the average time between the most
+            recently published media, counting the time since the latest media was
+            published, so sources which publish often are indexed often and sources
+            which have stopped publishing are indexed less. The interval is bounded by
+            INDEX_ADAPTIVE_MIN_INTERVAL and INDEX_ADAPTIVE_MAX_INTERVAL.
+        '''
+        min_interval = getattr(settings, 'INDEX_ADAPTIVE_MIN_INTERVAL', 3600)
+        max_interval = getattr(settings, 'INDEX_ADAPTIVE_MAX_INTERVAL', 604800)
+        sample_size = getattr(settings, 'INDEX_ADAPTIVE_SAMPLE_SIZE', 10)
+        media = self.media_source.filter(published__isnull=False)
+        dates = list(media.order_by('-published').values_list(
+            'published', flat=True)[:sample_size])
+        if len(dates) < 2:
+            # Not enough media to know how often the source publishes
+            interval = 86400
+        else:
+            interval = (timezone.now() - dates[-1]).total_seconds() / len(dates) / 2
+        return int(min(max(interval, min_interval), max_interval))
+
+    def get_next_adaptive_index(self):
+        '''
+            Returns the date and time the source should next be indexed when using the
+            adaptive index schedule.
+        '''
+        now = timezone.now()
+        if not self.last_crawl:
+            return now
+        interval = timedelta(seconds=self.get_adaptive_index_interval())
+        return max(self.last_crawl + interval, now)
+
+    @property
+    def index_offset(self):
+        '''
+            Returns the number of seconds into each index schedule window that the
+            source is indexed at. This is derived from the source UUID so it never
+            changes and sources with the same index schedule are spread evenly across
+            the window rather than all being indexed at the same time.
+        '''
+        if self.index_schedule <= 0:
+            return 0
+        digest = sha1(self.uuid.bytes).digest()
+        return int.from_bytes(digest[:8], 'big') % self.index_schedule
+
+    def get_next_index(self):
+        '''
+            Returns the date and time the source should next be indexed. Sources which
+            have never been indexed are indexed now. Otherwise sources with a fixed
+            index schedule are indexed at their index_offset into the next schedule
+            window, counted from the Unix epoch, plus up to INDEX_SCHEDULE_JITTER
+            seconds of random jitter.
+        '''
+        if self.index_schedule == self.IndexSchedule.ADAPTIVE:
+            return self.get_next_adaptive_index()
+        now = timezone.now()
+        if not self.last_crawl or self.index_schedule <= 0:
+            return now
+        interval = self.index_schedule
+        timestamp = now.timestamp()
+        run_at = timestamp - (timestamp % interval) + self.index_offset
+        if run_at < timestamp:
+            run_at += interval
+        jitter = min(getattr(settings, 'INDEX_SCHEDULE_JITTER', 0), interval)
+        if jitter > 0:
+            run_at += random.uniform(0, jitter)
+        return datetime.fromtimestamp(run_at, tz=timezone.utc)
+
+    @property
+    def needs_full_crawl(self):
+        '''
+            Returns True if all media on the source should be indexed rather than
+            stopping at the first run of already indexed media.
+        '''
+        if getattr(settings, 'INDEX_INCREMENTAL_STOP_AFTER', 0) < 1:
+            return True
+        if not self.last_full_crawl:
+            return True
+        interval = getattr(settings, 'INDEX_FULL_CRAWL_INTERVAL', 0)
+        return self.last_full_crawl < timezone.now() - timedelta(seconds=interval)
+
 
 def get_media_thumb_path(instance, filename):
     fileid = str(instance.uuid)
@@ -505,6 +702,12 @@ class Media(models.Model):
         Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID: get_youtube_media_info,
         Source.SOURCE_TYPE_YOUTUBE_PLAYLIST: get_youtube_media_info,
     }
+    # Callback functions to get the metadata of many media items at once
+    BATCH_INDEXERS = {
+        Source.SOURCE_TYPE_YOUTUBE_CHANNEL: iter_youtube_media_info,
+        Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID: iter_youtube_media_info,
+        Source.SOURCE_TYPE_YOUTUBE_PLAYLIST: iter_youtube_media_info,
+    }
     # Maps standardised names to names used in source metdata
     METADATA_FIELDS = {
         'upload_date': {
@@ -532,6 +735,11 @@ class Media(models.Model):
             Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID: 'duration',
             Source.SOURCE_TYPE_YOUTUBE_PLAYLIST: 'duration',
         },
+        'timestamp': {
+            Source.SOURCE_TYPE_YOUTUBE_CHANNEL: 'timestamp',
+            Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID: 'timestamp',
+            Source.SOURCE_TYPE_YOUTUBE_PLAYLIST: 'timestamp',
+        },
         'formats': {
             Source.SOURCE_TYPE_YOUTUBE_CHANNEL: 'formats',
             Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID: 'formats',
@@ -646,11 +854,59 @@ class Media(models.Model):
         null=True,
         help_text=_('Height (Y) of the thumbnail')
     )
-    metadata = models.TextField(
-        _('metadata'),
+    has_metadata = models.BooleanField(
+        _('has metadata'),
+        db_index=True,
+        default=False,
+        help_text=_('Media has had its metadata downloaded')
+    )
+    title = models.CharField(
+        _('title'),
+        max_length=200,
+        db_index=True,
         blank=True,
-        null=True,
-        help_text=_('JSON encoded metadata for the media')
+        default='',
+        help_text=_('Media title, copied from the metadata')
+    )
+    duration = models.PositiveIntegerField(
+        _('duration'),
+        db_index=True,
+        default=0,
+        help_text=_('Duration of the media in seconds, copied from the metadata')
+    )
+    uploader = models.CharField(
+        _('uploader'),
+        max_length=200,
+        db_index=True,
+        blank=True,
+        default='',
+        help_text=_('Name of the media uploader, copied from the metadata')
+    )
+    thumbnail = models.CharField(
+        _('thumbnail'),
+        max_length=500,
+        blank=True,
+        default='',
+        help_text=_('URL of the media thumbnail, copied from the metadata')
+    )
+    metadata_version = models.PositiveIntegerField(
+        _('metadata version'),
+        default=0,
+        help_text=_('Incremented every time the metadata changes')
+    )
+    matched_format = models.CharField(
+        _('matched format'),
+        max_length=100,
+        blank=True,
+        default='',
+        help_text=_('Format string of the best formats matched for the source')
+    )
+    matched_format_key = models.CharField(
+        _('matched format key'),
+        max_length=50,
+        blank=True,
+        default='',
+        help_text=_('Source fingerprint and metadata version the format was matched for')
     )
     can_download = models.BooleanField(
         _('can download'),
@@ -745,6 +1001,12 @@ class Media(models.Model):
         help_text=_('Size of the downloaded media in bytes')
     )
 
+    # Fields copied out of the metadata so they can be used without loading it
+    METADATA_COPIED_FIELDS = ('has_metadata', 'title', 'duration', 'uploader',
+                              'thumbnail')
+    # Fields storing the result of format matching, see get_format_str()
+    MATCHED_FORMAT_FIELDS = ('matched_format', 'matched_format_key')
+
     def __str__(self):
         return self.key
 
@@ -755,13 +1017,131 @@ class Media(models.Model):
             ('source', 'key'),
         )
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields', None)
+        if update_fields is not None:
+            # The metadata isn't a field, it's saved separately below
+            update_fields = set(update_fields)
+            update_fields.discard('metadata')
+        # Refresh the fields copied from the metadata if the metadata has changed
+        metadata_changed = self.__dict__.get('_metadata_changed', False)
+        if metadata_changed:
+            self.copy_metadata_fields()
+            if update_fields is not None:
+                update_fields |= set(self.METADATA_COPIED_FIELDS)
+                update_fields.add('metadata_version')
+        # Match formats again if the source profile or metadata has changed
+        if self.has_metadata:
+            self.get_format_str()
+        if update_fields is not None:
+            update_fields |= set(self.MATCHED_FORMAT_FIELDS)
+            kwargs['update_fields'] = update_fields
+        rtn = super().save(*args, **kwargs)
+        if metadata_changed:
+            self.media_metadata.save()
+            self._metadata_changed = False
+        return rtn
+
+    @property
+    def metadata_storage(self):
+        '''
+            Returns the MediaMetadata instance the metadata is stored in, or None if
+            the media has no stored metadata. It is only loaded from the database
+            when first accessed.
+        '''
+        try:
+            return self.media_metadata
+        except MediaMetadata.DoesNotExist:
+            return None
+
+    @property
+    def metadata(self):
+        '''
+            Returns the JSON encoded metadata string.
+        '''
+        storage = self.metadata_storage
+        return storage.metadata if storage else None
+
+    @metadata.setter
+    def metadata(self, metadata):
+        storage = None
+        if not self._state.adding:
+            storage = self.metadata_storage
+        if storage is None:
+            storage = MediaMetadata(media=self)
+            self.media_metadata = storage
+        storage.store(metadata, get_metadata_codec())
+        self._metadata_changed = True
+        self.metadata_version += 1
+
+    def copy_metadata_fields(self):
+        '''
+            Copies commonly used values out of the metadata into their own fields so
+            they can be listed, sorted and filtered without loading the metadata.
+        '''
+        self.has_metadata = bool(self.metadata)
+        self.title = self.metadata_title[:200]
+        self.duration = self.metadata_duration
+        self.uploader = str(self.metadata_uploader or '').strip()[:200]
+        self.thumbnail = self.metadata_thumbnail[:500]
+
+    def copy_index_fields(self, entry):
+        '''
+            Copies the values available in the flat metadata returned when the source
+            is indexed. This allows media to be listed, and media published outside
+            of the download window to be skipped, before its metadata is downloaded.
+        '''
+        title = entry.get(self.get_metadata_field('title'), None)
+        if title:
+            self.title = str(title).strip()[:200]
+        try:
+            self.duration = max(int(entry.get(self.get_metadata_field('duration'),
+                                              None) or 0), 0)
+        except (TypeError, ValueError) as e:
+            pass
+        # Dates in flat metadata are approximate but never older than the actual
+        # date so they are safe to skip media with
+        timestamp = entry.get(self.get_metadata_field('timestamp'), None)
+        upload_date = entry.get(self.get_metadata_field('upload_date'), None)
+        try:
+            if timestamp:
+                self.published = datetime.fromtimestamp(int(timestamp),
+                                                        tz=timezone.utc)
+            elif upload_date:
+                self.published = timezone.make_aware(
+                    datetime.strptime(str(upload_date), '%Y%m%d'))
+        except (OverflowError, TypeError, ValueError) as e:
+            pass
+
+    @property
+    def needs_metadata(self):
+        '''
+            Returns True if the metadata for the media should be downloaded. Media
+            skipped at index time for being published outside of the download window
+            does not need metadata until the window changes.
+        '''
+        return not self.has_metadata and not (self.skip and self.published)
+
     def get_metadata_field(self, field):
         fields = self.METADATA_FIELDS.get(field, {})
         return fields.get(self.source.source_type, '')
 
+    @property
+    def parsed_formats(self):
+        '''
+            Returns the ParsedFormats of the media. Formats are only parsed once for
+            each version of the loaded metadata.
+        '''
+        metadata = self.loaded_metadata
+        cached = self.__dict__.get('_parsed_formats_cache')
+        if cached is not None and cached[0] is metadata:
+            return cached[1]
+        parsed_formats = ParsedFormats(self.formats)
+        self._parsed_formats_cache = (metadata, parsed_formats)
+        return parsed_formats
+
     def iter_formats(self):
-        for fmt in self.formats:
-            yield parse_media_format(fmt)
+        return iter(self.parsed_formats)
 
     def get_best_combined_format(self):
         return get_best_combined_format(self)
@@ -772,11 +1152,28 @@ class Media(models.Model):
     def get_best_video_format(self):
         return get_best_video_format(self)
     
+    @property
+    def matched_format_cache_key(self):
+        return f'{self.source.format_fingerprint}-{self.metadata_version}'
+
     def get_format_str(self):
         '''
             Returns a youtube-dl compatible format string for the best matches
             combination of source requirements and available audio and video formats.
-            Returns boolean False if there is no valid downloadable combo.
+            Returns boolean False if there is no valid downloadable combo. The result
+            is stored in matched_format and only matched again when the source
+            format_fingerprint or the metadata_version change.
+        '''
+        cache_key = self.matched_format_cache_key
+        if self.matched_format_key != cache_key:
+            self.matched_format = self.match_format_str() or ''
+            self.matched_format_key = cache_key
+        return self.matched_format or False
+
+    def match_format_str(self):
+        '''
+            Matches the best formats for the source requirements, see
+            get_format_str().
         '''
         if self.source.is_audio:
             audio_match, audio_format = self.get_best_audio_format()
@@ -796,7 +1193,62 @@ class Media(models.Model):
                 else:
                     return False
         return False
-    
+
+    def refresh_download_flags(self):
+        '''
+            Recalculates the "skip" flag from the source download cap and the
+            "can_download" flag from the source format requirements. The media is
+            not saved. Returns True if either flag changed.
+        '''
+        changed = False
+        # Reset the skip flag if the download cap or days to keep have changed if the
+        # media has not already been downloaded
+        if not self.downloaded:
+            max_cap_age = self.source.download_window_date
+            published = self.published
+            if not published:
+                if not self.skip:
+                    log.warn(f'Media: {self.source} / {self} has no published date '
+                             f'set, marking to be skipped')
+                    self.skip = True
+                    changed = True
+                else:
+                    log.debug(f'Media: {self.source} / {self} has no published date '
+                              f'set but is already marked to be skipped')
+            else:
+                if max_cap_age:
+                    if published > max_cap_age and self.skip:
+                        # Media was published after the cap date but is set to be skipped
+                        log.info(f'Media: {self.source} / {self} has a valid '
+                                 f'publishing date, marking to be unskipped')
+                        self.skip = False
+                        changed = True
+                    elif published <= max_cap_age and not self.skip:
+                        log.info(f'Media: {self.source} / {self} is too old for '
+                                 f'the download cap date, marking to be skipped')
+                        self.skip = True
+                        changed = True
+                else:
+                    if self.skip:
+                        # Media marked to be skipped but source download cap removed
+                        log.info(f'Media: {self.source} / {self} has a valid '
+                                 f'publishing date, marking to be unskipped')
+                        self.skip = False
+                        changed = True
+        # Recalculate the "can_download" flag, this may need to change if the source
+        # specifications have been changed
+        if self.has_metadata:
+            can_download = bool(self.get_format_str())
+            if can_download != self.can_download:
+                self.can_download = can_download
+                changed = True
+        return changed
+
+    @property
+    def needs_download(self):
+        return (not self.downloaded and self.can_download and not self.skip and
+                self.source.download_media)
+
     def get_display_format(self, format_str):
         '''
             Returns a tuple used in the format component of the output filename. This
@@ -904,12 +1356,9 @@ class Media(models.Model):
 
     def get_format_by_code(self, format_code):
         '''
-            Matches a format code, such as '22', to a processed format dict.
+            Matches a format code, such as '22', to a processed format.
         '''
-        for fmt in self.iter_formats():
-            if format_code == fmt['id']:
-                return fmt
-        return False
+        return self.parsed_formats.by_id.get(format_code, False)
 
     @property
     def format_dict(self):
@@ -943,19 +1392,26 @@ class Media(models.Model):
             'hdr': display_format['hdr'],
         }
 
-    @property
-    def has_metadata(self):
-        return self.metadata is not None
-
     @property
     def loaded_metadata(self):
+        '''
+            Returns the parsed metadata dict. Parsing is expensive for large metadata
+            so the result is cached against the exact metadata string it was parsed
+            from, reassigning .metadata (or reloading it from the database) will
+            invalidate the cache on the next access.
+        '''
+        metadata = self.metadata
+        cached = self.__dict__.get('_loaded_metadata_cache')
+        if cached is not None and cached[0] is metadata:
+            return cached[1]
         try:
-            data = json.loads(self.metadata)
+            data = json_loads(metadata)
             if not isinstance(data, dict):
-                return {}
-            return data
+                data = {}
         except Exception as e:
-            return {}
+            data = {}
+        self._loaded_metadata_cache = (metadata, data)
+        return data
 
     @property
     def url(self):
@@ -968,7 +1424,7 @@ class Media(models.Model):
         return self.loaded_metadata.get(field, '').strip()
 
     @property
-    def title(self):
+    def metadata_title(self):
         field = self.get_metadata_field('title')
         return self.loaded_metadata.get(field, '').strip()
 
@@ -978,7 +1434,7 @@ class Media(models.Model):
         return slugify(replaced)[:80]
 
     @property
-    def thumbnail(self):
+    def metadata_thumbnail(self):
         field = self.get_metadata_field('thumbnail')
         return self.loaded_metadata.get(field, '').strip()
 
@@ -1000,7 +1456,7 @@ class Media(models.Model):
             return None
 
     @property
-    def duration(self):
+    def metadata_duration(self):
         field = self.get_metadata_field('duration')
         duration = self.loaded_metadata.get(field, 0)
         try:
@@ -1044,7 +1500,7 @@ class Media(models.Model):
         return self.loaded_metadata.get(field, 0)
 
     @property
-    def uploader(self):
+    def metadata_uploader(self):
         field = self.get_metadata_field('uploader')
         return self.loaded_metadata.get(field, '')
 
@@ -1120,13 +1576,13 @@ class Media(models.Model):
     def thumb_file_exists(self):
         if not self.thumb:
             return False
-        return os.path.exists(self.thumb.path)
+        return file_exists(self.thumb.path)
 
     @property
     def media_file_exists(self):
         if not self.media_file:
             return False
-        return os.path.exists(self.media_file.path)
+        return file_exists(self.media_file.path)
 
     @property
     def nfoxml(self):
@@ -1266,6 +1722,147 @@ class Media(models.Model):
                             f'has no indexer')
         return indexer(self.url)
 
+    def update_metadata(self, metadata):
+        '''
+            Stores newly downloaded metadata as a dict and sets the published date
+            and "skip" and "can_download" flags from it. The media is not saved.
+        '''
+        source = self.source
+        if settings.MEDIA_METADATA_SLIM:
+            metadata = self.slim_metadata(metadata)
+        self.metadata = json_dumps(metadata)
+        upload_date = self.upload_date
+        # Media must have a valid upload date
+        if upload_date:
+            self.published = timezone.make_aware(upload_date)
+        else:
+            log.error(f'Media has no upload date, skipping: {source} / {self}')
+            self.skip = True
+        # If the source has a download cap date check the upload date is allowed
+        max_cap_age = source.download_cap_date
+        if self.published and max_cap_age:
+            if self.published < max_cap_age:
+                # Media was published after the cap date, skip it
+                log.warn(f'Media: {source} / {self} is older than cap age '
+                         f'{max_cap_age}, skipping')
+                self.skip = True
+        # If the source has a cut-off check the upload date is within the allowed delta
+        if source.delete_old_media and source.days_to_keep > 0:
+            if not isinstance(self.published, datetime):
+                # Media has no known published date or incomplete metadata
+                log.warn(f'Media: {source} / {self} has no published date, skipping')
+                self.skip = True
+            else:
+                delta = timezone.now() - timedelta(days=source.days_to_keep)
+                if self.published < delta:
+                    # Media was published after the cutoff date, skip it
+                    log.warn(f'Media: {source} / {self} is older than '
+                             f'{source.days_to_keep} days, skipping')
+                    self.skip = True
+        # Check we can download the media item
+        if not self.skip:
+            if self.get_format_str():
+                self.can_download = True
+            else:
+                self.can_download = False
+
+    def slim_metadata(self, metadata):
+        '''
+            Returns the metadata dict with the transient data configured in
+            MEDIA_METADATA_DROP_KEYS and MEDIA_METADATA_FORMAT_KEYS removed. Fields
+            the media reads through METADATA_FIELDS are always kept.
+        '''
+        keep_keys = [self.get_metadata_field(f) for f in self.METADATA_FIELDS]
+        return slim_metadata(metadata,
+                             drop_keys=settings.MEDIA_METADATA_DROP_KEYS,
+                             keep_keys=keep_keys,
+                             formats_key=self.get_metadata_field('formats'),
+                             format_keys=settings.MEDIA_METADATA_FORMAT_KEYS)
+
+
+class MediaMetadata(models.Model):
+    '''
+        The metadata of a Media item. It is stored in its own table so querying
+        media doesn't need to load the (often large) metadata. The metadata is
+        stored either as plain JSON or compressed with the codec recorded in codec.
+    '''
+
+    media = models.OneToOneField(
+        Media,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name='media_metadata',
+        help_text=_('Media the metadata is for')
+    )
+    data = models.TextField(
+        _('data'),
+        blank=True,
+        null=True,
+        help_text=_('JSON encoded metadata for the media, if stored uncompressed')
+    )
+    compressed = models.BinaryField(
+        _('compressed'),
+        blank=True,
+        null=True,
+        help_text=_('Compressed JSON encoded metadata for the media')
+    )
+    codec = models.CharField(
+        _('codec'),
+        max_length=8,
+        blank=True,
+        default='',
+        help_text=_('Codec the metadata is compressed with, blank if uncompressed')
+    )
+
+    # Fields the metadata is stored in
+    STORAGE_FIELDS = ('data', 'compressed', 'codec')
+
+    def __str__(self):
+        return f'Metadata for: {self.media_id}'
+
+    class Meta:
+        verbose_name = _('Media metadata')
+        verbose_name_plural = _('Media metadata')
+
+    @property
+    def metadata(self):
+        '''
+            Returns the JSON encoded metadata string. Compressed metadata is
+            decompressed once and cached against the exact compressed value it came
+            from.
+        '''
+        if not self.codec:
+            return self.data
+        compressed = self.compressed
+        cached = self.__dict__.get('_decompressed_cache')
+        if cached is not None and cached[0] is compressed:
+            return cached[1]
+        metadata = decompress_metadata(compressed, self.codec)
+        self._decompressed_cache = (compressed, metadata)
+        return metadata
+
+    def store(self, metadata, codec):
+        '''
+            Sets the metadata, compressing it with the named codec. An empty codec
+            stores the metadata uncompressed.
+        '''
+        if metadata and codec:
+            compressed = compress_metadata(metadata, codec)
+            self.data = None
+            self.compressed = compressed
+            self.codec = codec
+            self._decompressed_cache = (compressed, metadata)
+        else:
+            self.data = metadata
+            self.compressed = None
+            self.codec = ''
+
+    @property
+    def stored_size(self):
+        if self.codec:
+            return len(self.compressed or b'')
+        return len((self.data or '').encode('utf-8'))
+
 
 class MediaServer(models.Model):
     '''
@@ -6,11 +6,13 @@ from django.utils.translation import gettext_lazy as _
 from background_task.signals import task_failed
 from background_task.models import Task
 from common.logger import log
-from .models import Source, Media, MediaServer
+from .models import Source, Media
 from .tasks import (delete_task_by_source, delete_task_by_media, index_source_task,
-                    download_media_thumbnail, download_media_metadata,
+                    schedule_index_source_task, schedule_update_source_media,
+                    schedule_task, get_media_tasks, download_media_metadata,
                     map_task_to_instance, check_source_directory_exists,
-                    download_media, rescan_media_server)
+                    delete_source_media, schedule_media_server_rescans,
+                    bulk_deletion)
 from .utils import delete_file
 
 
@@ -18,23 +20,13 @@ from .utils import delete_file
 def source_pre_save(sender, instance, **kwargs):
     # Triggered before a source is saved, if the schedule has been updated recreate
     # its indexing task
-    try:
-        existing_source = Source.objects.get(pk=instance.pk)
-    except Source.DoesNotExist:
-        # Probably not possible?
+    if instance._state.adding:
+        # New sources are scheduled to be indexed once they have been created
         return
-    if existing_source.index_schedule != instance.index_schedule:
+    if 'index_schedule' in instance.changed_fields:
         # Indexing schedule has changed, recreate the indexing task
         delete_task_by_source('sync.tasks.index_source_task', instance.pk)
-        verbose_name = _('Index media from source "{}"')
-        index_source_task(
-            str(instance.pk),
-            repeat=instance.index_schedule,
-            queue=str(instance.pk),
-            priority=5,
-            verbose_name=verbose_name.format(instance.name),
-            remove_existing_tasks=True
-        )
+        schedule_index_source_task(instance)
 
 
 @receiver(post_save, sender=Source)
@@ -47,31 +39,23 @@ def source_post_save(sender, instance, created, **kwargs):
             priority=0,
             verbose_name=verbose_name.format(instance.name)
         )
-        if instance.index_schedule > 0:
+        if instance.index_schedule != Source.IndexSchedule.NEVER:
             delete_task_by_source('sync.tasks.index_source_task', instance.pk)
             log.info(f'Scheduling media indexing for source: {instance.name}')
-            verbose_name = _('Index media from source "{}"')
-            index_source_task(
-                str(instance.pk),
-                repeat=instance.index_schedule,
-                queue=str(instance.pk),
-                priority=5,
-                verbose_name=verbose_name.format(instance.name),
-                remove_existing_tasks=True
-            )
-    # Trigger the post_save signal for each media item linked to this source as various
-    # flags may need to be recalculated
-    for media in Media.objects.filter(source=instance):
-        media.save()
+            schedule_index_source_task(instance)
+    # Various flags on the media linked to this source may need to be recalculated
+    # if settings which affect them have changed, do this in bulk in the background
+    # rather than saving each media item here. Saves which only change fields such
+    # as the last crawl time don't affect the media
+    elif instance.changed_fields.intersection(Source.MEDIA_UPDATE_FIELDS):
+        schedule_update_source_media(instance)
 
 
 @receiver(pre_delete, sender=Source)
 def source_pre_delete(sender, instance, **kwargs):
-    # Triggered before a source is deleted, delete all media objects to trigger
-    # the Media models post_delete signal
-    for media in Media.objects.filter(source=instance):
-        log.info(f'Deleting media for source: {instance.name} item: {media.name}')
-        media.delete()
+    # Triggered before a source is deleted, delete all media objects in bulk
+    log.info(f'Deleting media for source: {instance.name}')
+    delete_source_media(instance)
 
 
 @receiver(post_delete, sender=Source)
@@ -89,110 +73,48 @@ def task_task_failed(sender, task_id, completed_task, **kwargs):
         log.error(f'Permanent failure for source: {obj} task: {completed_task}')
         obj.has_failed = True
         obj.save()
+        if (completed_task.task_name == 'sync.tasks.index_source_task' and
+                obj.index_schedule == Source.IndexSchedule.ADAPTIVE):
+            # Adaptive indexes schedule the next index when they complete, keep
+            # indexing the source after a permanent failure
+            schedule_index_source_task(obj)
 
 
 @receiver(post_save, sender=Media)
 def media_post_save(sender, instance, created, **kwargs):
-    # Triggered after media is saved
-    cap_changed = False
-    can_download_changed = False
-    # Reset the skip flag if the download cap has changed if the media has not
-    # already been downloaded
-    if not instance.downloaded:
-        max_cap_age = instance.source.download_cap_date
-        published = instance.published
-        if not published:
-            if not instance.skip:
-                log.warn(f'Media: {instance.source} / {instance} has no published date '
-                         f'set, marking to be skipped')
-                instance.skip = True
-                cap_changed = True
-            else:
-                log.debug(f'Media: {instance.source} / {instance} has no published date '
-                          f'set but is already marked to be skipped')
-        else:
-            if max_cap_age:
-                if published > max_cap_age and instance.skip:
-                    # Media was published after the cap date but is set to be skipped
-                    log.info(f'Media: {instance.source} / {instance} has a valid '
-                            f'publishing date, marking to be unskipped')
-                    instance.skip = False
-                    cap_changed = True
-                elif published <= max_cap_age and not instance.skip:
-                    log.info(f'Media: {instance.source} / {instance} is too old for '
-                            f'the download cap date, marking to be skipped')
-                    instance.skip = True
-                    cap_changed = True
-            else:
-                if instance.skip:
-                    # Media marked to be skipped but source download cap removed
-                    log.info(f'Media: {instance.source} / {instance} has a valid '
-                            f'publishing date, marking to be unskipped')
-                    instance.skip = False
-                    cap_changed = True
-    # Recalculate the "can_download" flag, this may
-    # need to change if the source specifications have been changed
-    if instance.metadata:
-        if instance.get_format_str():
-            if not instance.can_download:
-                instance.can_download = True
-                can_download_changed = True
-        else:
-            if instance.can_download:
-                instance.can_download = False
-                can_download_changed = True
-    # Save the instance if any changes were required
-    if cap_changed or can_download_changed:
-        post_save.disconnect(media_post_save, sender=Media)
-        instance.save()
-        post_save.connect(media_post_save, sender=Media)
+    # Triggered after media is saved, recalculate the "skip" and "can_download"
+    # flags as the source download cap or specifications may have changed
+    flags_changed = instance.refresh_download_flags()
+    # Store any changes that were required without saving the instance again
+    if flags_changed:
+        update_fields = ('skip', 'can_download') + Media.MATCHED_FORMAT_FIELDS
+        Media.objects.filter(pk=instance.pk).update(
+            **{field: getattr(instance, field) for field in update_fields})
     # If the media is missing metadata schedule it to be downloaded
-    if not instance.metadata:
+    if instance.needs_metadata:
         log.info(f'Scheduling task to download metadata for: {instance.url}')
         verbose_name = _('Downloading metadata for "{}"')
-        download_media_metadata(
-            str(instance.pk),
-            priority=10,
-            verbose_name=verbose_name.format(instance.pk),
-            remove_existing_tasks=True
-        )
-    # If the media is missing a thumbnail schedule it to be downloaded
+        schedule_task(download_media_metadata, (str(instance.pk),), {
+            'priority': 10,
+            'verbose_name': verbose_name.format(instance.pk),
+        })
+    # If the media is missing a thumbnail or has not yet been downloaded schedule it
+    # to be downloaded
     if not instance.thumb_file_exists:
         instance.thumb = None
-    if not instance.thumb:
-        thumbnail_url = instance.thumbnail
-        if thumbnail_url:
-            log.info(f'Scheduling task to download thumbnail for: {instance.name} '
-                     f'from: {thumbnail_url}')
-            verbose_name = _('Downloading thumbnail for "{}"')
-            download_media_thumbnail(
-                str(instance.pk),
-                thumbnail_url,
-                queue=str(instance.source.pk),
-                priority=10,
-                verbose_name=verbose_name.format(instance.name),
-                remove_existing_tasks=True
-            )
-    # If the media has not yet been downloaded schedule it to be downloaded
     if not instance.media_file_exists:
-        instance.downloaded = False
         instance.media_file = None
-    if (not instance.downloaded and instance.can_download and not instance.skip
-        and instance.source.download_media):
-        delete_task_by_media('sync.tasks.download_media', (str(instance.pk),))
-        verbose_name = _('Downloading media for "{}"')
-        download_media(
-            str(instance.pk),
-            queue=str(instance.source.pk),
-            priority=15,
-            verbose_name=verbose_name.format(instance.name),
-            remove_existing_tasks=True
-        )
+    for task, (args, options) in get_media_tasks(instance):
+        log.info(f'Scheduling task: {options["verbose_name"]}')
+        schedule_task(task, args, options)
 
 
 @receiver(pre_delete, sender=Media)
 def media_pre_delete(sender, instance, **kwargs):
     # Triggered before media is deleted, delete any scheduled tasks
+    if getattr(bulk_deletion, 'source_id', None) == str(instance.source_id):
+        # The tasks for all the source media have already been deleted
+        return
     log.info(f'Deleting tasks for media: {instance.name}')
     delete_task_by_media('sync.tasks.download_media', (str(instance.pk),))
     thumbnail_url = instance.thumbnail
@@ -204,12 +126,7 @@ def media_pre_delete(sender, instance, **kwargs):
 @receiver(post_delete, sender=Media)
 def media_post_delete(sender, instance, **kwargs):
     # Schedule a task to update media servers
-    for mediaserver in MediaServer.objects.all():
-        log.info(f'Scheduling media server updates')
-        verbose_name = _('Request media server rescan for "{}"')
-        rescan_media_server(
-            str(mediaserver.pk),
-            priority=0,
-            verbose_name=verbose_name.format(mediaserver),
-            remove_existing_tasks=True
-        )
+    if getattr(bulk_deletion, 'source_id', None) == str(instance.source_id):
+        # Media servers are updated once all the source media has been deleted
+        return
+    schedule_media_server_rescans()
@@ -8,24 +8,32 @@ import os
 import json
 import math
 import uuid
+import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from io import BytesIO
+from pathlib import Path
 from hashlib import sha1
 from datetime import timedelta, datetime
 from shutil import copyfile
 from PIL import Image
 from django.conf import settings
+from django.db import transaction
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
-from django.db.utils import IntegrityError
+from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
 from background_task import background
 from background_task.models import Task, CompletedTask
 from common.logger import log
 from common.errors import NoMediaException, DownloadFailedException
-from common.utils import json_serial
-from .models import Source, Media, MediaServer
+from .models import Source, Media, MediaMetadata, MediaServer, media_file_storage
 from .utils import (get_remote_image, resize_image_to_height, delete_file,
                     write_text_file)
+from .feeds import FeedError, get_feed_media_keys
 
 
 def get_hash(task_name, pk):
@@ -45,6 +53,9 @@ def map_task_to_instance(task):
     TASK_MAP = {
         'sync.tasks.index_source_task': Source,
         'sync.tasks.check_source_directory_exists': Source,
+        'sync.tasks.update_source_media': Source,
+        'sync.tasks.download_media_metadata_batch': Source,
+        'sync.tasks.delete_source': Source,
         'sync.tasks.download_media_thumbnail': Media,
         'sync.tasks.download_media': Media,
     }
@@ -120,9 +131,110 @@ def delete_task_by_source(task_name, source_id):
 
 
 def delete_task_by_media(task_name, args):
+    # Also drop the task if it is waiting to be scheduled
+    pending = getattr(task_buffer, 'pending', None)
+    if pending:
+        pending.pop((task_name, tuple(args)), None)
     return Task.objects.drop_task(task_name, args=args)
 
 
+def schedule_index_source_task(source):
+    '''
+        Schedules the task to index a source at the time from Source.get_next_index()
+        so the indexes of many sources are staggered rather than all running at once.
+        Sources with a fixed index schedule get a repeating task. Sources with the
+        adaptive index schedule get a single task which schedules the next index once
+        it has run.
+    '''
+    verbose_name = _('Index media from source "{}"')
+    run_at = source.get_next_index()
+    options = {
+        'schedule': run_at,
+        'queue': str(source.pk),
+        'priority': 5,
+        'verbose_name': verbose_name.format(source.name),
+        'remove_existing_tasks': True,
+    }
+    if source.index_schedule == Source.IndexSchedule.ADAPTIVE:
+        log.info(f'Scheduling adaptive index of source: {source} at {run_at}')
+        index_source_task(str(source.pk), **options)
+    else:
+        log.info(f'Scheduling index of source: {source} at {run_at}')
+        index_source_task(str(source.pk), repeat=source.index_schedule, **options)
+
+
+def schedule_update_source_media(source):
+    '''
+        Schedules the background task to recalculate the flags of, and schedule any
+        tasks needed by, every media item for a source, replacing any already
+        waiting to run.
+    '''
+    verbose_name = _('Update media for source "{}"')
+    update_source_media(
+        str(source.pk),
+        queue=str(source.pk),
+        priority=1,
+        verbose_name=verbose_name.format(source.name),
+        remove_existing_tasks=True
+    )
+
+
+def get_index_load(start, hours=24):
+    '''
+        Returns how many source indexes are scheduled to run in each hour from
+        "start" as a list of (hour, sources) tuples, following repeating index tasks
+        through the period. Overdue tasks are counted in the first hour.
+    '''
+    end = start + timedelta(hours=hours)
+    buckets = [[] for _ in range(hours)]
+    sources = {str(s.pk): s for s in Source.objects.all()}
+    tasks = Task.objects.filter(task_name='sync.tasks.index_source_task')
+    for task in tasks:
+        source = sources.get(task.queue)
+        if not source:
+            continue
+        run_at = task.run_at
+        if run_at < start:
+            # Overdue tasks run now and repeat from their original schedule
+            buckets[0].append(source)
+            if not task.repeat:
+                continue
+            repeats = math.floor((start - run_at).total_seconds() / task.repeat) + 1
+            run_at += timedelta(seconds=task.repeat * repeats)
+        while run_at < end:
+            hour = int((run_at - start).total_seconds() // 3600)
+            buckets[hour].append(source)
+            if not task.repeat:
+                break
+            run_at += timedelta(seconds=task.repeat)
+    return [(start + timedelta(hours=i), bucket) for i, bucket in enumerate(buckets)]
+
+
+def schedule_tasks_in_bulk(task, tasks, batch_size=500):
+    '''
+        Schedules many instances of a background task at once rather than one at a
+        time. "tasks" is an iterable of (args, options) tuples where the options are
+        the keyword arguments the task would normally be called with, such as
+        priority, queue and verbose_name. Existing tasks with the same arguments are
+        replaced unless they are already running. Returns the number of tasks
+        scheduled.
+    '''
+    new_tasks = {}
+    for args, options in tasks:
+        new_task = Task.objects.new_task(task.name, args=args, **options)
+        new_tasks[new_task.task_hash] = new_task
+    task_hashes = list(new_tasks.keys())
+    for i in range(0, len(task_hashes), batch_size):
+        existing = Task.objects.filter(task_hash__in=task_hashes[i:i + batch_size])
+        for task_hash in existing.filter(locked_at__isnull=False).values_list(
+                'task_hash', flat=True):
+            # Task is already running, leave it alone
+            new_tasks.pop(task_hash, None)
+        existing.filter(locked_at__isnull=True).delete()
+    Task.objects.bulk_create(new_tasks.values(), batch_size=batch_size)
+    return len(new_tasks)
+
+
 def cleanup_completed_tasks():
     days_to_keep = getattr(settings, 'COMPLETED_TASKS_DAYS_TO_KEEP', 30)
     delta = timezone.now() - timedelta(days=days_to_keep)
@@ -144,10 +256,209 @@ def cleanup_old_media():
                 media.delete()
 
 
+def schedule_metadata_batches(source, media_ids, replace=False):
+    '''
+        Schedules download_media_metadata_batch tasks to download the metadata for
+        media of a source by ID, MEDIA_METADATA_BATCH_SIZE media items per task. If
+        "replace" is set any batches already waiting to run for the source are
+        deleted first. Returns the number of tasks scheduled.
+    '''
+    if replace:
+        Task.objects.filter(task_name=download_media_metadata_batch.name,
+                            queue=str(source.pk), locked_at__isnull=True).delete()
+    media_ids = [str(media_id) for media_id in media_ids]
+    batch_size = getattr(settings, 'MEDIA_METADATA_BATCH_SIZE', 25)
+    verbose_name = _('Downloading metadata for {} media items from "{}"')
+    tasks = []
+    for i in range(0, len(media_ids), batch_size):
+        chunk = media_ids[i:i + batch_size]
+        tasks.append(((str(source.pk), chunk), {
+            'queue': str(source.pk),
+            'priority': 10,
+            'verbose_name': verbose_name.format(len(chunk), source.name),
+        }))
+    return schedule_tasks_in_bulk(download_media_metadata_batch, tasks)
+
+
+def get_media_tasks(media):
+    '''
+        Returns a list of the (task, (args, options)) pairs for the thumbnail and
+        download tasks a media item needs, the same tasks as the media post_save
+        signal schedules, suitable for schedule_media_tasks().
+    '''
+    tasks = []
+    if not media.thumb_file_exists and media.thumbnail:
+        verbose_name = _('Downloading thumbnail for "{}"')
+        tasks.append((download_media_thumbnail, ((str(media.pk), media.thumbnail), {
+            'queue': str(media.source.pk),
+            'priority': 10,
+            'verbose_name': verbose_name.format(media.name),
+        })))
+    if not media.media_file_exists:
+        media.downloaded = False
+    if media.needs_download:
+        verbose_name = _('Downloading media for "{}"')
+        tasks.append((download_media, ((str(media.pk),), {
+            'queue': str(media.source.pk),
+            'priority': 15,
+            'verbose_name': verbose_name.format(media.name),
+        })))
+    return tasks
+
+
+def schedule_media_tasks(media_tasks, batch_size=500):
+    '''
+        Schedules the (task, (args, options)) pairs returned by get_media_tasks() for
+        many media items in bulk. Returns the number of tasks scheduled.
+    '''
+    by_task = {}
+    for task, task_args in media_tasks:
+        by_task.setdefault(task, []).append(task_args)
+    scheduled = 0
+    for task, tasks in by_task.items():
+        scheduled += schedule_tasks_in_bulk(task, tasks, batch_size=batch_size)
+    return scheduled
+
+
+# Tasks waiting to be scheduled by the scheduled_tasks_buffer() block running in
+# each thread
+task_buffer = threading.local()
+
+
+# Set to the ID of the source whose media is being deleted in bulk by
+# delete_source_media() in each thread so the media delete signals can skip the
+# per-media work it does once for all of the media
+bulk_deletion = threading.local()
+
+
+@contextmanager
+def scheduled_tasks_buffer():
+    '''
+        Collects the tasks scheduled with schedule_task() while the block runs and
+        schedules them in bulk once it exits rather than one at a time. A task
+        scheduled more than once with the same arguments is only scheduled once,
+        with the options it was last scheduled with. If the block exits inside a
+        transaction the tasks are scheduled when it commits and dropped if it is
+        rolled back. Nested blocks share the buffer of the outermost block. Can also
+        be used as a decorator.
+    '''
+    if getattr(task_buffer, 'pending', None) is not None:
+        yield
+        return
+    pending = task_buffer.pending = {}
+    try:
+        yield
+    finally:
+        task_buffer.pending = None
+        if pending:
+            transaction.on_commit(partial(schedule_media_tasks,
+                                          list(pending.values())))
+
+
+def schedule_task(task, args, options):
+    '''
+        Schedules a background task with the positional "args" and the keyword
+        "options" it would normally be called with, replacing any existing task with
+        the same arguments unless it is already running. Inside a
+        scheduled_tasks_buffer() block the task is scheduled when the block exits,
+        otherwise it is scheduled now or when the current transaction commits.
+    '''
+    args = tuple(args)
+    pending = getattr(task_buffer, 'pending', None)
+    if pending is None:
+        transaction.on_commit(partial(schedule_tasks_in_bulk, task,
+                                      [(args, options)]))
+    else:
+        pending[(task.name, args)] = (task, (args, options))
+
+
+def save_media_metadata_in_bulk(media_items, batch_size=500):
+    '''
+        Saves media items which have had their metadata updated with
+        Media.update_metadata() in bulk, then schedules any thumbnail or download
+        tasks they need. This does what saving each media item would without
+        triggering the media signals.
+    '''
+    update_fields = (Media.METADATA_COPIED_FIELDS + Media.MATCHED_FORMAT_FIELDS +
+                     ('metadata_version', 'published', 'skip', 'can_download'))
+    new_storage, existing_storage = [], []
+    for media in media_items:
+        media.copy_metadata_fields()
+        media.get_format_str()
+        media.refresh_download_flags()
+        storage = media.media_metadata
+        if storage._state.adding:
+            new_storage.append(storage)
+        else:
+            existing_storage.append(storage)
+    Media.objects.bulk_update(media_items, update_fields, batch_size=batch_size)
+    MediaMetadata.objects.bulk_create(new_storage, batch_size=batch_size)
+    MediaMetadata.objects.bulk_update(existing_storage, MediaMetadata.STORAGE_FIELDS,
+                                      batch_size=batch_size)
+    media_tasks = []
+    for media in media_items:
+        media_tasks.extend(get_media_tasks(media))
+    return schedule_media_tasks(media_tasks, batch_size=batch_size)
+
+
+def create_indexed_media(source, media_items, batch_size):
+    '''
+        Creates newly indexed Media objects in bulk and schedules their metadata
+        to be downloaded. Media created at the same time elsewhere is ignored
+        rather than failing.
+    '''
+    Media.objects.bulk_create(media_items, batch_size=batch_size,
+                              ignore_conflicts=True)
+    # Rows which conflicted with media created elsewhere were not inserted, only
+    # media which now exists with the primary keys created here is new
+    created = set(Media.objects.filter(
+        source=source,
+        pk__in=[media.pk for media in media_items]
+    ).values_list('pk', flat=True))
+    media_items = [media for media in media_items if media.pk in created]
+    for media in media_items:
+        log.info(f'Indexed media: {source} / {media}')
+    # New media has no metadata yet, schedule it to be downloaded unless the media
+    # was already skipped from its flat metadata
+    schedule_metadata_batches(source, [media.pk for media in media_items
+                                       if media.needs_metadata])
+
+
+def probe_source_feed(source, existing_keys):
+    '''
+        Checks the feed of recent uploads for a source for media which hasn't been
+        indexed yet, using the function named by INDEX_FEED_FETCHER to fetch it.
+        Returns False if every media item in the feed is in "existing_keys" and True
+        if there is new media or the feed couldn't be checked.
+    '''
+    url = source.feed_url
+    if not url:
+        return True
+    fetcher = import_string(getattr(settings, 'INDEX_FEED_FETCHER',
+                                    'sync.feeds.fetch_feed'))
+    try:
+        keys = get_feed_media_keys(url, fetcher=fetcher)
+    except FeedError as e:
+        log.warn(f'Failed to check the feed of source: {source}: {e}')
+        return True
+    if not keys:
+        # An empty feed can't show that there's no new media
+        return True
+    new_keys = set(keys) - existing_keys
+    log.info(f'Found {len(new_keys)} new media items in the feed of source: {source}')
+    return bool(new_keys)
+
+
 @background(schedule=0)
-def index_source_task(source_id):
+def index_source_task(source_id, full=False):
     '''
-        Indexes media available from a Source object.
+        Indexes media available from a Source object. Unless "full" is set or the
+        source is due a full crawl, indexing stops once INDEX_INCREMENTAL_STOP_AFTER
+        already indexed media items in a row have been found as channels and
+        playlists are returned newest first. Media is consumed as each page of
+        results is fetched and new media is created in batches. The number of media
+        items processed is checkpointed after each batch so if indexing fails the
+        next attempt resumes where it stopped.
     '''
     try:
         source = Source.objects.get(pk=source_id)
@@ -159,32 +470,79 @@ def index_source_task(source_id):
     source.has_failed = False
     source.save()
     # Index the source
-    videos = source.index_media()
-    if not videos:
+    full = full or source.needs_full_crawl
+    stop_after = 0 if full else getattr(settings, 'INDEX_INCREMENTAL_STOP_AFTER', 0)
+    batch_size = getattr(settings, 'MEDIA_BULK_BATCH_SIZE', 500)
+    resume_from = source.index_checkpoint
+    if resume_from:
+        # The last index of this source failed, skip the media it already processed
+        # and don't stop at the known media it created
+        log.info(f'Resuming index of source: {source} after {resume_from} media '
+                 f'items')
+        stop_after = 0
+    # Only create media which hasn't been indexed before, the flags of existing
+    # media are recalculated by the update_source_media task scheduled when the
+    # source settings are changed
+    existing_keys = set(Media.objects.filter(source=source).values_list('key',
+                                                                         flat=True))
+    # Incremental indexes are skipped if the feed of recent uploads has no new media
+    quiet = (not full and not resume_from and
+             getattr(settings, 'INDEX_FEED_PROBE', False) and
+             not probe_source_feed(source, existing_keys))
+    if quiet:
+        log.info(f'No new media in the feed of source: {source}, skipping index')
+        videos = ()
+    else:
+        log.info(f'Starting {"full" if full else "incremental"} index of source: '
+                 f'{source}')
+        videos = source.iter_index_media(start=resume_from)
+    new_media = []
+    found, created, known_in_a_row = resume_from, 0, 0
+    for video in videos:
+        found += 1
+        key = video.get(source.key_field, None)
+        if not key:
+            # Video has no unique key (ID), it can't be indexed
+            continue
+        if key in existing_keys:
+            known_in_a_row += 1
+            if stop_after and known_in_a_row >= stop_after:
+                log.info(f'Found {known_in_a_row} already indexed media items in a '
+                         f'row, stopping incremental index of source: {source}')
+                break
+            continue
+        known_in_a_row = 0
+        existing_keys.add(key)
+        media = Media(key=key, source=source)
+        media.copy_index_fields(video)
+        media.refresh_download_flags()
+        new_media.append(media)
+        if len(new_media) >= batch_size:
+            create_indexed_media(source, new_media, batch_size)
+            created += len(new_media)
+            new_media = []
+            # Checkpoint the progress without triggering the source signals
+            Source.objects.filter(pk=source.pk).update(index_checkpoint=found)
+            log.info(f'Indexed {found} media items so far for source: {source}')
+    create_indexed_media(source, new_media, batch_size)
+    created += len(new_media)
+    if not found and not quiet:
         raise NoMediaException(f'Source "{source}" (ID: {source_id}) returned no '
                                f'media to index, is the source key valid? Check the '
                                f'source configuration is correct and that the source '
                                f'is reachable')
-    # Got some media, update the last crawl timestamp
+    # Got some media or the feed showed there was none, update the last crawl
+    # timestamp
     source.last_crawl = timezone.now()
+    if full:
+        source.last_full_crawl = source.last_crawl
+    source.index_checkpoint = 0
     source.save()
-    log.info(f'Found {len(videos)} media items for source: {source}')
-    for video in videos:
-        # Create or update each video as a Media object
-        key = video.get(source.key_field, None)
-        if not key:
-            # Video has no unique key (ID), it can't be indexed
-            continue
-        try:
-            media = Media.objects.get(key=key, source=source)
-        except Media.DoesNotExist:
-            media = Media(key=key)
-        media.source = source
-        try:
-            media.save()
-            log.info(f'Indexed media: {source} / {media}')
-        except IntegrityError as e:
-            log.error(f'Index media failed: {source} / {media} with "{e}"')
+    log.info(f'Found {found} media items and indexed {created} new media items for '
+             f'source: {source}')
+    if source.index_schedule == Source.IndexSchedule.ADAPTIVE:
+        # Adaptive indexes are single tasks, schedule the next one
+        schedule_index_source_task(source)
     # Tack on a cleanup of old completed tasks
     cleanup_completed_tasks()
     # Tack on a cleanup of old media
@@ -212,6 +570,162 @@ def check_source_directory_exists(source_id):
 
 
 @background(schedule=0)
+def update_source_media(source_id):
+    '''
+        Recalculates the "skip" and "can_download" flags of every media item for a
+        source, for example after the source format requirements or download cap
+        have been changed. Media is loaded and updated in batches and any metadata,
+        thumbnail and download tasks the media now needs are scheduled at once.
+    '''
+    try:
+        source = Source.objects.get(pk=source_id)
+    except Source.DoesNotExist:
+        # Task triggered but the Source has been deleted, do nothing
+        return
+    batch_size = getattr(settings, 'MEDIA_BULK_BATCH_SIZE', 500)
+    update_fields = ('skip', 'can_download') + Media.MATCHED_FORMAT_FIELDS
+    media_pks = list(Media.objects.filter(source=source).values_list('pk', flat=True))
+    log.info(f'Updating {len(media_pks)} media items for source: {source}')
+    start = time.monotonic()
+    updated = 0
+    metadata_ids, media_tasks = [], []
+    for i in range(0, len(media_pks), batch_size):
+        batch = []
+        chunk = media_pks[i:i + batch_size]
+        for media in Media.objects.filter(pk__in=chunk).select_related('media_metadata'):
+            media.source = source
+            matched_format_key = media.matched_format_key
+            if (media.refresh_download_flags() or
+                    media.matched_format_key != matched_format_key):
+                batch.append(media)
+            if media.needs_metadata:
+                metadata_ids.append(media.pk)
+            media_tasks.extend(get_media_tasks(media))
+        Media.objects.bulk_update(batch, update_fields)
+        updated += len(batch)
+        log.info(f'Processed {i + len(chunk)} of {len(media_pks)} media items for '
+                 f'source: {source} ({updated} updated)')
+    # This replaces any metadata batches already scheduled as they are a subset
+    scheduled = schedule_metadata_batches(source, metadata_ids, replace=True)
+    scheduled += schedule_media_tasks(media_tasks, batch_size=batch_size)
+    log.info(f'Updated {updated} of {len(media_pks)} media items and scheduled '
+             f'{scheduled} tasks for source: {source} in '
+             f'{time.monotonic() - start:.1f}s')
+
+
+def delete_source_files(source, media_files):
+    '''
+        Deletes the downloaded media files named in "media_files" for a source along
+        with any thumbnail, NFO and JSON files saved next to them. The source
+        directory is scanned once rather than checking for each file in turn.
+        Returns the number of files deleted.
+    '''
+    directory = source.directory_path
+    targets = set()
+    for name in media_files:
+        # Imported media files are stored by their absolute path
+        if os.path.isabs(name):
+            path = Path(name)
+        else:
+            path = Path(media_file_storage.path(name))
+        prefix, ext = os.path.splitext(path.name)
+        targets.add(str(path))
+        for sidecar in ('.jpg', '.nfo', '.info.json'):
+            targets.add(str(directory / f'{prefix}{sidecar}'))
+    deleted = 0
+    for root, dirs, files in os.walk(directory):
+        for filename in files:
+            filepath = os.path.join(root, filename)
+            if filepath in targets:
+                targets.discard(filepath)
+                if delete_file(filepath) is not False:
+                    deleted += 1
+    # Media files saved outside of the source directory
+    for filepath in targets:
+        if not filepath.startswith(f'{directory}{os.sep}') and os.path.isfile(filepath):
+            if delete_file(filepath) is not False:
+                deleted += 1
+    return deleted
+
+
+def delete_source_media(source, delete_files=False, progress=None):
+    '''
+        Deletes all the media for a source in batches of MEDIA_BULK_BATCH_SIZE,
+        optionally with its downloaded files. Any tasks waiting to run for the
+        source are deleted at once beforehand rather than for each media item as it
+        is deleted. "progress" is called with the number of media items deleted so
+        far and the total after each batch if set. Returns the number of media items
+        deleted.
+    '''
+    batch_size = getattr(settings, 'MEDIA_BULK_BATCH_SIZE', 500)
+    media = Media.objects.filter(source=source)
+    media_pks = list(media.values_list('pk', flat=True))
+    if not media_pks:
+        return 0
+    Task.objects.filter(queue=str(source.pk), locked_at__isnull=True).delete()
+    if delete_files:
+        media_files = media.exclude(media_file='').exclude(
+            media_file__isnull=True).values_list('media_file', flat=True)
+        deleted_files = delete_source_files(source, list(media_files))
+        log.info(f'Deleted {deleted_files} files for source: {source}')
+    bulk_deletion.source_id = str(source.pk)
+    try:
+        for i in range(0, len(media_pks), batch_size):
+            Media.objects.filter(pk__in=media_pks[i:i + batch_size]).delete()
+            deleted = min(i + batch_size, len(media_pks))
+            log.info(f'Deleted {deleted} of {len(media_pks)} media items for '
+                     f'source: {source}')
+            if progress:
+                progress(deleted, len(media_pks))
+    finally:
+        bulk_deletion.source_id = None
+    return len(media_pks)
+
+
+def schedule_media_server_rescans():
+    '''
+        Schedules a rescan of every media server.
+    '''
+    for mediaserver in MediaServer.objects.all():
+        log.info(f'Scheduling media server updates')
+        verbose_name = _('Request media server rescan for "{}"')
+        rescan_media_server(
+            str(mediaserver.pk),
+            priority=0,
+            verbose_name=verbose_name.format(mediaserver),
+            remove_existing_tasks=True
+        )
+
+
+@background(schedule=0)
+def delete_source(source_id, delete_files=False):
+    '''
+        Deletes a source and all of its media, optionally along with the downloaded
+        media files, then requests a single rescan of each media server. Progress is
+        shown in the name of the running task.
+    '''
+    try:
+        source = Source.objects.get(pk=source_id)
+    except Source.DoesNotExist:
+        # Task triggered but the source has already been deleted, do nothing
+        return
+    log.info(f'Deleting source: {source}')
+    verbose_name = _('Deleting source "{}", {} of {} media items deleted')
+
+    def progress(deleted, total):
+        Task.objects.filter(task_name=delete_source.name, queue=str(source.pk),
+                            locked_at__isnull=False).update(
+            verbose_name=verbose_name.format(source.name, deleted, total))
+
+    deleted = delete_source_media(source, delete_files=delete_files,
+                                  progress=progress)
+    source.delete()
+    log.info(f'Deleted source: {source} and {deleted} media items')
+    schedule_media_server_rescans()
+
+
+@background(schedule=0)
+@scheduled_tasks_buffer()
 def download_media_metadata(media_id):
     '''
         Downloads the metadata for a media item.
@@ -225,48 +739,146 @@ def download_media_metadata(media_id):
         return
     source = media.source
     metadata = media.index_metadata()
-    media.metadata = json.dumps(metadata, default=json_serial)
-    upload_date = media.upload_date
-    # Media must have a valid upload date
-    if upload_date:
-        media.published = timezone.make_aware(upload_date)
-    else:
-        log.error(f'Media has no upload date, skipping: {source} / {media}')
-        media.skip = True
-    # If the source has a download cap date check the upload date is allowed
-    max_cap_age = source.download_cap_date
-    if media.published and max_cap_age:
-        if media.published < max_cap_age:
-            # Media was published after the cap date, skip it
-            log.warn(f'Media: {source} / {media} is older than cap age '
-                     f'{max_cap_age}, skipping')
-            media.skip = True
-    # If the source has a cut-off check the upload date is within the allowed delta
-    if source.delete_old_media and source.days_to_keep > 0:
-        if not isinstance(media.published, datetime):
-            # Media has no known published date or incomplete metadata
-            log.warn(f'Media: {source} / {media} has no published date, skipping')
-            media.skip = True
-        else:
-            delta = timezone.now() - timedelta(days=source.days_to_keep)
-            if media.published < delta:
-                # Media was published after the cutoff date, skip it
-                log.warn(f'Media: {source} / {media} is older than '
-                         f'{source.days_to_keep} days, skipping')
-                media.skip = True
-    # Check we can download the media item
-    if not media.skip:
-        if media.get_format_str():
-            media.can_download = True
-        else:
-            media.can_download = False
+    media.update_metadata(metadata)
     # Save the media
     media.save()
     log.info(f'Saved {len(media.metadata)} bytes of metadata for: '
              f'{source} / {media_id}')
 
 
+# Semaphores limiting how many media items have their metadata fetched at once in
+# this process with a count of their users, see metadata_fetch_slots_for()
+metadata_fetch_slots = {}
+metadata_fetch_slots_lock = threading.Lock()
+
+
+@contextmanager
+def metadata_fetch_slots_for(source_id):
+    '''
+        Yields a tuple of (global semaphore, source semaphore, source limit) which
+        limit how many media items have their metadata fetched at once over all
+        sources to MEDIA_METADATA_CONCURRENCY and for a single source to
+        MEDIA_METADATA_SOURCE_CONCURRENCY. Semaphores are dropped once nothing is
+        using them so they aren't kept for every source ever fetched.
+    '''
+    global_limit = max(getattr(settings, 'MEDIA_METADATA_CONCURRENCY', 4), 1)
+    source_limit = max(getattr(settings, 'MEDIA_METADATA_SOURCE_CONCURRENCY', 2), 1)
+    source_limit = min(source_limit, global_limit)
+    keys = (('global', global_limit), (str(source_id), source_limit))
+    with metadata_fetch_slots_lock:
+        for key in keys:
+            limit = key[1]
+            slots = metadata_fetch_slots.setdefault(
+                key, [threading.BoundedSemaphore(limit), 0])
+            slots[1] += 1
+        global_slots, source_slots = (metadata_fetch_slots[key][0] for key in keys)
+    try:
+        yield global_slots, source_slots, source_limit
+    finally:
+        with metadata_fetch_slots_lock:
+            for key in keys:
+                metadata_fetch_slots[key][1] -= 1
+                if metadata_fetch_slots[key][1] <= 0:
+                    del metadata_fetch_slots[key]
+
+
+def fetch_media_metadata(source, urls):
+    '''
+        Fetches the metadata for many media URLs of a source concurrently in a pool
+        of threads, each with its own youtube-dl instance, within the limits set by
+        metadata_fetch_slots_for(). Yields a tuple of (url, info, error) as each
+        fetch completes. The database is not used by the pool threads.
+    '''
+    indexer = Media.BATCH_INDEXERS.get(source.source_type, None)
+    if not callable(indexer):
+        raise Exception(f'Media with source type f"{source.source_type}" has no '
+                        f'batch indexer')
+    if not urls:
+        return
+    with metadata_fetch_slots_for(source.pk) as slots:
+        global_slots, source_slots, source_limit = slots
+        results = queue.Queue()
+
+        def fetch(urls):
+            # Every URL must put exactly one result or the consumer below would block
+            i = 0
+            while i < len(urls):
+                infos = indexer(urls[i:])
+                try:
+                    while i < len(urls):
+                        # Wait for a slot for the source before taking a global slot
+                        # so a busy source never holds global slots other sources
+                        # could use
+                        with source_slots, global_slots:
+                            result = next(infos)
+                        results.put(result)
+                        i += 1
+                except Exception as e:
+                    results.put((urls[i], None, e))
+                    i += 1
+
+        workers = min(source_limit, len(urls))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for i in range(workers):
+                executor.submit(fetch, urls[i::workers])
+            for i in range(len(urls)):
+                yield results.get()
+
+
+@background(schedule=0)
+def download_media_metadata_batch(source_id, media_ids):
+    '''
+        Downloads the metadata for many media items of a source concurrently, see
+        fetch_media_metadata(), and saves the results in batches of
+        MEDIA_METADATA_WRITE_BATCH_SIZE. Media which fails is scheduled as an
+        individual download_media_metadata task to be retried.
+    '''
+    try:
+        source = Source.objects.get(pk=source_id)
+    except Source.DoesNotExist:
+        # Task triggered but the Source has been deleted, do nothing
+        return
+    media_by_url = {}
+    for media in Media.objects.filter(source=source, pk__in=media_ids).select_related(
+            'media_metadata'):
+        media.source = source
+        # Media may have had its metadata downloaded since the task was scheduled
+        if media.needs_metadata:
+            media_by_url[media.url] = media
+    log.info(f'Downloading metadata for {len(media_by_url)} media items for '
+             f'source: {source}')
+    start = time.monotonic()
+    write_batch_size = max(getattr(settings, 'MEDIA_METADATA_WRITE_BATCH_SIZE', 10), 1)
+    batch, failed = [], []
+    saved, scheduled = 0, 0
+    for url, metadata, error in fetch_media_metadata(source, list(media_by_url.keys())):
+        media = media_by_url[url]
+        if error:
+            log.error(f'Failed to download metadata for: {source} / {media}: {error}')
+            failed.append(media)
+            continue
+        media.update_metadata(metadata)
+        batch.append(media)
+        if len(batch) >= write_batch_size:
+            scheduled += save_media_metadata_in_bulk(batch)
+            saved += len(batch)
+            batch = []
+    scheduled += save_media_metadata_in_bulk(batch)
+    saved += len(batch)
+    verbose_name = _('Downloading metadata for "{}"')
+    scheduled += schedule_tasks_in_bulk(download_media_metadata, [
+        ((str(media.pk),), {
+            'priority': 10,
+            'verbose_name': verbose_name.format(media.pk),
+        }) for media in failed
+    ])
+    log.info(f'Saved metadata for {saved} media items, {len(failed)} failed, and '
+             f'scheduled {scheduled} tasks for source: {source} in '
+             f'{time.monotonic() - start:.1f}s')
+
+
 @background(schedule=0)
+@scheduled_tasks_buffer()
 def download_media_thumbnail(media_id, url):
     '''
         Downloads an image from a URL and save it as a local thumbnail attached to a
@@ -300,6 +912,7 @@ def download_media_thumbnail(media_id, url):
 
 
 @background(schedule=0)
+@scheduled_tasks_buffer()
 def download_media(media_id):
     '''
         Downloads the media to disk and attaches it to the Media instance.
@@ -5,15 +5,44 @@
 '''
 
 
+import json
+import sqlite3
+import time
+import uuid
+import random
+import tempfile
+import threading
 import logging
-from datetime import datetime
+import itertools
+from io import StringIO, BytesIO
+from concurrent.futures import Future
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from datetime import datetime, timedelta
+from unittest import mock
 from urllib.parse import urlsplit
 from xml.etree import ElementTree
 from django.conf import settings
-from django.test import TestCase, Client
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from background_task.models import Task
-from .models import Source, Media
+from PIL import Image
+from .models import Source, Media, MediaMetadata, MediaServer
+from .utils import zstandard, parse_media_format
+from .testutils import synthetic_video_formats
+from .feeds import FeedError, fetch_feed, get_feed_media_keys
+from .fileindex import FileIndex
+from .workers import LaneSupervisor, WorkerLane, run_task
+from .tasks import (update_source_media, index_source_task,
+                    schedule_index_source_task, get_index_load,
+                    scheduled_tasks_buffer, delete_source,
+                    download_media_metadata_batch, fetch_media_metadata,
+                    create_indexed_media, metadata_fetch_slots)
+from .matching import (get_best_video_format, VIDEO_FORMAT_LADDERS, min_height,
+                       fallback_hd_cutoff)
 
 
 class FrontEndTestCase(TestCase):
@@ -276,6 +305,11 @@ class FrontEndTestCase(TestCase):
         self.assertEqual(response.status_code, 302)
         url_parts = urlsplit(response.url)
         self.assertEqual(url_parts.path, '/sources')
+        # The source is deleted by a background task
+        tasks = Task.objects.filter(task_name='sync.tasks.delete_source',
+                                    queue=source_uuid)
+        self.assertTrue(tasks.exists())
+        delete_source.now(source_uuid)
         try:
             Source.objects.get(pk=source_uuid)
             object_gone = False
@@ -355,27 +389,29 @@ class FrontEndTestCase(TestCase):
             } 
         '''
         past_date = timezone.make_aware(datetime(year=2000, month=1, day=1))
-        test_media1 = Media.objects.create(
-            key='mediakey1',
-            source=test_source,
-            published=past_date,
-            metadata=test_minimal_metadata
-        )
-        test_media1_pk = str(test_media1.pk)
-        test_media2 = Media.objects.create(
-            key='mediakey2',
-            source=test_source,
-            published=past_date,
-            metadata=test_minimal_metadata
-        )
-        test_media2_pk = str(test_media2.pk)
-        test_media3 = Media.objects.create(
-            key='mediakey3',
-            source=test_source,
-            published=past_date,
-            metadata=test_minimal_metadata
-        )
-        test_media3_pk = str(test_media3.pk)
+        # Tasks are scheduled once the media has been committed
+        with self.captureOnCommitCallbacks(execute=True):
+            test_media1 = Media.objects.create(
+                key='mediakey1',
+                source=test_source,
+                published=past_date,
+                metadata=test_minimal_metadata
+            )
+            test_media1_pk = str(test_media1.pk)
+            test_media2 = Media.objects.create(
+                key='mediakey2',
+                source=test_source,
+                published=past_date,
+                metadata=test_minimal_metadata
+            )
+            test_media2_pk = str(test_media2.pk)
+            test_media3 = Media.objects.create(
+                key='mediakey3',
+                source=test_source,
+                published=past_date,
+                metadata=test_minimal_metadata
+            )
+            test_media3_pk = str(test_media3.pk)
         # Check the tasks to fetch the media thumbnails have been scheduled
         found_thumbnail_task1 = False
         found_thumbnail_task2 = False
@@ -448,6 +484,9 @@ class FrontEndTestCase(TestCase):
         # Completed tasks overview page
         response = c.get('/tasks-completed')
         self.assertEqual(response.status_code, 200)
+        # Index load page
+        response = c.get('/tasks-index-load')
+        self.assertEqual(response.status_code, 200)
 
     def test_mediasevrers(self):
         # Media servers overview page
@@ -470,6 +509,8 @@ all_test_metadata = {
     '60fps': metadata_60fps,
     '60fps+hdr': metadata_60fps_hdr,
 }
+metadata_low_formats_filepath = settings.BASE_DIR / 'sync' / 'testdata' / 'metadata_low_formats.json'
+metadata_low_formats = open(metadata_low_formats_filepath, 'rt').read()
 
 
 class FilepathTestCase(TestCase):
@@ -683,6 +724,1115 @@ class MediaTestCase(TestCase):
             self.assertEqual(expected_node.tag, nfo_node.tag)
             self.assertEqual(expected_node.text, nfo_node.text)
 
+    def test_metadata_fields(self):
+        # Fields are copied from the metadata when saved
+        self.assertTrue(self.media.has_metadata)
+        self.assertEqual(self.media.title, 'no fancy stuff title')
+        self.assertEqual(self.media.duration, 401)
+        self.assertEqual(self.media.uploader, 'test uploader')
+        self.assertEqual(self.media.thumbnail, self.media.metadata_thumbnail)
+        self.media.metadata = metadata_hdr
+        self.media.save()
+        media = Media.objects.get(pk=self.media.pk)
+        self.assertEqual(media.title, 'hdr')
+        media.metadata = None
+        media.save(update_fields=['metadata'])
+        media = Media.objects.get(pk=self.media.pk)
+        self.assertFalse(media.has_metadata)
+        self.assertEqual(media.title, '')
+        self.assertEqual(media.duration, 0)
+        # Media saved before the fields existed can be backfilled
+        MediaMetadata.objects.filter(media=self.media).update(data=metadata,
+                                                              compressed=None,
+                                                              codec='')
+        Media.objects.filter(pk=self.media.pk).update(has_metadata=True)
+        call_command('backfill-media-fields')
+        media = Media.objects.get(pk=self.media.pk)
+        self.assertEqual(media.title, 'no fancy stuff title')
+        self.assertEqual(media.duration, 401)
+        # Listing media doesn't load the metadata
+        c = Client()
+        response = c.get('/media?show_skipped=yes')
+        self.assertEqual(response.status_code, 200)
+        for m in response.context['media']:
+            self.assertFalse(Media.media_metadata.is_cached(m))
+        self.assertIn('no fancy stuff title', response.content.decode())
+
+    def test_metadata_compression(self):
+        # Metadata is compressed transparently with the configured codec
+        media_metadata = MediaMetadata.objects.get(media=self.media)
+        self.assertEqual(media_metadata.codec, settings.MEDIA_METADATA_COMPRESSION)
+        self.assertIsNone(media_metadata.data)
+        self.assertLess(len(media_metadata.compressed), len(metadata))
+        # Metadata is only loaded when accessed
+        media = Media.objects.get(pk=self.media.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(media.metadata, metadata)
+        self.assertEqual(media.loaded_metadata, json.loads(metadata))
+        # Existing uncompressed metadata is converted by the compress-metadata command
+        with override_settings(MEDIA_METADATA_COMPRESSION=''):
+            media.metadata = metadata_hdr
+            media.save()
+        media_metadata = MediaMetadata.objects.get(media=self.media)
+        self.assertEqual(media_metadata.codec, '')
+        self.assertEqual(media_metadata.data, metadata_hdr)
+        self.assertIsNone(media_metadata.compressed)
+        codecs = ['zlib', 'zstd', 'none'] if zstandard else ['zlib', 'none']
+        for codec in codecs:
+            call_command('compress-metadata', codec=codec)
+            media = Media.objects.get(pk=self.media.pk)
+            self.assertEqual(media.media_metadata.codec, '' if codec == 'none' else codec)
+            self.assertEqual(media.metadata, metadata_hdr)
+            self.assertEqual(media.title, 'hdr')
+
+    def test_slim_metadata(self):
+        # Slimmed metadata must give identical results to the full metadata
+        test_metadata = dict(all_test_metadata, low_formats=metadata_low_formats)
+        for name, full_metadata in test_metadata.items():
+            results = []
+            for slim in (False, True):
+                loaded = json.loads(full_metadata)
+                if slim:
+                    slimmed = self.media.slim_metadata(loaded)
+                    self.assertLess(len(json.dumps(slimmed)), len(full_metadata))
+                    loaded = slimmed
+                self.media.metadata = json.dumps(loaded)
+                result = [self.media.nfoxml, list(self.media.iter_formats())]
+                for resolution in ('360p', '720p', '1080p', '2160p', 'audio'):
+                    for prefer in (False, True):
+                        self.source.source_resolution = resolution
+                        self.source.prefer_60fps = prefer
+                        self.source.prefer_hdr = prefer
+                        result.append(self.media.get_best_combined_format())
+                        result.append(self.media.get_best_audio_format())
+                        result.append(self.media.get_best_video_format())
+                        result.append(self.media.get_format_str())
+                        if self.media.get_format_str():
+                            result.append(self.media.format_dict)
+                results.append(result)
+            self.assertEqual(results[0], results[1], name)
+
+    def test_metadata_parsed_once(self):
+        # Fetch a fresh instance so there is no already parsed metadata
+        media = Media.objects.get(pk=self.media.pk)
+        with mock.patch('sync.models.json_loads', wraps=json.loads) as loads:
+            media.nfoxml
+            media.filename
+            media.format_dict
+            self.assertEqual(loads.call_count, 1)
+            # Reassigning the metadata invalidates the parsed metadata
+            media.metadata = metadata_hdr
+            self.assertEqual(media.metadata_title, 'hdr')
+            self.assertEqual(loads.call_count, 2)
+        # The media item page should only parse the metadata once
+        c = Client()
+        with mock.patch('sync.models.json_loads', wraps=json.loads) as loads:
+            response = c.get(f'/media/{self.media.pk}')
+            self.assertEqual(response.status_code, 200)
+            metadata_loads = [call for call in loads.call_args_list
+                              if call.args and call.args[0] == metadata]
+            self.assertEqual(len(metadata_loads), 1)
+
+    def test_matched_format_persisted(self):
+        # The matched format is stored when the media is saved
+        media = Media.objects.get(pk=self.media.pk)
+        self.assertEqual(media.matched_format, '248+251')
+        self.assertEqual(media.matched_format_key,
+                         f'{self.source.format_fingerprint}-1')
+        match_format_str = mock.patch.object(Media, 'match_format_str',
+                                             autospec=True, return_value='22')
+        # Nothing affecting matching has changed, saving doesn't match again
+        with match_format_str as match:
+            self.assertEqual(media.get_format_str(), '248+251')
+            media.filename
+            media.save()
+            self.source.name = 'newname'
+            self.source.save()
+            update_source_media.now(str(self.source.pk))
+            self.assertEqual(match.call_count, 0)
+        # Changing the source profile matches again
+        with match_format_str as match:
+            self.source.source_resolution = Source.SOURCE_RESOLUTION_720P
+            self.source.save()
+            update_source_media.now(str(self.source.pk))
+            media = Media.objects.get(pk=self.media.pk)
+            self.assertEqual(media.matched_format, '22')
+            self.assertEqual(media.get_format_str(), '22')
+            self.assertEqual(match.call_count, 1)
+        # Changing the metadata matches again
+        media.metadata = metadata_hdr
+        self.assertEqual(media.metadata_version, 2)
+        self.assertNotEqual(media.get_format_str(), '22')
+
+    def test_update_source_media(self):
+        # Saving a source schedules one bulk update rather than saving each media
+        for i in range(4):
+            Media.objects.create(key=f'mediakey{i}', source=self.source,
+                                 metadata=metadata)
+        Media.objects.filter(source=self.source).update(can_download=False,
+                                                        published=timezone.now())
+        Task.objects.filter(task_name='sync.tasks.download_media').delete()
+        self.source.source_resolution = Source.SOURCE_RESOLUTION_720P
+        with mock.patch.object(Media, 'save') as media_save:
+            self.source.save()
+            self.assertEqual(media_save.call_count, 0)
+        tasks = Task.objects.get_task('sync.tasks.update_source_media',
+                                      args=(str(self.source.pk),))
+        self.assertEqual(tasks.count(), 1)
+        # Running the update recalculates the flags over several batches and
+        # schedules the downloads
+        with override_settings(MEDIA_BULK_BATCH_SIZE=2):
+            with mock.patch.object(Media, 'save') as media_save:
+                update_source_media.now(str(self.source.pk))
+                self.assertEqual(media_save.call_count, 0)
+        for media in Media.objects.filter(source=self.source):
+            self.assertTrue(media.can_download)
+            self.assertFalse(media.skip)
+            self.assertEqual(media.matched_format, '247+251')
+            tasks = Task.objects.get_task('sync.tasks.download_media',
+                                          args=(str(media.pk),))
+            self.assertEqual(tasks.count(), 1)
+            self.assertEqual(tasks[0].queue, str(self.source.pk))
+        # Running it again replaces the existing tasks rather than duplicating them
+        update_source_media.now(str(self.source.pk))
+        tasks = Task.objects.filter(task_name='sync.tasks.download_media')
+        self.assertEqual(tasks.count(), 5)
+        # Running download tasks are left alone
+        tasks.update(locked_by='1', locked_at=timezone.now())
+        update_source_media.now(str(self.source.pk))
+        self.assertEqual(tasks.count(), 5)
+        self.assertEqual(tasks.filter(locked_at__isnull=True).count(), 0)
+
+    def test_source_changed_fields(self):
+        # Only saving changes to fields which affect media updates the media
+        task_name = 'sync.tasks.update_source_media'
+        Task.objects.filter(task_name=task_name).delete()
+        source = Source.objects.get(pk=self.source.pk)
+        self.assertEqual(source.changed_fields, set())
+        source.last_crawl = timezone.now()
+        source.has_failed = True
+        self.assertEqual(source.changed_fields, {'last_crawl', 'has_failed'})
+        source.save()
+        self.assertEqual(source.changed_fields, set())
+        self.assertFalse(Task.objects.filter(task_name=task_name).exists())
+        videos = [{'id': 'mediakey'}]
+        with mock.patch.object(Source, 'iter_index_media', return_value=videos):
+            index_source_task.now(str(self.source.pk))
+        self.assertFalse(Task.objects.filter(task_name=task_name).exists())
+        source.source_resolution = Source.SOURCE_RESOLUTION_720P
+        source.save()
+        self.assertTrue(Task.objects.filter(task_name=task_name).exists())
+        # Sources which have not been loaded or saved have every field changed
+        self.assertIn('source_resolution', Source().changed_fields)
+
+    def test_scheduled_tasks_buffer(self):
+        # Tasks scheduled by saving media are collected, deduplicated and scheduled
+        # in bulk once the block exits and the transaction commits
+        task_name = 'sync.tasks.download_media_thumbnail'
+        Task.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            with scheduled_tasks_buffer():
+                for i in range(3):
+                    self.media.save()
+                for i in range(20):
+                    Media.objects.create(key=f'mediakey{i}', source=self.source,
+                                         metadata=metadata)
+                self.assertFalse(Task.objects.exists())
+            self.assertFalse(Task.objects.exists())
+        tasks = Task.objects.filter(task_name=task_name)
+        self.assertEqual(tasks.count(), 21)
+        self.assertEqual(tasks.filter(task_params__contains=str(self.media.pk)).count(),
+                         1)
+        # Tasks are dropped if the transaction is rolled back
+        Task.objects.all().delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    with scheduled_tasks_buffer():
+                        self.media.save()
+                    raise ValueError()
+            except ValueError:
+                pass
+        self.assertFalse(Task.objects.exists())
+        # Tasks for media deleted before the block exits are dropped
+        with self.captureOnCommitCallbacks(execute=True):
+            with scheduled_tasks_buffer():
+                media = Media.objects.create(key='deletedkey', source=self.source,
+                                             metadata=metadata)
+                media_pk = str(media.pk)
+                media.delete()
+        self.assertFalse(Task.objects.filter(task_params__contains=media_pk).exists())
+
+    @override_settings(MEDIA_BULK_BATCH_SIZE=2)
+    def test_delete_source(self):
+        MediaServer.objects.create(host='127.0.0.1', port=32400, options='{}')
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = Path(tmpdir)
+            (directory / 'subdir').mkdir()
+            kept = directory / 'unrelated.mkv'
+            kept.touch()
+            deleted = []
+            for i in range(5):
+                media_file = directory / 'subdir' / f'media{i}.mkv'
+                media = Media.objects.create(key=f'mediakey{i}', source=self.source)
+                Media.objects.filter(pk=media.pk).update(media_file=str(media_file),
+                                                         downloaded=True)
+                deleted.append(media_file)
+                for ext in ('.jpg', '.nfo', '.info.json'):
+                    deleted.append(directory / f'media{i}{ext}')
+            for path in deleted:
+                path.touch()
+            Task.objects.all().delete()
+            # Files can only be deleted from inside the download directory
+            with override_settings(DOWNLOAD_ROOT=directory):
+                with mock.patch.object(Source, 'directory_path',
+                                       new_callable=mock.PropertyMock,
+                                       return_value=directory):
+                    delete_source.now(str(self.source.pk), delete_files=True)
+            for path in deleted:
+                self.assertFalse(path.exists())
+            self.assertTrue(kept.exists())
+        self.assertFalse(Source.objects.filter(pk=self.source.pk).exists())
+        self.assertFalse(Media.objects.exists())
+        # Media servers are only asked to rescan once
+        self.assertEqual(
+            Task.objects.filter(task_name='sync.tasks.rescan_media_server').count(), 1)
+
+    def test_file_index(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            directory = Path(tmpdir)
+            (directory / 'subdir').mkdir()
+            present = directory / 'subdir' / 'present.mkv'
+            present.touch()
+            stale = directory / 'stale.mkv'
+            stale.touch()
+            created = directory / 'created.mkv'
+            outside = Path(settings.BASE_DIR) / 'manage.py'
+            index = FileIndex()
+            with override_settings(MEDIA_ROOT=directory, DOWNLOAD_ROOT=directory,
+                                   FILE_INDEX_MAX_AGE=300):
+                # Until the index is built files are checked on disk while it is
+                # swept in the background
+                with mock.patch.object(index, 'refresh_in_background') as refresh:
+                    self.assertTrue(index.exists(present))
+                    self.assertFalse(index.exists(created))
+                    self.assertEqual(refresh.call_count, 2)
+                self.assertTrue(index.refresh_in_background())
+                with index.refresh_lock:
+                    self.assertEqual(index.files, {str(present), str(stale)})
+                # Files in the index are found without checking the disk
+                with mock.patch('os.path.isfile') as isfile:
+                    self.assertTrue(index.exists(present))
+                    self.assertTrue(index.exists(str(stale)))
+                    isfile.assert_not_called()
+                # Files missing from the index are checked on disk and indexed
+                created.touch()
+                self.assertFalse(index.exists(created, verify=False))
+                self.assertTrue(index.exists(created))
+                self.assertIn(str(created), index.files)
+                # Files outside the indexed directories are always checked on disk
+                self.assertTrue(index.exists(outside))
+                self.assertFalse(index.exists(directory.parent / 'missing.mkv'))
+                # Files deleted without telling the index are reported as stale
+                stale.unlink()
+                added, removed = index.refresh()
+                self.assertEqual(added, set())
+                self.assertEqual(removed, {str(stale)})
+                self.assertFalse(index.exists(stale))
+                index.discard(present)
+                self.assertFalse(index.exists(present, verify=False))
+                # Stale indexes are used while they are swept in the background
+                index.refreshed -= 1000
+                with mock.patch.object(index, 'refresh_in_background') as refresh:
+                    with mock.patch('os.path.isfile') as isfile:
+                        self.assertTrue(index.exists(created))
+                        isfile.assert_not_called()
+                    refresh.assert_called_once_with()
+                # Files added and discarded during a sweep are kept
+                sweep = index.sweep
+
+                def sweep_while_changing(root):
+                    result = sweep(root)
+                    index.discard(created)
+                    index.add(stale)
+                    return result
+
+                created.touch()
+                with mock.patch.object(index, 'sweep', sweep_while_changing):
+                    index.refresh()
+                self.assertNotIn(str(created), index.files)
+                self.assertIn(str(stale), index.files)
+            # The index is disabled with a max age of 0
+            with override_settings(MEDIA_ROOT=directory, DOWNLOAD_ROOT=directory,
+                                   FILE_INDEX_MAX_AGE=0):
+                with mock.patch('os.path.isfile', return_value=False) as isfile:
+                    self.assertFalse(index.exists(created))
+                    isfile.assert_called_once_with(str(created))
+
+    def test_index_source_task(self):
+        # Only new media is created and indexing known media takes a fixed number
+        # of queries however many media items the source has
+        videos = [{'id': 'mediakey'}, {'id': 'newkey1'}, {'id': 'newkey2'},
+                  {'id': 'newkey1'}, {'title': 'no key'}]
+        with mock.patch.object(Source, 'iter_index_media', return_value=videos):
+            index_source_task.now(str(self.source.pk))
+        self.assertEqual(
+            sorted(Media.objects.filter(source=self.source).values_list('key',
+                                                                        flat=True)),
+            ['mediakey', 'newkey1', 'newkey2'])
+        for key in ('newkey1', 'newkey2'):
+            media = Media.objects.get(source=self.source, key=key)
+            self.assertTrue(media.skip)
+            self.assertEqual(metadata_batch_ids(self.source).count(str(media.pk)), 1)
+        for i in range(100):
+            Media.objects.create(key=f'mediakey{i}', source=self.source)
+        videos = [{'id': key} for key in
+                  Media.objects.filter(source=self.source).values_list('key',
+                                                                       flat=True)]
+        with mock.patch.object(Source, 'iter_index_media', return_value=videos):
+            with CaptureQueriesContext(connection) as queries:
+                index_source_task.now(str(self.source.pk))
+        self.assertEqual(Media.objects.filter(source=self.source).count(), 103)
+        self.assertLess(len(queries), 30)
+
+    def test_create_indexed_media_conflicts(self):
+        # Media created elsewhere first is neither logged nor scheduled as new
+        existing = Media(key='mediakey', source=self.source)
+        new = Media(key='newkey', source=self.source)
+        Task.objects.all().delete()
+        create_indexed_media(self.source, [existing, new], batch_size=10)
+        self.assertEqual(Media.objects.get(key='mediakey').pk, self.media.pk)
+        self.assertTrue(Media.objects.filter(pk=new.pk).exists())
+        self.assertEqual(metadata_batch_ids(self.source), [str(new.pk)])
+
+    @override_settings(INDEX_INCREMENTAL_STOP_AFTER=3)
+    def test_incremental_index_source_task(self):
+        for i in range(10):
+            Media.objects.create(key=f'mediakey{i}', source=self.source)
+        consumed = []
+
+        def iter_index_media(source, start=0):
+            # Newest first, two new media then the already indexed media
+            keys = ['newkey1', 'newkey2'] + [f'mediakey{i}' for i in range(10)]
+            for key in keys[start:]:
+                consumed.append(key)
+                yield {'id': key}
+
+        # The first index of a source is always a full index
+        self.assertTrue(self.source.needs_full_crawl)
+        with mock.patch.object(Source, 'iter_index_media', new=iter_index_media):
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(len(consumed), 12)
+            source = Source.objects.get(pk=self.source.pk)
+            self.assertIsNotNone(source.last_full_crawl)
+            self.assertFalse(source.needs_full_crawl)
+            # Later indexes stop after the configured number of known media
+            Media.objects.filter(key__in=('newkey1', 'newkey2')).delete()
+            consumed.clear()
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(consumed, ['newkey1', 'newkey2', 'mediakey0',
+                                        'mediakey1', 'mediakey2'])
+            self.assertTrue(Media.objects.filter(key='newkey2').exists())
+            self.assertEqual(Source.objects.get(pk=self.source.pk).last_full_crawl,
+                             source.last_full_crawl)
+            # A full index can be requested
+            consumed.clear()
+            index_source_task.now(str(self.source.pk), full=True)
+            self.assertEqual(len(consumed), 12)
+        # Full indexes are due again after the interval
+        with override_settings(INDEX_FULL_CRAWL_INTERVAL=0):
+            self.assertTrue(source.needs_full_crawl)
+
+    @override_settings(MEDIA_BULK_BATCH_SIZE=2)
+    def test_index_source_task_checkpoint(self):
+        keys = [f'newkey{i}' for i in range(7)]
+        consumed = []
+
+        def iter_index_media(source, start=0):
+            for key in keys[start:]:
+                if key == fail_at:
+                    raise Exception('indexing failed')
+                consumed.append(key)
+                yield {'id': key}
+
+        # Media is created in batches and the progress checkpointed
+        fail_at = 'newkey5'
+        with mock.patch.object(Source, 'iter_index_media', new=iter_index_media):
+            with self.assertRaises(Exception):
+                index_source_task.now(str(self.source.pk))
+            source = Source.objects.get(pk=self.source.pk)
+            self.assertEqual(source.index_checkpoint, 4)
+            self.assertIsNone(source.last_crawl)
+            self.assertEqual(Media.objects.filter(key__startswith='newkey').count(), 4)
+            # The next attempt resumes from the checkpoint
+            fail_at = None
+            consumed.clear()
+            index_source_task.now(str(self.source.pk))
+        self.assertEqual(consumed, ['newkey4', 'newkey5', 'newkey6'])
+        source = Source.objects.get(pk=self.source.pk)
+        self.assertEqual(source.index_checkpoint, 0)
+        self.assertIsNotNone(source.last_crawl)
+        self.assertEqual(Media.objects.filter(key__startswith='newkey').count(), 7)
+
+    def test_index_source_task_flat_metadata(self):
+        # Flat metadata is stored at index time and media published outside of the
+        # download window is skipped without downloading its metadata
+        self.source.download_cap = Source.CapChoices.CAP_7DAYS
+        self.source.save()
+        now = timezone.now()
+        videos = [
+            {'id': 'recent', 'title': 'Recent video', 'duration': 61.0,
+             'timestamp': int((now - timedelta(days=1)).timestamp())},
+            {'id': 'old', 'title': 'Old video', 'duration': None,
+             'upload_date': (now - timedelta(days=30)).strftime('%Y%m%d')},
+            {'id': 'nodate', 'title': 'Undated video'},
+        ]
+        with mock.patch.object(Source, 'iter_index_media', return_value=videos):
+            index_source_task.now(str(self.source.pk))
+        recent = Media.objects.get(source=self.source, key='recent')
+        self.assertEqual(recent.title, 'Recent video')
+        self.assertEqual(recent.duration, 61)
+        self.assertIsNotNone(recent.published)
+        self.assertFalse(recent.skip)
+        old = Media.objects.get(source=self.source, key='old')
+        self.assertEqual(old.name, 'Old video')
+        self.assertTrue(old.skip)
+        self.assertFalse(old.needs_metadata)
+        nodate = Media.objects.get(source=self.source, key='nodate')
+        self.assertIsNone(nodate.published)
+        self.assertTrue(nodate.needs_metadata)
+
+        def metadata_tasks(media):
+            return metadata_batch_ids(self.source).count(str(media.pk))
+
+        self.assertEqual(metadata_tasks(recent), 1)
+        self.assertEqual(metadata_tasks(old), 0)
+        self.assertEqual(metadata_tasks(nodate), 1)
+        # Updating the source media doesn't schedule it either until the window
+        # includes the media
+        update_source_media.now(str(self.source.pk))
+        self.assertEqual(metadata_tasks(old), 0)
+        self.source.download_cap = Source.CapChoices.CAP_90DAYS
+        self.source.save()
+        update_source_media.now(str(self.source.pk))
+        self.assertFalse(Media.objects.get(pk=old.pk).skip)
+        self.assertEqual(metadata_tasks(old), 1)
+
+    @override_settings(INDEX_ADAPTIVE_MIN_INTERVAL=3600,
+                       INDEX_ADAPTIVE_MAX_INTERVAL=604800,
+                       INDEX_ADAPTIVE_SAMPLE_SIZE=10)
+    def test_adaptive_index_interval(self):
+        # Without enough published media the source is indexed daily
+        self.assertEqual(self.source.get_adaptive_index_interval(), 86400)
+        now = timezone.now()
+        # A video every 4 hours is indexed every 2 hours
+        for i in range(10):
+            Media.objects.create(key=f'mediakey{i}', source=self.source,
+                                 published=now - timedelta(hours=4 * (i + 1)))
+        self.assertAlmostEqual(self.source.get_adaptive_index_interval(), 7200,
+                               delta=5)
+        # Sources which publish very often are limited to the minimum interval
+        Media.objects.filter(source=self.source).update(published=now)
+        self.assertEqual(self.source.get_adaptive_index_interval(), 3600)
+        # Sources which have stopped publishing are limited to the maximum interval
+        Media.objects.filter(source=self.source).update(
+            published=now - timedelta(days=365))
+        self.assertEqual(self.source.get_adaptive_index_interval(), 604800)
+        # Never indexed sources are indexed now
+        self.assertLessEqual(self.source.get_next_adaptive_index(), timezone.now())
+        self.source.last_crawl = now
+        self.assertEqual(self.source.get_next_adaptive_index(),
+                         now + timedelta(seconds=604800))
+
+    def test_adaptive_index_schedule(self):
+        task_name = 'sync.tasks.index_source_task'
+        self.source.index_schedule = Source.IndexSchedule.ADAPTIVE
+        self.source.save()
+        task = Task.objects.get(task_name=task_name, queue=str(self.source.pk))
+        self.assertEqual(task.repeat, Task.NEVER)
+        # Indexing the source schedules the next index
+        videos = [{'id': 'mediakey'}]
+        with mock.patch.object(Source, 'iter_index_media', return_value=videos):
+            index_source_task.now(str(self.source.pk))
+        task = Task.objects.get(task_name=task_name, queue=str(self.source.pk))
+        self.assertEqual(task.repeat, Task.NEVER)
+        self.assertGreater(task.run_at, timezone.now() + timedelta(hours=23))
+        # Fixed schedules still get a repeating task
+        self.source.index_schedule = Source.IndexSchedule.EVERY_6_HOURS
+        self.source.save()
+        task = Task.objects.get(task_name=task_name, queue=str(self.source.pk))
+        self.assertEqual(task.repeat, 21600)
+
+    @override_settings(INDEX_SCHEDULE_JITTER=0)
+    def test_staggered_index_schedule(self):
+        # Sources with the same schedule are spread across the schedule window
+        day = Source.IndexSchedule.EVERY_24_HOURS
+        sources = [Source(uuid=uuid.UUID(int=i), index_schedule=day)
+                   for i in range(240)]
+        hours = [0] * 24
+        for source in sources:
+            self.assertEqual(source.index_offset,
+                             Source(uuid=source.uuid, index_schedule=day).index_offset)
+            hours[source.index_offset // 3600] += 1
+        self.assertGreater(min(hours), 0)
+        self.assertLess(max(hours), 30)
+        # Sources which have been indexed are indexed at their offset into the window
+        now = timezone.now()
+        source = sources[0]
+        source.last_crawl = now
+        run_at = source.get_next_index()
+        self.assertEqual(round(run_at.timestamp()) % day, source.index_offset)
+        self.assertGreaterEqual(run_at, now)
+        self.assertLess(run_at, now + timedelta(seconds=day))
+        with override_settings(INDEX_SCHEDULE_JITTER=600):
+            run_at = source.get_next_index()
+            self.assertLessEqual(round(run_at.timestamp()) % day - source.index_offset,
+                                 600)
+        # Sources which have never been indexed are indexed now
+        source.last_crawl = None
+        self.assertLessEqual(source.get_next_index(), timezone.now())
+
+    def test_index_load(self):
+        # The test source is indexed every hour starting now
+        start = timezone.now().replace(minute=0, second=0, microsecond=0)
+        load = get_index_load(start, hours=24)
+        self.assertEqual(len(load), 24)
+        self.assertEqual([len(sources) for hour, sources in load], [1] * 24)
+        self.assertEqual(load[0][1], [self.source])
+        # Once indexed the source is rescheduled at its offset into the hour
+        self.source.last_crawl = timezone.now()
+        self.source.save()
+        schedule_index_source_task(self.source)
+        task = Task.objects.get(task_name='sync.tasks.index_source_task')
+        self.assertEqual(task.repeat, 3600)
+        self.assertGreaterEqual(task.run_at, self.source.last_crawl)
+        load = get_index_load(start, hours=24)
+        counts = [len(sources) for hour, sources in load]
+        self.assertEqual(max(counts), 1)
+        self.assertIn(sum(counts), (23, 24))
+
+    def test_download_media_metadata_batch(self):
+        media_items = [Media.objects.create(key=f'batchkey{i}', source=self.source)
+                       for i in range(3)]
+        Task.objects.all().delete()
+        calls = []
+
+        def iter_media_info(urls):
+            calls.append(urls)
+            for url in urls:
+                if url == media_items[2].url:
+                    yield url, None, Exception('failed')
+                else:
+                    yield url, json.loads(metadata), None
+
+        indexers = {self.source.source_type: iter_media_info}
+        with mock.patch.dict(Media.BATCH_INDEXERS, indexers):
+            with mock.patch.object(Media, 'save') as media_save:
+                download_media_metadata_batch.now(
+                    str(self.source.pk), [str(media.pk) for media in media_items])
+                self.assertEqual(media_save.call_count, 0)
+        # Media is fetched through one call for each pool thread
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(sorted(len(urls) for urls in calls), [1, 2])
+        for media in media_items[:2]:
+            media = Media.objects.get(pk=media.pk)
+            self.assertTrue(media.has_metadata)
+            self.assertEqual(media.title, json.loads(metadata)['title'])
+            self.assertIsNotNone(media.published)
+            self.assertTrue(media.can_download)
+            self.assertEqual(media.matched_format, '248+251')
+            self.assertEqual(json.loads(media.metadata)['id'],
+                             json.loads(metadata)['id'])
+            tasks = Task.objects.get_task('sync.tasks.download_media',
+                                          args=(str(media.pk),))
+            self.assertEqual(tasks.count(), 1)
+        # Failed media is retried as an individual task
+        failed = Media.objects.get(pk=media_items[2].pk)
+        self.assertFalse(failed.has_metadata)
+        tasks = Task.objects.get_task('sync.tasks.download_media_metadata',
+                                      args=(str(failed.pk),))
+        self.assertEqual(tasks.count(), 1)
+
+    def test_fetch_media_metadata_concurrency(self):
+        # Fetches run concurrently up to the per source and global limits
+        lock = threading.Lock()
+        running, max_running = [0], [0]
+
+        def iter_media_info(urls):
+            for url in urls:
+                with lock:
+                    running[0] += 1
+                    max_running[0] = max(max_running[0], running[0])
+                time.sleep(0.01)
+                with lock:
+                    running[0] -= 1
+                if url.endswith('3'):
+                    raise Exception('unexpected error')
+                yield url, {'id': url}, None
+
+        urls = [f'https://example.com/{i}' for i in range(8)]
+        indexers = {self.source.source_type: iter_media_info}
+        for source_limit, global_limit, expected in ((3, 8, 3), (4, 2, 2), (1, 8, 1)):
+            max_running[0] = 0
+            with override_settings(MEDIA_METADATA_SOURCE_CONCURRENCY=source_limit,
+                                   MEDIA_METADATA_CONCURRENCY=global_limit):
+                with mock.patch.dict(Media.BATCH_INDEXERS, indexers):
+                    results = list(fetch_media_metadata(self.source, urls))
+            self.assertEqual(max_running[0], expected)
+            # Every URL has one result, unexpected errors are returned per URL
+            self.assertEqual(sorted(url for url, info, error in results), urls)
+            errors = [url for url, info, error in results if error]
+            self.assertEqual(errors, ['https://example.com/3'])
+        # Semaphores are dropped once no fetches are using them
+        self.assertEqual(metadata_fetch_slots, {})
+
+    def test_fetch_media_metadata_source_fairness(self):
+        # Fetches waiting on a busy source don't hold global slots other sources
+        # could use
+        other = Source.objects.create(
+            source_type=self.source.source_type,
+            key='otherkey',
+            name='othername',
+            directory='otherdirectory',
+        )
+        release = threading.Event()
+
+        def iter_media_info(urls):
+            for url in urls:
+                if 'busy' in url:
+                    release.wait(5)
+                yield url, {'id': url}, None
+
+        def fetch_busy():
+            list(fetch_media_metadata(self.source, ['https://busy.example.com/']))
+
+        indexers = {self.source.source_type: iter_media_info}
+        with override_settings(MEDIA_METADATA_SOURCE_CONCURRENCY=1,
+                               MEDIA_METADATA_CONCURRENCY=2):
+            with mock.patch.dict(Media.BATCH_INDEXERS, indexers):
+                busy = [threading.Thread(target=fetch_busy) for i in range(2)]
+                for thread in busy:
+                    thread.start()
+                # Give both busy fetches time to take or wait for their slots
+                time.sleep(0.1)
+                start = time.monotonic()
+                results = list(fetch_media_metadata(other, ['https://example.com/']))
+                elapsed = time.monotonic() - start
+                release.set()
+                for thread in busy:
+                    thread.join()
+        self.assertEqual(results, [('https://example.com/',
+                                    {'id': 'https://example.com/'}, None)])
+        self.assertLess(elapsed, 2)
+        self.assertEqual(metadata_fetch_slots, {})
+
+    def test_formats_parsed_once(self):
+        media = Media.objects.get(pk=self.media.pk)
+        num_formats = len(media.formats)
+        with mock.patch('sync.utils.parse_media_format',
+                        wraps=parse_media_format) as parse:
+            format_str = media.get_format_str()
+            media.filename
+            media.format_dict
+            media.get_format_by_code(format_str)
+            media.get_best_combined_format()
+            self.assertEqual(parse.call_count, num_formats)
+            # Reassigning the metadata invalidates the parsed formats
+            media.metadata = metadata_hdr
+            media.get_format_str()
+            self.assertEqual(parse.call_count, num_formats + len(media.formats))
+        # Check the precomputed groupings and index
+        parsed_formats = media.parsed_formats
+        self.assertEqual(len(parsed_formats), len(media.formats))
+        self.assertEqual(list(parsed_formats.audio_only),
+                         [f for f in parsed_formats if f['vcodec'] is None])
+        self.assertEqual(list(parsed_formats.video_only),
+                         [f for f in parsed_formats if f['acodec'] is None])
+        self.assertEqual(list(parsed_formats.combined),
+                         [f for f in parsed_formats if f['vcodec'] and f['acodec']])
+        for fmt in parsed_formats:
+            self.assertIs(media.get_format_by_code(fmt['id']), fmt)
+        self.assertFalse(media.get_format_by_code('nonexistent'))
+
+
+class PendingExecutor:
+    '''
+        Executor which leaves tasks pending until the test finishes them.
+    '''
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        self.submitted.append((future, args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class WorkerLaneTestCase(TestCase):
+
+    lanes = {
+        'thumbnails': {'tasks': ('sync.tasks.download_media_thumbnail',),
+                       'concurrency': 2},
+        'downloads': {'tasks': ('sync.tasks.download_media',), 'concurrency': 1},
+    }
+
+    def setUp(self):
+        # Disable general logging for test case
+        logging.disable(logging.CRITICAL)
+        Task.objects.all().delete()
+        for i in range(3):
+            Task.objects.new_task('sync.tasks.download_media', args=(f'media{i}',),
+                                  priority=i).save()
+            Task.objects.new_task('sync.tasks.download_media_thumbnail',
+                                  args=(f'media{i}', 'url')).save()
+        Task.objects.new_task('sync.tasks.rescan_media_server', args=(999,)).save()
+        Task.objects.new_task('sync.tasks.unknown_task').save()
+
+    def get_supervisor(self):
+        supervisor = LaneSupervisor(lanes=self.lanes, report_interval=0)
+        for lane in supervisor.lanes:
+            lane.get_executor = PendingExecutor
+        return supervisor
+
+    def test_lane_concurrency(self):
+        supervisor = self.get_supervisor()
+        lanes = {lane.name: lane for lane in supervisor.lanes}
+        # Tasks not in any lane run in the default lane
+        self.assertEqual(list(lanes), ['thumbnails', 'downloads', 'default'])
+        self.assertEqual(supervisor.run_once(), 4)
+        running = {name: sorted(task.task_name for task, started
+                                in lane.running.values())
+                   for name, lane in lanes.items()}
+        self.assertEqual(running, {
+            'thumbnails': ['sync.tasks.download_media_thumbnail'] * 2,
+            'downloads': ['sync.tasks.download_media'],
+            'default': ['sync.tasks.rescan_media_server'],
+        })
+        # Running tasks are locked, unknown tasks are never picked up
+        self.assertEqual(Task.objects.exclude(locked_by=None).count(), 4)
+        self.assertIsNone(Task.objects.get(task_name='sync.tasks.unknown_task').locked_by)
+        # Tasks are run in priority order
+        task, started = list(lanes['downloads'].running.values())[0]
+        self.assertEqual(task.task_params, json.dumps((('media0',), {})))
+        # Full lanes don't start more tasks, lanes with free workers do
+        self.assertEqual(supervisor.run_once(), 0)
+        future, args = lanes['downloads'].executor.submitted[0]
+        self.assertEqual(args, (task.pk,))
+        Task.objects.filter(pk=task.pk).delete()
+        future.set_result(True)
+        self.assertEqual(supervisor.run_once(), 1)
+        self.assertEqual(len(lanes['downloads'].running), 1)
+        # Utilisation is reported for each lane
+        lanes['thumbnails'].executor.submitted[0][0].set_result(False)
+        reports = {report['lane']: report for report in supervisor.report()}
+        self.assertEqual(reports['downloads']['completed'], 1)
+        self.assertEqual(reports['downloads']['waiting'], 1)
+        self.assertEqual(reports['thumbnails']['failed'], 1)
+        self.assertEqual(reports['thumbnails']['running'], 1)
+        self.assertEqual(reports['default']['waiting'], 0)
+        for report in reports.values():
+            self.assertGreater(report['utilisation'], 0)
+            self.assertLessEqual(report['utilisation'], 1)
+        # Reports are reset after each report
+        reports = {report['lane']: report for report in supervisor.report()}
+        self.assertEqual(reports['downloads']['completed'], 0)
+
+    def test_max_tasks(self):
+        Task.objects.filter(task_name='sync.tasks.rescan_media_server').update(
+            priority=-1)
+        Task.objects.filter(task_name='sync.tasks.download_media_thumbnail').update(
+            priority=5)
+        supervisor = self.get_supervisor()
+        lanes = {lane.name: lane for lane in supervisor.lanes}
+        # The highest priority tasks over all lanes run first up to the limit
+        with override_settings(WORKER_MAX_TASKS=2):
+            self.assertEqual(supervisor.run_once(), 2)
+            self.assertEqual(len(lanes['default'].running), 1)
+            self.assertEqual(len(lanes['downloads'].running), 1)
+            self.assertEqual(len(lanes['thumbnails'].running), 0)
+            self.assertEqual(supervisor.run_once(), 0)
+            lanes['default'].executor.submitted[0][0].set_result(True)
+            self.assertEqual(supervisor.run_once(), 1)
+            self.assertEqual(len(lanes['thumbnails'].running), 1)
+        # Without a limit every lane is filled
+        self.assertEqual(supervisor.run_once(), 1)
+        self.assertEqual(len(lanes['thumbnails'].running), 2)
+
+    def test_lane_settings(self):
+        with override_settings(WORKER_LANES=self.lanes,
+                               WORKER_LANE_CONCURRENCY={'downloads': 3},
+                               WORKER_LANE_PROCESSES=('thumbnails',)):
+            supervisor = LaneSupervisor()
+        lanes = {lane.name: lane for lane in supervisor.lanes}
+        self.assertEqual(lanes['downloads'].concurrency, 3)
+        self.assertFalse(lanes['downloads'].processes)
+        self.assertEqual(lanes['thumbnails'].concurrency, 2)
+        self.assertTrue(lanes['thumbnails'].processes)
+        # The default settings put every task in a lane other than the default lane
+        supervisor = LaneSupervisor()
+        default_lane = [lane for lane in supervisor.lanes if not lane.tasks]
+        self.assertEqual(len(default_lane), 1)
+        for task_name in ('sync.tasks.index_source_task', 'sync.tasks.download_media',
+                          'sync.tasks.download_media_thumbnail',
+                          'sync.tasks.download_media_metadata_batch'):
+            self.assertIn(task_name, supervisor.lane_tasks)
+
+    def test_run_task(self):
+        task = Task.objects.get(task_name='sync.tasks.rescan_media_server')
+        # The test database connection must stay open
+        with mock.patch('sync.workers.connections'), \
+                mock.patch('sync.workers.close_old_connections'):
+            # Completed tasks are deleted
+            self.assertTrue(run_task(task.pk))
+            self.assertFalse(Task.objects.filter(pk=task.pk).exists())
+            # Tasks with errors are rescheduled
+            task = Task.objects.get(task_name='sync.tasks.download_media',
+                                    priority=0)
+            with mock.patch('sync.tasks.Media.objects.get',
+                            side_effect=RuntimeError('error')):
+                self.assertFalse(run_task(task.pk))
+            task = Task.objects.get(pk=task.pk)
+            self.assertEqual(task.attempts, 1)
+            self.assertIn('error', task.last_error)
+
+
+class ProcessLaneTestCase(TransactionTestCase):
+
+    def setUp(self):
+        # Disable general logging for test case
+        logging.disable(logging.CRITICAL)
+        image = BytesIO()
+        Image.new('RGB', (64, 36)).save(image, 'JPEG')
+        image = image.getvalue()
+
+        class ImageHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/jpeg')
+                self.send_header('Content-Length', str(len(image)))
+                self.end_headers()
+                self.wfile.write(image)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), ImageHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_process_lane_task(self):
+        # Tasks run in spawned processes have the signal receivers connected
+        source = Source.objects.create(
+            source_type=Source.SOURCE_TYPE_YOUTUBE_CHANNEL,
+            key='testkey',
+            name='testname',
+            directory='testdirectory',
+        )
+        media = Media.objects.create(key='mediakey', source=source)
+        Task.objects.all().delete()
+        host, port = self.server.server_address
+        task = Task.objects.new_task('sync.tasks.download_media_thumbnail',
+                                     args=(str(media.pk), f'http://{host}:{port}/'))
+        task.save()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # Processes can't share the in-memory test database, copy it to a file
+            database = Path(tmpdir) / 'db.sqlite3'
+            connection.ensure_connection()
+            with sqlite3.connect(str(database)) as db:
+                connection.connection.backup(db)
+            databases = {'default': dict(settings.DATABASES['default'],
+                                         NAME=str(database))}
+            lane = WorkerLane('thumbnails', tasks=(task.task_name,), processes=True)
+            with override_settings(DATABASES=databases):
+                future = lane.submit(task)
+                try:
+                    self.assertTrue(future.result(timeout=120))
+                finally:
+                    lane.shutdown()
+            db = sqlite3.connect(str(database))
+            try:
+                thumb, = db.execute('SELECT thumb FROM sync_media WHERE key = ?',
+                                    ('mediakey',)).fetchone()
+                task_names = [row[0] for row in db.execute(
+                    'SELECT task_name FROM background_task')]
+            finally:
+                db.close()
+        self.assertTrue(thumb)
+        thumb_path = Path(settings.MEDIA_ROOT) / thumb
+        self.assertTrue(thumb_path.is_file())
+        thumb_path.unlink()
+        # Saving the thumbnail ran media_post_save, which scheduled the metadata
+        self.assertEqual(task_names, ['sync.tasks.download_media_metadata'])
+
+
+class FeedProbeTestCase(TestCase):
+
+    def setUp(self):
+        # Disable general logging for test case
+        logging.disable(logging.CRITICAL)
+        self.source = Source.objects.create(
+            source_type=Source.SOURCE_TYPE_YOUTUBE_CHANNEL_ID,
+            key='testkey',
+            name='testname',
+            directory='testdirectory',
+            index_schedule=3600,
+            last_full_crawl=timezone.now(),
+        )
+        Media.objects.create(key='mediakey1', source=self.source)
+        Media.objects.create(key='mediakey2', source=self.source)
+        # Serve the feed from a local stand-in for YouTube
+        self.feed_keys = []
+        self.feed_requests = []
+        test = self
+
+        class FeedHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                test.feed_requests.append(self.path)
+                if test.feed_keys is None:
+                    self.send_error(404)
+                    return
+                body = feed_xml(test.feed_keys).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/atom+xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), FeedHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        global local_feed_url
+        local_feed_url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_feed_media_keys(self):
+        self.feed_keys = ['newkey1', 'mediakey1']
+        url = f'{local_feed_url}/feeds/videos.xml?channel_id=testkey'
+        self.assertEqual(get_feed_media_keys(url), ['newkey1', 'mediakey1'])
+        self.feed_keys = None
+        with self.assertRaises(FeedError):
+            get_feed_media_keys(url)
+        with self.assertRaises(FeedError):
+            get_feed_media_keys(url, fetcher=lambda url: b'not xml')
+
+    @override_settings(INDEX_FEED_PROBE=True,
+                       INDEX_FEED_FETCHER='sync.tests.local_feed_fetcher')
+    def test_index_source_task_feed_probe(self):
+        videos = [{'id': 'newkey1'}, {'id': 'mediakey1'}, {'id': 'mediakey2'}]
+        iter_index_media = mock.Mock(return_value=videos)
+        with mock.patch.object(Source, 'iter_index_media', new=iter_index_media):
+            # No new media in the feed, the index is skipped
+            self.feed_keys = ['mediakey1', 'mediakey2']
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(self.feed_requests,
+                             ['/feeds/videos.xml?channel_id=testkey'])
+            iter_index_media.assert_not_called()
+            self.assertIsNotNone(Source.objects.get(pk=self.source.pk).last_crawl)
+            self.assertFalse(Media.objects.filter(key='newkey1').exists())
+            # New media in the feed, the source is indexed
+            self.feed_keys = ['newkey1', 'mediakey1', 'mediakey2']
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(iter_index_media.call_count, 1)
+            self.assertTrue(Media.objects.filter(key='newkey1').exists())
+            # The feed can't be fetched, the source is indexed
+            self.feed_keys = None
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(iter_index_media.call_count, 2)
+            # Full indexes don't check the feed
+            self.feed_keys = ['newkey1', 'mediakey1', 'mediakey2']
+            self.feed_requests.clear()
+            index_source_task.now(str(self.source.pk), full=True)
+            self.assertEqual(self.feed_requests, [])
+            self.assertEqual(iter_index_media.call_count, 3)
+            # Nor do sources without a feed
+            self.source.source_type = Source.SOURCE_TYPE_YOUTUBE_CHANNEL
+            self.source.save()
+            index_source_task.now(str(self.source.pk))
+            self.assertEqual(self.feed_requests, [])
+            self.assertEqual(iter_index_media.call_count, 4)
+
+
+def metadata_batch_ids(source):
+    # Returns the IDs of the media in the scheduled metadata batches for a source
+    media_ids = []
+    for task in Task.objects.filter(task_name='sync.tasks.download_media_metadata_batch',
+                                    queue=str(source.pk)):
+        args, kwargs = task.params()
+        media_ids.extend(args[1])
+    return media_ids
+
+
+# Base URL of the local server feeds are fetched from by local_feed_fetcher()
+local_feed_url = None
+
+
+def local_feed_fetcher(url):
+    # Fetches feeds from the local server in place of YouTube
+    parts = urlsplit(url)
+    return fetch_feed(f'{local_feed_url}{parts.path}?{parts.query}')
+
+
+def feed_xml(keys):
+    # Returns a minimal YouTube Atom feed listing media with the IDs in "keys"
+    entries = ''.join(f'<entry><yt:videoId>{key}</yt:videoId>'
+                      f'<title>{key}</title></entry>' for key in keys)
+    return (f'<?xml version="1.0" encoding="UTF-8"?>'
+            f'<feed xmlns:yt="http://www.youtube.com/xml/schemas/2015" '
+            f'xmlns="http://www.w3.org/2005/Atom">{entries}</feed>')
+
+
+def multi_pass_get_best_video_format(media):
+    '''
+        Reference implementation of get_best_video_format() structured the way it
+        was before it ranked formats in a single pass, with one pass over the
+        formats for each rule of the source\'s preference ladder.
+    '''
+    source = media.source
+    if source.is_audio:
+        return False, False
+    source_resolution = source.source_resolution.strip().upper()
+    video_formats = [f for f in media.iter_formats() if f['acodec'] is None and
+                     f['format'] == source_resolution]
+    if not video_formats:
+        if not source.can_fallback:
+            return False, False
+        video_formats = [f for f in media.iter_formats() if f['acodec'] is None and
+                         min_height <= f['height'] <= source.source_resolution_height]
+    video_formats = list(reversed(sorted(video_formats, key=lambda k: k['height'])))
+    ladder = VIDEO_FORMAT_LADDERS[(source.prefer_60fps, source.prefer_hdr)]
+    if not source.can_fallback:
+        ladder = ladder[:1]
+    for rank, rule in enumerate(ladder):
+        for fmt in video_formats:
+            matches = (source_resolution == fmt['format'],
+                       source.source_vcodec == fmt['vcodec'],
+                       fmt['is_hdr'], fmt['is_60fps'])
+            if not all(req is None or req == m for req, m in zip(rule, matches)):
+                continue
+            if rank == 0:
+                return True, fmt['id']
+            if (source.fallback == Source.FALLBACK_NEXT_BEST_HD and
+                fmt['height'] >= fallback_hd_cutoff):
+                return False, fmt['id']
+            elif source.fallback == Source.FALLBACK_NEXT_BEST:
+                return False, fmt['id']
+            return False, False
+    return False, False
+
 
 class FormatMatchingTestCase(TestCase):
 
@@ -1397,3 +2547,39 @@ class FormatMatchingTestCase(TestCase):
             match_type, format_code = self.media.get_best_video_format()
             self.assertEqual(format_code, expected_format_code)
             self.assertEqual(match_type, expeceted_match_type)
+
+    def test_video_format_ranking_equivalence(self):
+        # The single pass ranking must pick the same format as one pass per rule
+        # for every source profile, over the test metadata and random format lists
+        format_lists = [json.loads(m)['formats'] for m in all_test_metadata.values()]
+        format_lists.append(json.loads(metadata_low_formats)['formats'])
+        synthetic_formats = synthetic_video_formats()
+        rng = random.Random(1)
+        for i in range(100):
+            format_lists.append(rng.sample(synthetic_formats, rng.randint(1, 64)))
+        profiles = list(itertools.product(
+            [r for r, _ in Source.SOURCE_RESOLUTION_CHOICES], Source.SOURCE_VCODECS,
+            (True, False), (True, False), Source.FALLBACKS))
+        for formats in format_lists:
+            self.media.metadata = json.dumps({'formats': formats})
+            for resolution, vcodec, prefer_60fps, prefer_hdr, fallback in profiles:
+                self.source.source_resolution = resolution
+                self.source.source_vcodec = vcodec
+                self.source.prefer_60fps = prefer_60fps
+                self.source.prefer_hdr = prefer_hdr
+                self.source.fallback = fallback
+                self.assertEqual(get_best_video_format(self.media),
+                                 multi_pass_get_best_video_format(self.media))
+
+    def test_benchmark_matching_command(self):
+        # The benchmark emits a result for each function over each format list
+        out = StringIO()
+        call_command('benchmark-matching', iterations=1, sizes='16', json=True,
+                     stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['profiles'], 384)
+        fixtures = len(list((Path(__file__).parent / 'testdata').glob('metadata*.json')))
+        self.assertEqual(len(report['results']), (fixtures + 1) * 5)
+        for result in report['results']:
+            self.assertGreater(result['calls'], 0)
+            self.assertGreaterEqual(result['per_call_us'], 0)
@@ -0,0 +1,62 @@
+import random
+
+
+def synthetic_video_formats():
+    '''
+        Returns a list of video-only formats in every combination of height, codec,
+        HDR, frame rate and format note style.
+    '''
+    formats = []
+    for height in (144, 240, 360, 480, 720, 1080, 1440, 2160):
+        for vcodec in ('vp9', 'avc1.4d401f', 'av01.0.08M.08'):
+            for hdr in (False, True):
+                for fps in (30, 60):
+                    for note in (f'{height}p', 'DASH video'):
+                        format_id = str(len(formats) + 1)
+                        fps_note = '60' if fps == 60 else ''
+                        hdr_note = ' HDR' if hdr else ''
+                        formats.append({
+                            'format_id': format_id,
+                            'format': f'{format_id} - {height}p{hdr_note}',
+                            'format_note': f'{note}{fps_note}{hdr_note}',
+                            'vcodec': vcodec,
+                            'acodec': 'none',
+                            'height': height,
+                            'width': height * 16 // 9,
+                            'fps': fps,
+                            'tbr': height,
+                        })
+    return formats
+
+
+def random_formats(count, seed=None):
+    '''
+        Returns a list of count random formats, similar to a large formats list
+        from youtube-dl. Roughly a quarter are audio-only and a tenth combined, the
+        rest are video-only.
+    '''
+    rng = random.Random(seed)
+    video_formats = synthetic_video_formats()
+    formats = []
+    for i in range(count):
+        format_id = str(1000 + i)
+        kind = rng.random()
+        if kind < 0.25:
+            acodec = rng.choice(('opus', 'mp4a.40.2', 'mp4a.40.5'))
+            abr = rng.choice((48, 50, 70, 128, 160))
+            formats.append({
+                'format_id': format_id,
+                'format': f'{format_id} - audio only (tiny)',
+                'format_note': 'tiny',
+                'vcodec': 'none',
+                'acodec': acodec,
+                'abr': abr,
+                'tbr': abr,
+            })
+        else:
+            fmt = dict(rng.choice(video_formats), format_id=format_id)
+            if kind < 0.35:
+                fmt['acodec'] = rng.choice(('opus', 'mp4a.40.2'))
+                fmt['abr'] = 128
+            formats.append(fmt)
+    return formats
@@ -2,9 +2,9 @@ from django.urls import path
 from .views import (DashboardView, SourcesView, ValidateSourceView, AddSourceView,
                     SourceView, UpdateSourceView, DeleteSourceView, MediaView,
                     MediaThumbView, MediaItemView, MediaRedownloadView, MediaSkipView,
-                    MediaEnableView, TasksView, CompletedTasksView, ResetTasks,
-                    MediaServersView, AddMediaServerView, MediaServerView,
-                    DeleteMediaServerView, UpdateMediaServerView)
+                    MediaEnableView, TasksView, CompletedTasksView, IndexLoadView,
+                    ResetTasks, MediaServersView, AddMediaServerView,
+                    MediaServerView, DeleteMediaServerView, UpdateMediaServerView)
 
 
 app_name = 'sync'
@@ -80,6 +80,10 @@ urlpatterns = [
          CompletedTasksView.as_view(),
          name='tasks-completed'),
 
+    path('tasks-index-load',
+         IndexLoadView.as_view(),
+         name='tasks-index-load'),
+
     path('tasks-reset',
          ResetTasks.as_view(),
          name='reset-tasks'),
@@ -1,12 +1,25 @@
 import os
 import re
 import math
+import zlib
 from pathlib import Path
 import requests
 from PIL import Image
 from django.conf import settings
 from urllib.parse import urlsplit, parse_qs
 from django.forms import ValidationError
+from common.logger import log
+from .fileindex import file_index
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+METADATA_CODECS = ('zlib', 'zstd')
+# Keys of each format read by parse_media_format(), never removed by slim_metadata()
+MEDIA_FORMAT_REQUIRED_KEYS = ('format_id', 'format', 'format_note', 'acodec', 'vcodec',
+                              'abr', 'tbr', 'fps', 'height', 'width')
 
 
 def validate_url(url, validator):
@@ -78,7 +91,7 @@ def resize_image_to_height(image, width, height):
     if scaled_width < width:
         # Width too small, stretch it
         scaled_width = width
-    image = image.resize((scaled_width, height), Image.ANTIALIAS)
+    image = image.resize((scaled_width, height), Image.LANCZOS)
     if scaled_width > width:
         # Width too large, crop it
         delta = scaled_width - width
@@ -118,10 +131,87 @@ def write_text_file(filepath, filedata):
 
 def delete_file(filepath):
     if file_is_editable(filepath):
-        return os.remove(filepath)
+        os.remove(filepath)
+        file_index.discard(filepath)
+        return True
     return False
 
 
+def get_metadata_codec():
+    '''
+        Returns the codec new metadata should be compressed with from the
+        MEDIA_METADATA_COMPRESSION setting, or an empty string if metadata should be
+        stored uncompressed. Falls back to zlib if zstd is requested but the
+        zstandard package isn't installed.
+    '''
+    codec = str(getattr(settings, 'MEDIA_METADATA_COMPRESSION', '') or '')
+    codec = codec.strip().lower()
+    if codec in ('', 'none', 'off'):
+        return ''
+    if codec not in METADATA_CODECS:
+        raise ValueError(f'Invalid MEDIA_METADATA_COMPRESSION "{codec}", must be '
+                         f'one of: {METADATA_CODECS}')
+    if codec == 'zstd' and zstandard is None:
+        log.warn(f'MEDIA_METADATA_COMPRESSION is "zstd" but the zstandard package '
+                 f'is not installed, using "zlib"')
+        return 'zlib'
+    return codec
+
+
+def compress_metadata(metadata, codec):
+    '''
+        Compresses a JSON encoded metadata string with the named codec, returning
+        the compressed bytes.
+    '''
+    data = str(metadata).encode('utf-8')
+    if codec == 'zlib':
+        return zlib.compress(data, 6)
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('Unable to compress metadata with zstd, the zstandard '
+                             'package is not installed')
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    raise ValueError(f'Unknown metadata codec "{codec}"')
+
+
+def decompress_metadata(data, codec):
+    '''
+        Decompresses metadata compressed by compress_metadata() with the named codec
+        back in to a JSON encoded metadata string.
+    '''
+    data = bytes(data)
+    if codec == 'zlib':
+        return zlib.decompress(data).decode('utf-8')
+    elif codec == 'zstd':
+        if zstandard is None:
+            raise ValueError('Unable to decompress metadata with zstd, the '
+                             'zstandard package is not installed')
+        return zstandard.ZstdDecompressor().decompress(data).decode('utf-8')
+    raise ValueError(f'Unknown metadata codec "{codec}"')
+
+
+def slim_metadata(metadata, drop_keys=(), keep_keys=(), formats_key='formats',
+                  format_keys=()):
+    '''
+        Returns a copy of a media metadata dict with transient data that is never
+        used, such as signed stream URLs and captions, removed. Top level keys in
+        drop_keys are removed unless they are also in keep_keys. Each format listed
+        under formats_key only keeps the keys in format_keys along with the keys
+        required by parse_media_format().
+    '''
+    drop_keys = set(drop_keys) - set(keep_keys)
+    format_keys = set(format_keys) | set(MEDIA_FORMAT_REQUIRED_KEYS)
+    slimmed = {}
+    for key, value in metadata.items():
+        if key in drop_keys:
+            continue
+        if key == formats_key and isinstance(value, (list, tuple)):
+            value = [{k: v for k, v in f.items() if k in format_keys}
+                     if isinstance(f, dict) else f for f in value]
+        slimmed[key] = value
+    return slimmed
+
+
 def seconds_to_timestr(seconds):
    seconds = seconds % (24 * 3600)
    hour = seconds // 3600
@@ -131,6 +221,89 @@ def seconds_to_timestr(seconds):
    return '{:02d}:{:02d}:{:02d}'.format(hour, minutes, seconds)
 
 
+class ParsedFormat:
+    '''
+        A single media format as returned by parse_media_format(). Uses __slots__ to
+        keep the parsed formats of media with long format lists compact. Values can
+        be accessed as attributes or as fmt['key'] as if it were a dict.
+    '''
+
+    __slots__ = ('id', 'format', 'format_verbose', 'height', 'width', 'vcodec', 'fps',
+                 'vbr', 'acodec', 'abr', 'is_60fps', 'is_hdr', 'is_hls', 'is_dash')
+
+    def __init__(self, **kwargs):
+        for key in self.__slots__:
+            setattr(self, key, kwargs[key])
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def __eq__(self, other):
+        if isinstance(other, (ParsedFormat, dict)):
+            return self.as_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self):
+        return f'ParsedFormat({self.as_dict()})'
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def items(self):
+        return ((key, getattr(self, key)) for key in self.__slots__)
+
+    def as_dict(self):
+        return dict(self.items())
+
+
+class ParsedFormats:
+    '''
+        All formats of a media item parsed once by parse_media_format(), with an
+        index by format ID and the formats grouped the way the matchers in
+        matching.py select them. Formats with neither an audio or video codec, such
+        as storyboards, are in both audio_only and video_only. video_only_by_height
+        is video_only ordered from the highest to the lowest height, formats with
+        the same height are in reverse order.
+    '''
+
+    __slots__ = ('formats', 'by_id', 'audio_only', 'video_only', 'video_only_by_height',
+                 'combined')
+
+    def __init__(self, formats):
+        self.formats = tuple(parse_media_format(fmt) for fmt in formats)
+        self.by_id = {}
+        audio_only, video_only, combined = [], [], []
+        for fmt in self.formats:
+            # If format IDs are duplicated the first one wins
+            self.by_id.setdefault(fmt.id, fmt)
+            if fmt.vcodec is None:
+                audio_only.append(fmt)
+            if fmt.acodec is None:
+                video_only.append(fmt)
+            if fmt.vcodec is not None and fmt.acodec is not None:
+                combined.append(fmt)
+        self.audio_only = tuple(audio_only)
+        self.video_only = tuple(video_only)
+        self.video_only_by_height = tuple(reversed(sorted(video_only,
+                                                          key=lambda f: f.height)))
+        self.combined = tuple(combined)
+
+    def __iter__(self):
+        return iter(self.formats)
+
+    def __len__(self):
+        return len(self.formats)
+
+
 def parse_media_format(format_dict):
     '''
         This parser primarily adapts the format dict returned by youtube-dl into a
@@ -183,19 +356,19 @@ def parse_media_format(format_dict):
             format_str = f'{height}P'
         else:
             format_str = None
-    return {
-        'id': format_dict.get('format_id', ''),
-        'format': format_str,
-        'format_verbose': format_dict.get('format', ''),
-        'height': height,
-        'width': width,
-        'vcodec': vcodec,
-        'fps': format_dict.get('fps', 0),
-        'vbr': format_dict.get('tbr', 0),
-        'acodec': acodec,
-        'abr': format_dict.get('abr', 0),
-        'is_60fps': fps > 50,
-        'is_hdr': 'HDR' in format_dict.get('format', '').upper(),
-        'is_hls': is_hls,
-        'is_dash': is_dash,
-    }
+    return ParsedFormat(
+        id=format_dict.get('format_id', ''),
+        format=format_str,
+        format_verbose=format_dict.get('format', ''),
+        height=height,
+        width=width,
+        vcodec=vcodec,
+        fps=format_dict.get('fps', 0),
+        vbr=format_dict.get('tbr', 0),
+        acodec=acodec,
+        abr=format_dict.get('abr', 0),
+        is_60fps=fps > 50,
+        is_hdr='HDR' in format_dict.get('format', '').upper(),
+        is_hls=is_hls,
+        is_dash=is_dash,
+    )
@@ -7,7 +7,7 @@ from django.views.generic import TemplateView, ListView, DetailView
 from django.views.generic.edit import (FormView, FormMixin, CreateView, UpdateView,
                                        DeleteView)
 from django.views.generic.detail import SingleObjectMixin
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect
 from django.urls import reverse_lazy
 from django.db import IntegrityError
 from django.db.models import Q, Count, Sum, When, Case
@@ -24,8 +24,8 @@ from .forms import (ValidateSourceForm, ConfirmDeleteSourceForm, RedownloadMedia
 from .utils import validate_url, delete_file
 from .tasks import (map_task_to_instance, get_error_message,
                     get_source_completed_tasks, get_media_download_task,
-                    delete_task_by_media, index_source_task)
-from . import signals
+                    delete_task_by_media, schedule_index_source_task,
+                    schedule_update_source_media, get_index_load, delete_source)
 from . import youtube
 
 
@@ -67,11 +67,11 @@ class DashboardView(TemplateView):
         # Latest downloads
         data['latest_downloads'] = Media.objects.filter(
             downloaded=True
-        ).order_by('-download_date')[:10]
+        ).select_related('source').order_by('-download_date')[:10]
         # Largest downloads
         data['largest_downloads'] = Media.objects.filter(
             downloaded=True, downloaded_filesize__isnull=False
-        ).order_by('-downloaded_filesize')[:10]
+        ).select_related('source').order_by('-downloaded_filesize')[:10]
         # UID and GID
         data['uid'] = os.getuid()
         data['gid'] = os.getgid()
@@ -92,6 +92,9 @@ class SourcesView(ListView):
     paginate_by = settings.SOURCES_PER_PAGE
     messages = {
         'source-deleted': _('Your selected source has been deleted.'),
+        'source-deleting': _('Your selected source is being deleted in the '
+                             'background. It will be removed from this list once '
+                             'all of its media has been deleted.'),
     }
 
     def __init__(self, *args, **kwargs):
@@ -360,7 +363,7 @@ class SourceView(DetailView):
             error_message = get_error_message(error)
             setattr(error, 'error_message', error_message)
             data['errors'].append(error)
-        data['media'] = Media.objects.filter(source=self.object).order_by('-published')
+        data['media_count'] = Media.objects.filter(source=self.object).count()
         return data
 
 
@@ -411,23 +414,23 @@ class DeleteSourceView(DeleteView, FormMixin):
     def post(self, request, *args, **kwargs):
         delete_media_val = request.POST.get('delete_media', False)
         delete_media = True if delete_media_val is not False else False
-        if delete_media:
-            source = self.get_object()
-            for media in Media.objects.filter(source=source):
-                if media.media_file:
-                    # Delete the media file
-                    delete_file(media.media_file.name)
-                    # Delete thumbnail copy if it exists
-                    delete_file(media.thumbpath)
-                    # Delete NFO file if it exists
-                    delete_file(media.nfopath)
-                    # Delete JSON file if it exists
-                    delete_file(media.jsonpath)
-        return super().post(request, *args, **kwargs)
+        source = self.get_object()
+        # Deleting a source with a lot of media can take a long time, do it in the
+        # background
+        verbose_name = _('Deleting source "{}"')
+        delete_source(
+            str(source.pk),
+            delete_files=delete_media,
+            queue=str(source.pk),
+            priority=0,
+            verbose_name=verbose_name.format(source.name),
+            remove_existing_tasks=True
+        )
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_success_url(self):
         url = reverse_lazy('sync:sources')
-        return append_uri_params(url, {'message': 'source-deleted'})
+        return append_uri_params(url, {'message': 'source-deleting'})
 
 
 class MediaView(ListView):
@@ -479,6 +482,7 @@ class MediaView(ListView):
                 q = Media.objects.filter(skip=True)
             else:
                 q = Media.objects.filter(skip=False)
+        q = q.select_related('source')
         return q.order_by('-published', '-created')
 
     def get_context_data(self, *args, **kwargs):
@@ -787,11 +791,39 @@ class CompletedTasksView(ListView):
         return data
 
 
+class IndexLoadView(TemplateView):
+    '''
+        Shows how many sources are scheduled to be indexed in each hour over the next
+        day so the spread of indexing load can be checked.
+    '''
+
+    template_name = 'sync/tasks-index-load.html'
+
+    def get_context_data(self, *args, **kwargs):
+        data = super().get_context_data(*args, **kwargs)
+        now = timezone.now()
+        start = now.replace(minute=0, second=0, microsecond=0)
+        load = get_index_load(start, hours=24)
+        busiest = max(len(sources) for hour, sources in load)
+        data['hours'] = []
+        for hour, sources in load:
+            data['hours'].append({
+                'start': hour,
+                'sources': sources,
+                'count': len(sources),
+                'percent': round(len(sources) / busiest * 100) if busiest else 0,
+            })
+        data['total'] = sum(h['count'] for h in data['hours'])
+        data['busiest'] = busiest
+        data['jitter'] = getattr(settings, 'INDEX_SCHEDULE_JITTER', 0)
+        return data
+
+
 class ResetTasks(FormView):
     '''
-        Confirm that all tasks should be reset. As all tasks are triggered from
-        signals by checking for files existing etc. this can be done by just deleting
-        all tasks and then calling every Source objects .save() method.
+        Confirm that all tasks should be reset. As all tasks are triggered by checking
+        for files existing etc. this can be done by just deleting all tasks and then
+        rescheduling the index and media updates of every Source.
     '''
 
     template_name = 'sync/tasks-reset.html'
@@ -803,16 +835,9 @@ class ResetTasks(FormView):
         # Iter all tasks
         for source in Source.objects.all():
             # Recreate the initial indexing task
-            verbose_name = _('Index media from source "{}"')
-            index_source_task(
-                str(source.pk),
-                repeat=source.index_schedule,
-                queue=str(source.pk),
-                priority=5,
-                verbose_name=verbose_name.format(source.name)
-            )
-            # This also chains down to call each Media objects .save() as well
-            source.save()
+            schedule_index_source_task(source)
+            # Recreate any media tasks with a bulk update of the sources media
+            schedule_update_source_media(source)
         return super().form_valid(form)
 
     def get_success_url(self):
@@ -0,0 +1,18 @@
+'''
+    Sets up the processes spawned to run tasks in process lanes, see sync.workers.
+    This is kept apart from sync.workers as that imports models, which can't be
+    imported in a new process until Django has been set up.
+'''
+
+
+import django
+from django.conf import settings
+
+
+def setup_worker_process(databases):
+    '''
+        Sets up Django in a spawned lane worker process to use the same databases as
+        the supervisor which spawned it.
+    '''
+    settings.DATABASES = databases
+    django.setup()
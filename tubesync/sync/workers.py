@@ -0,0 +1,274 @@
+'''
+    A task worker which runs background tasks in lanes. Each lane runs a set of task
+    types with its own concurrency so, for example, a long download does not stop
+    thumbnails or metadata for new sources from being fetched. Lanes run tasks in
+    threads, or in processes for CPU heavy tasks which would otherwise compete for
+    the GIL. Tasks not in any lane are run in the "default" lane.
+'''
+
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from background_task.models import Task
+from background_task.settings import app_settings
+from background_task.tasks import tasks, bg_runner
+from common.logger import log
+# Registers the task functions when imported in lane worker processes
+from . import tasks as sync_tasks
+from .workerprocess import setup_worker_process
+
+
+DEFAULT_LANE = 'default'
+
+
+def run_task(task_id):
+    '''
+        Runs the task with the ID "task_id" which must already be locked by the lane
+        worker. Returns True if the task completed or False if it raised an error and
+        was rescheduled.
+    '''
+    close_old_connections()
+    try:
+        try:
+            task = Task.objects.get(pk=task_id)
+        except Task.DoesNotExist:
+            # Task was deleted after it was locked, nothing to run
+            return True
+        proxy_task = tasks._tasks.get(task.task_name)
+        if not proxy_task:
+            log.error(f'Lane worker has no function for task: {task.task_name}')
+            return False
+        log.info(f'Running task: {task}')
+        bg_runner(proxy_task, task)
+        # Tasks which complete are deleted, tasks with errors are rescheduled
+        return not Task.objects.filter(pk=task_id).exists()
+    finally:
+        connections.close_all()
+
+
+class WorkerLane:
+    '''
+        A set of task types run with their own concurrency.
+    '''
+
+    def __init__(self, name, tasks=(), concurrency=1, processes=False):
+        self.name = name
+        self.tasks = tuple(tasks)
+        self.concurrency = max(int(concurrency), 1)
+        self.processes = bool(processes)
+        self.executor = None
+        self.running = {}
+        self.window_start = time.monotonic()
+        self.busy = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    def __str__(self):
+        return self.name
+
+    def get_executor(self):
+        if self.processes:
+            # Processes are spawned rather than forked so they don't share the
+            # supervisor's database connections, Django must be set up before this
+            # module is imported in them to run tasks
+            return ProcessPoolExecutor(
+                max_workers=self.concurrency,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=setup_worker_process,
+                initargs=(settings.DATABASES,)
+            )
+        return ThreadPoolExecutor(max_workers=self.concurrency,
+                                  thread_name_prefix=f'lane-{self.name}')
+
+    @property
+    def free_slots(self):
+        return self.concurrency - len(self.running)
+
+    def submit(self, task):
+        if self.executor is None:
+            self.executor = self.get_executor()
+        future = self.executor.submit(run_task, task.pk)
+        self.running[future] = (task, time.monotonic())
+        return future
+
+    def reap(self):
+        '''
+            Removes finished tasks from the lane and records how long they ran for.
+            Returns the number of tasks which finished.
+        '''
+        now = time.monotonic()
+        finished = [future for future in self.running if future.done()]
+        for future in finished:
+            task, started = self.running.pop(future)
+            self.busy += now - max(started, self.window_start)
+            try:
+                completed = future.result()
+            except Exception as e:
+                log.error(f'Lane "{self}" failed to run task: {task}: {e}')
+                completed = False
+            if completed:
+                self.completed += 1
+            else:
+                self.failed += 1
+        return len(finished)
+
+    def report(self, waiting=0):
+        '''
+            Returns a dict of the lane's utilisation since the last report and resets
+            it. Utilisation is the share of the lane's available worker time spent
+            running tasks.
+        '''
+        now = time.monotonic()
+        busy = self.busy + sum(now - max(started, self.window_start)
+                               for task, started in self.running.values())
+        elapsed = now - self.window_start
+        capacity = elapsed * self.concurrency
+        report = {
+            'lane': self.name,
+            'concurrency': self.concurrency,
+            'processes': self.processes,
+            'running': len(self.running),
+            'waiting': waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+            'utilisation': min(busy / capacity, 1.0) if capacity > 0 else 0.0,
+        }
+        self.window_start = now
+        self.busy = 0.0
+        self.completed = 0
+        self.failed = 0
+        return report
+
+    def shutdown(self, wait=True):
+        if self.executor is not None:
+            self.executor.shutdown(wait=wait)
+            self.executor = None
+        self.reap()
+
+
+class LaneSupervisor:
+    '''
+        Finds tasks which are ready to run and hands them to the lane for their task
+        type as the lane has free workers.
+    '''
+
+    def __init__(self, lanes=None, report_interval=None):
+        if lanes is None:
+            lanes = getattr(settings, 'WORKER_LANES', {})
+        concurrency = getattr(settings, 'WORKER_LANE_CONCURRENCY', {})
+        processes = getattr(settings, 'WORKER_LANE_PROCESSES', ())
+        self.lanes = []
+        for name, options in lanes.items():
+            options = dict(options)
+            if name in concurrency:
+                options['concurrency'] = concurrency[name]
+            if name in processes:
+                options['processes'] = True
+            self.lanes.append(WorkerLane(name, **options))
+        if not any(not lane.tasks for lane in self.lanes):
+            self.lanes.append(WorkerLane(DEFAULT_LANE))
+        self.lane_tasks = set()
+        for lane in self.lanes:
+            self.lane_tasks.update(lane.tasks)
+        if report_interval is None:
+            report_interval = getattr(settings, 'WORKER_LANE_REPORT_INTERVAL', 300)
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+        self.worker_name = str(os.getpid())
+
+    def get_available_tasks(self, lane):
+        '''
+            Returns a queryset of the tasks which are ready to run in "lane".
+        '''
+        now = timezone.now()
+        qs = Task.objects.unlocked(now).filter(run_at__lte=now, failed_at=None)
+        if lane.tasks:
+            qs = qs.filter(task_name__in=lane.tasks)
+        else:
+            qs = qs.filter(task_name__in=list(tasks._tasks))
+            qs = qs.exclude(task_name__in=self.lane_tasks)
+        ordering = app_settings.BACKGROUND_TASK_PRIORITY_ORDERING
+        return qs.order_by(f'{ordering}priority', 'run_at')
+
+    def run_once(self):
+        '''
+            Fills each lane's free workers with tasks, up to WORKER_MAX_TASKS running
+            over all lanes if it is set. Tasks from every lane are started in
+            priority order so a limit over all lanes still runs the most important
+            tasks first. Returns the number of tasks started.
+        '''
+        max_tasks = getattr(settings, 'WORKER_MAX_TASKS', 0)
+        running = 0
+        candidates = []
+        for lane in self.lanes:
+            lane.reap()
+            running += len(lane.running)
+            free_slots = lane.free_slots
+            if free_slots <= 0:
+                continue
+            # Fetch a few extra tasks in case other workers lock some of them first
+            for task in self.get_available_tasks(lane)[:free_slots * 2]:
+                candidates.append((task, lane))
+        descending = app_settings.BACKGROUND_TASK_PRIORITY_ORDERING == '-'
+        candidates.sort(key=lambda c: (-c[0].priority if descending else c[0].priority,
+                                       c[0].run_at))
+        started = 0
+        for task, lane in candidates:
+            if max_tasks > 0 and running >= max_tasks:
+                break
+            if lane.free_slots <= 0:
+                continue
+            locked_task = task.lock(self.worker_name)
+            if not locked_task:
+                continue
+            lane.submit(locked_task)
+            started += 1
+            running += 1
+        return started
+
+    def report(self):
+        '''
+            Logs and returns the utilisation of each lane since the last report.
+        '''
+        reports = []
+        for lane in self.lanes:
+            lane.reap()
+            waiting = self.get_available_tasks(lane).count()
+            report = lane.report(waiting=waiting)
+            log.info(f'Lane "{lane}": {report["running"]}/{report["concurrency"]} '
+                     f'running, {report["utilisation"]:.0%} utilised, '
+                     f'{report["completed"]} completed, {report["failed"]} failed, '
+                     f'{report["waiting"]} waiting')
+            reports.append(report)
+        self.last_report = time.monotonic()
+        return reports
+
+    def run(self, duration=0, sleep=5.0, stop=None):
+        '''
+            Runs tasks until "duration" seconds have passed, or forever if 0, or
+            until "stop" returns True.
+        '''
+        start = time.monotonic()
+        lanes = ', '.join(f'{lane} ({lane.concurrency} '
+                          f'{"processes" if lane.processes else "threads"})'
+                          for lane in self.lanes)
+        log.info(f'Starting task worker with lanes: {lanes}')
+        try:
+            while duration <= 0 or time.monotonic() - start <= duration:
+                if stop is not None and stop():
+                    break
+                if not self.run_once():
+                    close_old_connections()
+                    time.sleep(sleep)
+                if (self.report_interval > 0 and
+                        time.monotonic() - self.last_report >= self.report_interval):
+                    self.report()
+        finally:
+            log.info('Stopping task worker, waiting for running tasks to finish')
+            for lane in self.lanes:
+                lane.shutdown(wait=True)
@@ -5,6 +5,7 @@
 
 
 import os
+import itertools
 from django.conf import settings
 from copy import copy
 from common.logger import log
@@ -36,12 +37,7 @@ def get_yt_opts():
     return opts
 
 
-def get_media_info(url):
-    '''
-        Extracts information from a YouTube URL and returns it as a dict. For a channel
-        or playlist this returns a dict of all the videos on the channel or playlist
-        as well as associated metadata.
-    '''
+def get_media_info_opts():
     opts = get_yt_opts()
     opts.update({
         'skip_download': True,
@@ -50,6 +46,16 @@ def get_media_info(url):
         'logger': log,
         'extract_flat': True,
     })
+    return opts
+
+
+def get_media_info(url):
+    '''
+        Extracts information from a YouTube URL and returns it as a dict. For a channel
+        or playlist this returns a dict of all the videos on the channel or playlist
+        as well as associated metadata.
+    '''
+    opts = get_media_info_opts()
     response = {}
     with yt_dlp.YoutubeDL(opts) as y:
         try:
@@ -64,6 +70,78 @@ def get_media_info(url):
     return response
 
 
+def iter_media_info(urls):
+    '''
+        Extracts information from many YouTube URLs through a single youtube-dl
+        instance rather than setting one up for each URL. Yields a tuple of
+        (url, info, error) for each URL where info is the dict returned by
+        get_media_info() or None and error is a YouTubeError if the information
+        could not be extracted.
+    '''
+    opts = get_media_info_opts()
+    with yt_dlp.YoutubeDL(opts) as y:
+        for url in urls:
+            try:
+                response = y.extract_info(url, download=False)
+            except yt_dlp.utils.DownloadError as e:
+                yield url, None, YouTubeError(f'Failed to extract_info for "{url}": '
+                                              f'{e}')
+                continue
+            if not response:
+                yield url, None, YouTubeError(f'Failed to extract_info for "{url}": '
+                                              f'No metadata was returned by '
+                                              f'youtube-dl')
+                continue
+            yield url, response, None
+
+
+def get_media_entries(url, start=0):
+    '''
+        Extracts the videos from a YouTube channel or playlist URL lazily, yielding a
+        dict of flat metadata for each video. Further pages of results are only
+        requested as the entries are consumed so stopping iteration early avoids
+        fetching the rest of the channel or playlist. Entries are not kept once
+        they have been yielded. The first "start" entries are skipped.
+    '''
+    opts = get_yt_opts()
+    opts.update({
+        'skip_download': True,
+        'simulate': True,
+        'logger': log,
+        'extract_flat': True,
+    })
+    # Ask for the approximate upload dates shown on channel pages to be included
+    # in the flat metadata
+    extractor_args = dict(opts.get('extractor_args', {}))
+    extractor_args['youtubetab'] = dict(extractor_args.get('youtubetab', {}),
+                                        approximate_date=[''])
+    opts['extractor_args'] = extractor_args
+    with yt_dlp.YoutubeDL(opts) as y:
+        try:
+            response = y.extract_info(url, download=False, process=False)
+            # Follow any redirects to the canonical channel or playlist URL
+            redirects = 0
+            while (response and response.get('_type') in ('url', 'url_transparent')
+                   and redirects < 5):
+                response = y.extract_info(response['url'], download=False,
+                                          process=False)
+                redirects += 1
+        except yt_dlp.utils.DownloadError as e:
+            raise YouTubeError(f'Failed to extract_info for "{url}": {e}') from e
+        if not response:
+            raise YouTubeError(f'Failed to extract_info for "{url}": No metadata was '
+                               f'returned by youtube-dl, check for error messages in '
+                               f'the logs above. This task will be retried later with '
+                               f'an exponential backoff.')
+        try:
+            entries = response.get('entries') or ()
+            for entry in itertools.islice(entries, start, None):
+                if entry:
+                    yield entry
+        except yt_dlp.utils.DownloadError as e:
+            raise YouTubeError(f'Failed to extract entries for "{url}": {e}') from e
+
+
 def download_media(url, media_format, extension, output_file, info_json):
     '''
         Downloads a YouTube URL to a file on disk.
@@ -38,6 +38,7 @@ MIDDLEWARE = [
     'whitenoise.middleware.WhiteNoiseMiddleware',
     'common.middleware.MaterializeDefaultFieldsMiddleware',
     'common.middleware.BasicAuthMiddleware',
+    'sync.middleware.ScheduledTasksMiddleware',
 ]
 
 
@@ -138,6 +139,63 @@ BACKGROUND_TASK_ASYNC_THREADS = 1           # Number of async tasks to run at on
 MAX_BACKGROUND_TASK_ASYNC_THREADS = 8       # For sanity reasons
 BACKGROUND_TASK_PRIORITY_ORDERING = 'ASC'   # Use 'niceness' task priority ordering
 COMPLETED_TASKS_DAYS_TO_KEEP = 7            # Number of days to keep completed tasks
+MEDIA_BULK_BATCH_SIZE = 500                 # Number of media items updated at once by bulk tasks
+MEDIA_METADATA_BATCH_SIZE = 25              # Number of media items to download metadata for in each batched task
+MEDIA_METADATA_WRITE_BATCH_SIZE = 10        # Number of media items to save metadata for at once in batched tasks
+MEDIA_METADATA_CONCURRENCY = 4              # Maximum number of media items to fetch metadata for at once
+MEDIA_METADATA_SOURCE_CONCURRENCY = 2       # Maximum number of media items to fetch metadata for at once per source
+INDEX_INCREMENTAL_STOP_AFTER = 50           # Stop indexing after this many known media in a row, 0 to always index everything
+INDEX_FULL_CRAWL_INTERVAL = 604800          # Seconds between full indexes of every media item on a source
+INDEX_ADAPTIVE_MIN_INTERVAL = 3600          # Minimum seconds between indexes of sources with the adaptive schedule
+INDEX_ADAPTIVE_MAX_INTERVAL = 604800        # Maximum seconds between indexes of sources with the adaptive schedule
+INDEX_ADAPTIVE_SAMPLE_SIZE = 10             # Number of recently published media used to estimate how often a source publishes
+INDEX_SCHEDULE_JITTER = 300                 # Maximum seconds of random delay added to each source's staggered index schedule
+INDEX_FEED_PROBE = True                     # Check the feed of recent uploads for new media before incremental indexes
+INDEX_FEED_FETCHER = 'sync.feeds.fetch_feed'  # Function used to fetch feeds of recent uploads
+INDEX_FEED_TIMEOUT = 10                     # Seconds to wait for a feed of recent uploads
+FILE_INDEX_MAX_AGE = 300                    # Seconds between sweeps of the media directories for the file index, 0 to disable
+FILE_INDEX_INOTIFY = False                  # Keep the file index up to date with inotify between sweeps
+WORKER_LANE_REPORT_INTERVAL = 300           # Seconds between logging the utilisation of each task worker lane, 0 to disable
+WORKER_LANE_CONCURRENCY = {}                # Overrides the concurrency of task worker lanes by lane name
+WORKER_LANE_PROCESSES = ()                  # Names of task worker lanes to run in processes rather than threads
+WORKER_MAX_TASKS = 0                        # Maximum number of tasks the task worker runs at once over all lanes, 0 for no limit
+
+
+# Lanes of the process-lanes task worker, each runs its task types with its own
+# concurrency and optionally in processes. Tasks not in any lane run in the
+# "default" lane, which is a lane with no tasks listed. With one worker in each
+# lane up to 5 tasks run at once, set WORKER_MAX_TASKS to limit this
+WORKER_LANES = {
+    'index': {
+        'tasks': (
+            'sync.tasks.index_source_task',
+            'sync.tasks.check_source_directory_exists',
+            'sync.tasks.update_source_media',
+            'sync.tasks.delete_source',
+        ),
+        'concurrency': 1,
+    },
+    'metadata': {
+        'tasks': (
+            'sync.tasks.download_media_metadata',
+            'sync.tasks.download_media_metadata_batch',
+        ),
+        'concurrency': 1,
+    },
+    'thumbnails': {
+        'tasks': ('sync.tasks.download_media_thumbnail',),
+        'concurrency': 1,
+        'processes': False,
+    },
+    'downloads': {
+        'tasks': ('sync.tasks.download_media',),
+        'concurrency': 1,
+    },
+    'default': {
+        'tasks': (),
+        'concurrency': 1,
+    },
+}
 
 
 SOURCES_PER_PAGE = 100
@@ -167,6 +225,22 @@ COOKIES_FILE = CONFIG_BASE_DIR / 'cookies.txt'
 MEDIA_FORMATSTR_DEFAULT = '{yyyy_mm_dd}_{source}_{title}_{key}_{format}.{ext}'
 
 
+MEDIA_METADATA_COMPRESSION = 'zlib'     # Codec to compress stored metadata with, 'zlib', 'zstd' or '' for none
+MEDIA_METADATA_SLIM = True              # Remove transient data from metadata before saving it
+# Top level metadata keys removed before saving, fields the media uses are always kept
+MEDIA_METADATA_DROP_KEYS = (
+    'automatic_captions', 'subtitles', 'requested_subtitles', 'requested_formats',
+    'requested_downloads', 'thumbnails', 'http_headers', 'fragments', 'url',
+    'manifest_url', 'heatmap', 'annotations', 'formats_table', '_format_sort_fields',
+)
+# Keys kept in each available format, keys required to match formats are always kept
+MEDIA_METADATA_FORMAT_KEYS = (
+    'format_id', 'format', 'format_note', 'ext', 'acodec', 'vcodec', 'abr', 'asr',
+    'vbr', 'tbr', 'fps', 'height', 'width', 'resolution', 'dynamic_range',
+    'filesize', 'filesize_approx', 'protocol', 'language',
+)
+
+
 try:
     from .local_settings import *
 except ImportError as e: